@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+"""Descriptor wrappers against cached descriptor snapshots.
+
+Usage: bench_descriptors.py [devices] [rounds]
+
+Builds usb_device structures in memory (2 configurations, 3 interfaces,
+2 alternate settings, 4 endpoints each), so no libusb is loaded, and
+times a full walk of every descriptor field through the property
+wrappers and through pylibusb.snapshot().
+"""
+import ctypes, os, sys, time
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+import pylibusb.pylibusb as usb
+
+def makeDevice(n, keep):
+    dev = usb.usb_device()
+    dev.devnum = n
+    dev.descriptor.bLength = 18
+    dev.descriptor.idVendor = 0x1949
+    dev.descriptor.idProduct = 0x0004
+    dev.descriptor.bNumConfigurations = 2
+    configs = (usb.usb_config_descriptor*2)()
+    for c in range(2):
+        configs[c].bNumInterfaces = 3
+        configs[c].bConfigurationValue = c+1
+        interfaces = (usb.usb_interface*3)()
+        for i in range(3):
+            alts = (usb.usb_interface_descriptor*2)()
+            for a in range(2):
+                alts[a].bInterfaceNumber = i
+                alts[a].bAlternateSetting = a
+                alts[a].bNumEndpoints = 4
+                endpoints = (usb.usb_endpoint_descriptor*4)()
+                for e in range(4):
+                    endpoints[e].bEndpointAddress = 0x81+e
+                    endpoints[e].wMaxPacketSize = 512
+                alts[a].endpoint = ctypes.cast(endpoints, usb.usb_endpoint_descriptor_p)
+                keep.append(endpoints)
+            interfaces[i].altsetting = ctypes.cast(alts, usb.usb_interface_descriptor_p)
+            interfaces[i].num_altsetting = 2
+            keep.append(alts)
+        configs[c].interface = ctypes.cast(interfaces, usb.usb_interface_p)
+        keep.append(interfaces)
+    dev.config = ctypes.cast(configs, usb.usb_config_descriptor_p)
+    keep.extend([configs, dev])
+    return usb._device(ctypes.pointer(dev))
+
+def walk(dev):
+    total = dev.descriptor.idVendor+dev.descriptor.idProduct
+    for config in dev.config:
+        total += config.bConfigurationValue
+        for interface in config.interface:
+            for alt in interface.altsetting:
+                total += alt.bInterfaceNumber+alt.bAlternateSetting
+                for endpoint in alt.endpoint:
+                    total += endpoint.bEndpointAddress+endpoint.wMaxPacketSize
+    return total
+
+def main():
+    args = [int(arg) for arg in sys.argv[1:]]
+    devices, rounds = (args+[200, 10][len(args):])[:2]
+    keep = []
+    devs = [makeDevice(i, keep) for i in range(devices)]
+
+    start = time.time()
+    for r in range(rounds):
+        expected = [walk(dev) for dev in devs]
+    wrappers = (time.time()-start)/rounds
+
+    start = time.time()
+    first = [walk(usb.snapshot(dev)) for dev in devs]
+    build = time.time()-start
+
+    start = time.time()
+    for r in range(rounds):
+        result = [walk(usb.snapshot(dev)) for dev in devs]
+    cached = (time.time()-start)/rounds
+
+    if result != expected or first != expected:
+        sys.stderr.write("ERR snapshots differ from the wrappers\n")
+        sys.exit(1)
+    print "devices:        %d"%devices
+    print "wrappers:       %8.2fms per walk"%(wrappers*1e3)
+    print "snapshot build: %8.2fms"%(build*1e3)
+    print "snapshot:       %8.2fms per walk (%.1fx)"%(cached*1e3, wrappers/cached)
+
+if __name__ == "__main__":
+    main()
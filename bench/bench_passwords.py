@@ -0,0 +1,34 @@
+#!/usr/bin/env python
+"""Throughput of getKindlePasswords (multimd5) against getKindlePassword.
+
+Usage: bench_passwords.py [number of serials]
+"""
+import os, sys, time
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+import kdt
+
+def main():
+    if len(sys.argv) > 1:
+        n = int(sys.argv[1])
+    else:
+        n = 1000000
+    serials = ['B00%X%011d'%(i%16, i) for i in range(n)]
+
+    start = time.time()
+    scalar = [kdt.getKindlePassword(serial) for serial in serials]
+    scalar_time = time.time()-start
+
+    start = time.time()
+    batch = kdt.getKindlePasswords(serials)
+    batch_time = time.time()-start
+
+    if scalar != batch:
+        sys.stderr.write("ERR getKindlePasswords does not match getKindlePassword\n")
+        sys.exit(1)
+    print "serials:  %d"%n
+    print "scalar:   %.3fs  %10.0f serials/s"%(scalar_time, n/scalar_time)
+    print "batch:    %.3fs  %10.0f serials/s"%(batch_time, n/batch_time)
+    print "speedup:  %.1fx"%(scalar_time/batch_time)
+
+if __name__ == "__main__":
+    main()
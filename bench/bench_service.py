@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+"""Query latency of the kdt.py --serve socket under concurrent clients.
+
+Usage: bench_service.py [clients] [queries] [devices]
+
+Starts a service.Server in a child process with a table of the given
+number of devices (no USB involved), then lets clients processes each
+send queries list requests one after another, plus one batched lookup of
+every device. Prints latency percentiles over all requests; the exit
+status is 1 when the median is above a millisecond.
+"""
+import multiprocessing, os, shutil, subprocess, sys, tempfile, time
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+def serve(path, devices):
+    import kdt, service
+    server = service.Server(service.listen(path), kdt.describeSerials)
+    server.update(['B00%X%011d'%(i%16, i) for i in range(devices)])
+    server.run()
+
+def client((path, queries, devices)):
+    import service
+    connection = service.Connection(path)
+    times = []
+    for i in range(queries):
+        start = time.time()
+        found = connection.list()
+        times.append(time.time()-start)
+        if len(found) != devices:
+            raise RuntimeError('listed %d devices, expected %d'%(len(found), devices))
+    start = time.time()
+    connection.lookup([device['serial'] for device in found])
+    batch = time.time()-start
+    connection.close()
+    return times, batch
+
+def percentile(values, p):
+    return values[min(len(values)-1, int(len(values)*p))]
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == '--serve':
+        serve(sys.argv[2], int(sys.argv[3]))
+        return
+    args = [int(arg) for arg in sys.argv[1:]]
+    clients, queries, devices = (args+[8, 1000, 16][len(args):])[:3]
+
+    directory = tempfile.mkdtemp(prefix='kdt-service-')
+    path = os.path.join(directory, 'kdt.sock')
+    server = subprocess.Popen([sys.executable, os.path.abspath(__file__), '--serve', path, str(devices)])
+    try:
+        for i in range(100):
+            if os.path.exists(path):
+                break
+            time.sleep(0.05)
+        else:
+            sys.stderr.write("ERR service did not start\n")
+            sys.exit(1)
+        pool = multiprocessing.Pool(clients)
+        start = time.time()
+        results = pool.map(client, [(path, queries, devices)]*clients)
+        elapsed = time.time()-start
+        pool.close()
+    finally:
+        server.terminate()
+        shutil.rmtree(directory)
+
+    times = sorted(t for result in results for t in result[0])
+    batches = sorted(result[1] for result in results)
+    print "clients:    %d x %d list requests, %d devices"%(clients, queries, devices)
+    print "throughput: %8.0f requests/s"%(len(times)/elapsed)
+    print "p50:        %8.3fms"%(percentile(times, 0.5)*1e3)
+    print "p99:        %8.3fms"%(percentile(times, 0.99)*1e3)
+    print "max:        %8.3fms"%(times[-1]*1e3)
+    print "lookup:     %8.3fms median for a batch of %d"%(percentile(batches, 0.5)*1e3, devices)
+    if percentile(times, 0.5) > 1e-3:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+"""Read latency and consistency of the kdt.py --publish device table.
+
+Usage: bench_sharedtable.py [readers] [reads] [devices] [writers]
+
+writers processes republish a table of the given number of devices as
+fast as they can, every row tagged with the writer and generation it
+belongs to, while readers processes each take reads snapshots. Prints
+read latency percentiles and exits with status 1 if any snapshot mixed
+rows of two updates or the median read took more than 100 microseconds.
+"""
+import multiprocessing, os, shutil, sys, tempfile, time
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+def rows(tag, devices):
+    return [('B00%X%011d'%(i%16, i), 'Kindle %s'%tag, tag) for i in range(devices)]
+
+def writer(path, devices, number, stop):
+    import sharedtable
+    table = sharedtable.TableWriter(path, devices)
+    generation = 0
+    while not stop.is_set():
+        generation += 1
+        table.publish(rows('%d-%d'%(number, generation), devices))
+    table.close()
+
+def reader((path, reads)):
+    import sharedtable
+    table = sharedtable.TableReader(path)
+    times = []
+    torn = 0
+    for i in range(reads):
+        start = time.time()
+        generation, updated, snapshot = table.read()
+        times.append(time.time()-start)
+        if len(set(password for serial, model, password in snapshot)) > 1:
+            torn += 1
+    table.close()
+    return times, torn
+
+def percentile(values, p):
+    return values[min(len(values)-1, int(len(values)*p))]
+
+def main():
+    args = [int(arg) for arg in sys.argv[1:]]
+    readers, reads, devices, writers = (args+[4, 20000, 16, 2][len(args):])[:4]
+
+    import sharedtable
+    directory = tempfile.mkdtemp(prefix='kdt-table-')
+    path = os.path.join(directory, 'kdt.table')
+    sharedtable.TableWriter(path, devices).close()
+    stop = multiprocessing.Event()
+    processes = [multiprocessing.Process(target=writer, args=(path, devices, number, stop))
+                 for number in range(writers)]
+    for process in processes:
+        process.start()
+    try:
+        pool = multiprocessing.Pool(readers)
+        start = time.time()
+        results = pool.map(reader, [(path, reads)]*readers)
+        elapsed = time.time()-start
+        pool.close()
+        generations = sharedtable.TableReader(path).generation()
+    finally:
+        stop.set()
+        for process in processes:
+            process.join()
+        shutil.rmtree(directory)
+
+    times = sorted(t for result in results for t in result[0])
+    torn = sum(result[1] for result in results)
+    print "readers:    %d x %d reads, %d devices"%(readers, reads, devices)
+    print "throughput: %8.0f reads/s while %d writers published %d updates"%(
+        len(times)/elapsed, writers, generations)
+    print "p50:        %8.1fus"%(percentile(times, 0.5)*1e6)
+    print "p99:        %8.1fus"%(percentile(times, 0.99)*1e6)
+    print "max:        %8.1fus"%(times[-1]*1e6)
+    print "torn:       %8d"%torn
+    if torn or percentile(times, 0.5) > 1e-4:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,359 @@
+#!/usr/bin/env python
+"""pylibusb and kdt.py against a simulated libusb, no hardware needed.
+
+Usage: bench_simusb.py [options]
+
+Compiles simusb.c and simusb1.c (with $CC, default cc) into a temporary
+directory and loads them in place of the real libusb-0.1 and libusb-1.0.
+Each case runs in a fresh interpreter because the simulated bus layout is
+read from the SIMUSB_* environment variables once per process (see
+simusb.c; simusb1.c reads the same ones):
+
+  enumerate    walking get_busses() and find() over 8 buses of 32 devices
+  descriptors  full descriptor walks through the wrappers and snapshots,
+               and topology.export() of the same devices with its file size
+  strings      get_string_simple through usb.open and a HandlePool, and
+               get_strings, cold and cached
+  bulk         bulk_read, bulk_readinto and stream_bulk throughput
+  libusb1      the libusb-1.0 backend: rescans, get_strings through its
+               HandlePool, cold and cached, and device references all
+               given back once the device list and handles are gone
+  kdt          end-to-end kdt.py runs that find 8 Kindles over libusb-0.1
+               and over libusb-1.0 with 200us per control transfer
+  hub          the same with 32 Kindles at 5ms per control transfer, where
+               reading serials in parallel matters
+  open         32 Kindles at 20ms per usb_open, with 1 and 8 workers (8 must
+               be faster), and with the open of one device per bus hanging
+
+With --save the results become the baseline; otherwise they are compared
+with it and the exit status is 1 when a metric is worse than the baseline
+by more than --tolerance. Baselines are per machine and not checked in.
+"""
+import json, os, shutil, subprocess, sys, tempfile, time
+
+here = os.path.dirname(os.path.abspath(__file__))
+top = os.path.join(here, os.pardir)
+sys.path.insert(0, top)
+
+# metrics in these units are better when larger, all others when smaller
+HIGHER_IS_BETTER = ('MB/s',)
+
+def build(directory):
+    """compiles both simulators into directory, returns the libusb-0.1 one"""
+    for name in ('simusb', 'simusb1'):
+        subprocess.check_call([os.environ.get('CC', 'cc'), '-O2', '-shared', '-fPIC',
+                               '-o', os.path.join(directory, 'lib%s.so'%name),
+                               os.path.join(here, name+'.c')])
+    return os.path.join(directory, 'libsimusb.so')
+
+def simulated1(library):
+    """the libusb-1.0 simulator built next to library"""
+    return os.path.join(os.path.dirname(library), 'libsimusb1.so')
+
+def median(values):
+    values = sorted(values)
+    return values[len(values)//2]
+
+def timeit(func, rounds):
+    times = []
+    for i in range(rounds):
+        start = time.time()
+        func()
+        times.append(time.time()-start)
+    return median(times)
+
+def loadSimulated(library):
+    import pylibusb.pylibusb as usb
+    usb.c_libusb_shared_library = library
+    usb.init()
+    usb.find_busses()
+    usb.find_devices()
+    return usb
+
+def loadSimulated1(library):
+    import pylibusb.libusb1 as usb
+    usb.c_libusb1_shared_library = simulated1(library)
+    usb.init()
+    usb.find_busses()
+    usb.find_devices()
+    return usb
+
+# cases, run in the child process; each returns {metric: (value, unit)}
+
+def caseEnumerate(library, rounds):
+    usb = loadSimulated(library)
+    def walk():
+        n = 0
+        for bus in usb.get_busses():
+            for dev in bus.devices:
+                desc = dev.descriptor
+                if desc.idVendor == 0x1949 and desc.idProduct == 0x0004:
+                    n += 1
+        return n
+    def find():
+        return len(list(usb.find(idVendor=0x1949, idProduct=0x0004)))
+    assert walk() == find() == 8
+    return {'get_busses walk': (timeit(walk, rounds)*1e3, 'ms'),
+            'find': (timeit(find, rounds)*1e3, 'ms')}
+
+def caseDescriptors(library, rounds):
+    usb = loadSimulated(library)
+    devs = [dev for bus in usb.get_busses() for dev in bus.devices]
+    def walk(dev):
+        total = dev.descriptor.idVendor+dev.descriptor.idProduct
+        for config in dev.config:
+            total += config.bConfigurationValue
+            for interface in config.interface:
+                for alt in interface.altsetting:
+                    total += alt.bInterfaceNumber+alt.bAlternateSetting
+                    for endpoint in alt.endpoint:
+                        total += endpoint.bEndpointAddress+endpoint.wMaxPacketSize
+        return total
+    expected = [walk(dev) for dev in devs]
+    assert [walk(usb.snapshot(dev)) for dev in devs] == expected
+    import StringIO, pylibusb.topology
+    f = StringIO.StringIO()
+    pylibusb.topology.export().save(f)
+    return {'wrapper walk': (timeit(lambda: [walk(dev) for dev in devs], rounds)*1e3, 'ms'),
+            'snapshot walk': (timeit(lambda: [walk(usb.snapshot(dev)) for dev in devs], rounds)*1e3, 'ms'),
+            'topology export': (timeit(pylibusb.topology.export, rounds)*1e3, 'ms'),
+            'topology file': (len(f.getvalue())/1024.0, 'KiB')}
+
+def caseStrings(library, rounds):
+    usb = loadSimulated(library)
+    devs = list(usb.find(idVendor=0x1949, idProduct=0x0004))
+    calls = len(devs)*3
+    def opened():
+        for dev in devs:
+            handle = usb.open(dev)
+            for index in (1, 2, 3):
+                usb.get_string_simple(handle, index)
+            usb.close(handle)
+    pool = usb.HandlePool(max_open=len(devs))
+    def pooled():
+        for dev in devs:
+            with pool.acquire(dev) as handle:
+                for index in (1, 2, 3):
+                    handle.get_string_simple(index)
+    def batched():
+        for dev in devs:
+            with pool.acquire(dev) as handle:
+                handle.get_strings((1, 2, 3))
+    def cold():
+        usb._string_cache.clear()
+        batched()
+    try:
+        return {'get_string_simple open/close': (timeit(opened, rounds)/calls*1e6, 'us'),
+                'get_string_simple pooled': (timeit(pooled, rounds)/calls*1e6, 'us'),
+                'get_strings': (timeit(cold, rounds)/calls*1e6, 'us'),
+                'get_strings cached': (timeit(batched, rounds)/calls*1e6, 'us')}
+    finally:
+        pool.close()
+
+def caseBulk(library, rounds):
+    import ctypes
+    usb = loadSimulated(library)
+    dev = usb.find(idVendor=0x1949, idProduct=0x0004).next()
+    handle = usb.open(dev)
+    chunk, count = 65536, 256
+    megabytes = chunk*count/1e6
+    buf = ctypes.create_string_buffer(chunk)
+    target = bytearray(chunk)
+    def read():
+        for i in range(count):
+            usb.bulk_read(handle, 0x81, buf, 1000)
+    def readinto():
+        for i in range(count):
+            usb.bulk_readinto(handle, 0x81, target, 1000)
+    def stream():
+        for data in usb.stream_bulk(handle, 0x81, chunk, total=chunk*count):
+            pass
+    try:
+        return {'bulk_read': (megabytes/timeit(read, rounds), 'MB/s'),
+                'bulk_readinto': (megabytes/timeit(readinto, rounds), 'MB/s'),
+                'stream_bulk': (megabytes/timeit(stream, rounds), 'MB/s')}
+    finally:
+        usb.close(handle)
+
+def caseLibusb1(library, rounds):
+    import ctypes, gc
+    usb = loadSimulated1(library)
+    def counter(name):
+        return ctypes.c_long.in_dll(usb._raw_libusb1, name).value
+    def rescan():
+        usb.find_busses()
+        usb.find_devices()
+        return list(usb.find(idVendor=0x1949, idProduct=0x0004))
+    lists = counter('simusb1_device_lists')
+    devs = rescan()
+    assert len(devs) == 8
+    assert counter('simusb1_device_lists') == lists+1, 'find() fetched the device list again'
+    pool = usb.HandlePool(max_open=len(devs))
+    expected = ['B006%04d%08d'%key for key in map(pool.key, devs)]
+    def batched():
+        serials = []
+        for dev in devs:
+            with pool.acquire(dev) as handle:
+                serials.append(handle.get_strings((1, 2, 3))[2])
+        return serials
+    def cold():
+        usb._string_cache.clear()
+        return batched()
+    calls = len(devs)*3
+    try:
+        metrics = {'libusb1 rescan': (timeit(rescan, rounds)*1e3, 'ms'),
+                   'libusb1 get_strings': (timeit(cold, rounds)/calls*1e6, 'us'),
+                   'libusb1 get_strings cached': (timeit(batched, rounds)/calls*1e6, 'us')}
+        # devs come from the first scan, several rescans ago
+        assert cold() == expected
+    finally:
+        pool.close()
+    del devs[:]
+    usb._device_list.clear()
+    gc.collect()
+    refs = counter('simusb1_device_refs')
+    assert refs == 0, '%d device references not given back'%refs
+    return metrics
+
+# stands in for "python kdt.py": dbus is hidden so UDisks fails fast as on
+# a host without it, and sysfs points nowhere, leaving libusb
+KDT_SCRIPT = """
+import sys
+sys.path.insert(0, %r)
+sys.modules['dbus'] = None
+import pylibusb.pylibusb, pylibusb.libusb1
+pylibusb.pylibusb.c_libusb_shared_library = %r
+pylibusb.libusb1.c_libusb1_shared_library = %r
+import kdt
+kdt.main(['--sysfs', '/nonexistent']+%r)
+"""
+
+def runKdt(library, rounds, kindles, args=(), settings={}, backend='0.1'):
+    script = KDT_SCRIPT%(top, library, simulated1(library), list(args))
+    env = dict(os.environ, PYLIBUSB_BACKEND=backend)
+    env.update((key, str(value)) for key, value in settings.items())
+    devnull = open(os.devnull, 'w')
+    times = []
+    try:
+        for i in range(rounds):
+            start = time.time()
+            output = subprocess.Popen([sys.executable, '-c', script], env=env,
+                                      stdout=subprocess.PIPE, stderr=devnull).communicate()[0]
+            times.append(time.time()-start)
+            if output.count('Serial:') != kindles:
+                raise RuntimeError('kdt.py found %d Kindles, expected %d'%(output.count('Serial:'), kindles))
+    finally:
+        devnull.close()
+    return median(times)
+
+def caseKdt(library, rounds):
+    return {'kdt.py run': (runKdt(library, rounds, 8)*1e3, 'ms'),
+            'kdt.py run, libusb-1.0': (runKdt(library, rounds, 8, backend='1.0')*1e3, 'ms')}
+
+def caseHub(library, rounds):
+    return {'kdt.py run, 32 Kindles': (runKdt(library, rounds, 32)*1e3, 'ms'),
+            'kdt.py run, 32 Kindles, libusb-1.0': (runKdt(library, rounds, 32, backend='1.0')*1e3, 'ms')}
+
+def caseOpen(library, rounds):
+    serial = runKdt(library, rounds, 32, ['--workers', '1'])
+    parallel = runKdt(library, rounds, 32, ['--workers', '8'])
+    if parallel >= serial:
+        raise RuntimeError('8 workers took %.3fs, 1 worker %.3fs'%(parallel, serial))
+    # devnum 1 of both buses never opens; the other 30 are still read
+    hung = runKdt(library, rounds, 30, ['--device-timeout', '0.5'], {'SIMUSB_OPEN_HANG': 1})
+    return {'kdt.py run, slow open, 1 worker': (serial*1e3, 'ms'),
+            'kdt.py run, slow open, 8 workers': (parallel*1e3, 'ms'),
+            'kdt.py run, hung open': (hung*1e3, 'ms')}
+
+CASES = [
+    ('enumerate', caseEnumerate, {'SIMUSB_BUSSES': 8, 'SIMUSB_DEVICES': 32}),
+    ('descriptors', caseDescriptors, {'SIMUSB_BUSSES': 2, 'SIMUSB_DEVICES': 32, 'SIMUSB_CONFIGS': 2,
+                                      'SIMUSB_INTERFACES': 3, 'SIMUSB_ENDPOINTS': 4}),
+    ('strings', caseStrings, {'SIMUSB_BUSSES': 1, 'SIMUSB_DEVICES': 8, 'SIMUSB_CONTROL_US': 100}),
+    ('bulk', caseBulk, {'SIMUSB_BUSSES': 1, 'SIMUSB_DEVICES': 1, 'SIMUSB_KINDLES': 1}),
+    ('libusb1', caseLibusb1, {'SIMUSB_BUSSES': 2, 'SIMUSB_DEVICES': 32, 'SIMUSB_CONTROL_US': 100}),
+    ('kdt', caseKdt, {'SIMUSB_CONTROL_US': 200}),
+    ('hub', caseHub, {'SIMUSB_BUSSES': 2, 'SIMUSB_KINDLES': 32, 'SIMUSB_CONTROL_US': 5000}),
+    ('open', caseOpen, {'SIMUSB_BUSSES': 2, 'SIMUSB_KINDLES': 32, 'SIMUSB_OPEN_US': 20000}),
+]
+
+def runCase(name, library, rounds):
+    """Runs one case in a child process and returns its metrics"""
+    settings = [case[2] for case in CASES if case[0] == name][0]
+    env = dict(os.environ)
+    for key in [key for key in env if key.startswith('SIMUSB_')]:
+        del env[key]
+    env.update((key, str(value)) for key, value in settings.items())
+    output = subprocess.Popen([sys.executable, os.path.abspath(__file__), '--case', name,
+                               '--rounds', str(rounds), '--library', library],
+                              env=env, stdout=subprocess.PIPE).communicate()[0]
+    if not output:
+        raise RuntimeError('case %s failed'%name)
+    return json.loads(output)
+
+def compare(results, baseline, tolerance):
+    """Prints every metric next to its baseline; returns the regressions"""
+    regressions = []
+    for name, (value, unit) in sorted(results.items()):
+        line = "%-34s %10.2f %-4s"%(name, value, unit)
+        if name in baseline:
+            old = baseline[name][0]
+            if unit in HIGHER_IS_BETTER:
+                change = old/value-1
+            else:
+                change = value/old-1
+            line += "  baseline %10.2f  %+6.1f%%"%(old, change*100)
+            if change > tolerance:
+                line += "  REGRESSION"
+                regressions.append(name)
+        print line
+    return regressions
+
+def main():
+    from optparse import OptionParser, SUPPRESS_HELP
+    parser = OptionParser(usage="%prog [options]")
+    parser.add_option("--rounds", type="int", default=11,
+                      help="repetitions per measurement, the median is reported (default: %default)")
+    parser.add_option("--only", metavar="CASES",
+                      help="comma separated cases to run (default: all)")
+    parser.add_option("--baseline", metavar="FILE", default=os.path.join(here, 'simusb_baseline.json'),
+                      help="baseline results (default: %default)")
+    parser.add_option("--save", action="store_true", default=False,
+                      help="store the results as the new baseline")
+    parser.add_option("--tolerance", type="float", default=0.25,
+                      help="allowed slowdown against the baseline (default: %default)")
+    parser.add_option("--case", help=SUPPRESS_HELP)
+    parser.add_option("--library", help=SUPPRESS_HELP)
+    options, args = parser.parse_args()
+
+    if options.case:
+        func = [case[1] for case in CASES if case[0] == options.case][0]
+        print json.dumps(func(options.library, options.rounds))
+        return
+
+    names = [name for name, func, settings in CASES]
+    if options.only:
+        names = options.only.split(',')
+    directory = tempfile.mkdtemp(prefix='simusb-')
+    try:
+        library = build(directory)
+        results = {}
+        for name in names:
+            results.update(runCase(name, library, options.rounds))
+    finally:
+        shutil.rmtree(directory)
+
+    baseline = {}
+    if os.path.exists(options.baseline):
+        baseline = json.load(open(options.baseline))
+    regressions = compare(results, baseline, options.tolerance)
+    if options.save:
+        baseline.update(results)
+        f = open(options.baseline, 'w')
+        json.dump(baseline, f, indent=1, sort_keys=True)
+        f.close()
+    elif regressions:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+#!/usr/bin/env python
+"""Cold start latency of pylibusb and kdt.py.
+
+Usage: bench_startup.py [runs] [target_ms]
+
+Every measurement starts a fresh interpreter. Times are medians with the
+bare interpreter start-up subtracted; the exit status is 1 when the
+end-to-end kdt.py run is slower than target_ms (default 50).
+"""
+import os, shutil, subprocess, sys, tempfile, time
+from bench_sysfs import makeTree
+
+here = os.path.dirname(os.path.abspath(__file__))
+top = os.path.join(here, os.pardir)
+
+def median(values):
+    values = sorted(values)
+    return values[len(values)//2]
+
+def timeCommand(args, runs):
+    devnull = open(os.devnull, 'w')
+    times = []
+    for i in range(runs):
+        start = time.time()
+        subprocess.call(args, cwd=top, stdout=devnull, stderr=devnull)
+        times.append(time.time()-start)
+    devnull.close()
+    return median(times)
+
+def main():
+    runs = 21
+    target = 50.0
+    if len(sys.argv) > 1:
+        runs = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        target = float(sys.argv[2])
+    root = tempfile.mkdtemp(prefix='kdt-startup-')
+    try:
+        makeTree(root, 1, 1)
+        base = timeCommand([sys.executable, '-c', 'pass'], runs)
+        imp = timeCommand([sys.executable, '-c', 'import pylibusb'], runs)-base
+        kdt = timeCommand([sys.executable, 'kdt.py', '--sysfs', root], runs)-base
+    finally:
+        shutil.rmtree(root)
+    print "interpreter:     %6.1fms"%(base*1e3)
+    print "import pylibusb: %6.1fms"%(imp*1e3)
+    print "kdt.py:          %6.1fms (target %.1fms)"%(kdt*1e3, target)
+    if kdt*1e3 > target:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+"""Times sysfs discovery on a fake tree.
+
+Usage: bench_sysfs.py [devices] [kindles] [rounds]
+
+Builds a temporary sysfs tree with the given number of USB devices (each
+with one interface entry), of which the given number are Kindles, and
+times kdt.findSysfsSerials over it.
+"""
+import os, shutil, sys, tempfile, time
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+import kdt
+
+def write(path, value):
+    f = open(path, 'w')
+    f.write(value+'\n')
+    f.close()
+
+def makeTree(root, devices, kindles):
+    links = os.path.join(root, 'bus', 'usb', 'devices')
+    os.makedirs(links)
+    for i in range(devices):
+        name = '%d-%d'%(i//100+1, i%100+1)
+        path = os.path.join(root, 'devices', 'pci0000:00', 'usb%d'%(i//100+1), name)
+        os.makedirs(os.path.join(path, name+':1.0'))
+        if i < kindles:
+            write(os.path.join(path, 'idVendor'), '1949')
+            write(os.path.join(path, 'idProduct'), '0004')
+        else:
+            write(os.path.join(path, 'idVendor'), '046d')
+            write(os.path.join(path, 'idProduct'), 'c52b')
+        write(os.path.join(path, 'serial'), 'B00%X%011d'%(i%16, i))
+        os.symlink(os.path.relpath(path, links), os.path.join(links, name))
+        os.symlink(os.path.relpath(os.path.join(path, name+':1.0'), links),
+                   os.path.join(links, name+':1.0'))
+
+def main():
+    args = [int(arg) for arg in sys.argv[1:]]
+    devices, kindles, rounds = (args+[5000, 50, 20][len(args):])[:3]
+    root = tempfile.mkdtemp(prefix='kdt-sysfs-')
+    try:
+        makeTree(root, devices, kindles)
+        found = kdt.findSysfsSerials(root)
+        if len(found) != kindles:
+            sys.stderr.write("ERR found %d Kindles, expected %d\n"%(len(found), kindles))
+            sys.exit(1)
+        start = time.time()
+        for i in range(rounds):
+            kdt.findSysfsSerials(root)
+        elapsed = (time.time()-start)/rounds
+        print "devices:  %d (%d Kindles)"%(devices, kindles)
+        print "scan:     %.2fms  %.2fus/device"%(elapsed*1e3, elapsed*1e6/devices)
+    finally:
+        shutil.rmtree(root)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,194 @@
+#!/usr/bin/env python
+"""pylibusb.libusb1 asynchronous transfers against a simulated libusb-1.0,
+no hardware needed.
+
+Usage: bench_transfers.py [options]
+
+Compiles simusb1.c (with $CC, default cc) into a temporary directory and
+loads it in place of libusb-1.0. The simulated bus takes --transfer-us per
+transfer and starts each one --latency-us after its submission at the
+earliest (see simusb1.c), so only a deep enough queue keeps it busy.
+
+  depth    IN throughput of a TransferQueue driven by EventLoop at depths
+           1 to 16, as a share of the simulated bus rate; the reads must
+           arrive complete and in bus order
+  write    OUT writes beyond the queue depth are held back and all complete
+  attach   Context.attach() handing the pollfds to a caller's own select()
+           loop, and detach() taking them back
+  errors   a callback that raises is counted, the queue keeps reading and
+           check() raises the exception
+  stop     stop() cancels every transfer in flight and close() succeeds
+
+The exit status is 1 when a check fails or a queue of depth 4 or more
+reaches less than --min-share of the bus rate.
+"""
+import os, select, shutil, struct, subprocess, sys, tempfile, time
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(here, os.pardir))
+
+DEPTHS = (1, 2, 4, 8, 16)
+
+def build(directory):
+    library = os.path.join(directory, 'libsimusb1.so')
+    subprocess.check_call([os.environ.get('CC', 'cc'), '-O2', '-shared', '-fPIC',
+                           '-o', library, os.path.join(here, 'simusb1.c')])
+    return library
+
+class Reader(object):
+    """collects the bus numbers of count reads, then stops its queue"""
+    def __init__(self, count, fail_at=None):
+        self.count = count
+        self.fail_at = fail_at
+        self.numbers = []
+        self.queue = None
+        self.finished = None
+
+    def __call__(self, data, status):
+        if self.finished is not None:
+            return # completed in the batch that finished, too late to cancel
+        self.numbers.append(struct.unpack('<I', data[:4])[0])
+        if len(self.numbers) == self.count:
+            self.finished = time.time()
+            self.queue.stop()
+        if len(self.numbers) == self.fail_at:
+            raise ValueError('callback failure %d'%self.fail_at)
+
+    def inOrder(self):
+        first = self.numbers[0]
+        return self.numbers == range(first, first+len(self.numbers))
+
+def read(libusb1, context, loop, handle, size, depth, count, fail_at=None):
+    reader = Reader(count, fail_at)
+    queue = reader.queue = libusb1.TransferQueue(handle, 0x81, reader, size, depth)
+    start = time.time()
+    queue.start()
+    loop.run(until=lambda: not queue.running and not queue.in_flight, timeout=60)
+    return queue, reader, start
+
+def checkDepth(libusb1, context, loop, handle, options):
+    results = []
+    rate = options.size/(options.transfer_us*1e-6)/1e6
+    for depth in DEPTHS:
+        queue, reader, start = read(libusb1, context, loop, handle, options.size, depth, options.transfers)
+        queue.close()
+        if len(reader.numbers) != options.transfers or not reader.inOrder():
+            return False, "depth %d: reads lost or out of order"%depth
+        achieved = options.size*options.transfers/(reader.finished-start)/1e6
+        results.append((depth, achieved))
+        print "%-34s %10.2f MB/s  %5.1f%% of %.2f MB/s"%("read, depth %d"%depth, achieved,
+                                                        achieved/rate*100, rate)
+    short = [depth for depth, achieved in results if depth >= 4 and achieved < rate*options.min_share]
+    if short:
+        return False, "depths %s below %d%% of the bus rate"%(short, options.min_share*100)
+    return True, ""
+
+def checkWrite(libusb1, context, loop, handle, options):
+    done = []
+    queue = libusb1.TransferQueue(handle, 0x01, lambda actual, status: done.append(actual),
+                                  options.size, 4)
+    count = 32
+    for i in range(count):
+        queue.write('x'*options.size)
+    loop.run(until=lambda: len(done) == count, timeout=60)
+    queue.close()
+    if sum(done) != count*options.size or queue.errors:
+        return False, "%d of %d writes completed"%(len(done), count)
+    return True, "%d writes through a queue of 4"%count
+
+def checkAttach(libusb1, context, loop, handle, options):
+    loop.close()
+    readers = {}
+    context.attach(lambda fd, callback: readers.__setitem__(fd, callback),
+                   lambda fd: readers.pop(fd, None))
+    try:
+        if not readers:
+            return False, "attach() registered no file descriptors"
+        reader = Reader(options.transfers//10)
+        queue = reader.queue = libusb1.TransferQueue(handle, 0x81, reader, options.size, 8)
+        queue.start()
+        deadline = time.time()+60
+        while (queue.running or queue.in_flight) and time.time() < deadline:
+            ready = select.select(list(readers), [], [], 1.0)[0]
+            for fd in ready:
+                readers[fd]()
+        queue.close()
+        if len(reader.numbers) != reader.count or not reader.inOrder():
+            return False, "reads lost or out of order"
+    finally:
+        context.detach()
+    if readers:
+        return False, "detach() left file descriptors registered"
+    return True, "%d reads through select()"%reader.count
+
+def checkErrors(libusb1, context, loop, handle, options):
+    count = options.transfers//10
+    queue, reader, start = read(libusb1, context, loop, handle, options.size, 8, count, fail_at=3)
+    queue.close()
+    if len(reader.numbers) != count or queue.callback_errors != 1:
+        return False, "%d reads, %d callback errors"%(len(reader.numbers), queue.callback_errors)
+    try:
+        queue.check()
+    except ValueError:
+        pass
+    else:
+        return False, "check() did not raise"
+    return True, "reading went on after the failed callback"
+
+def checkStop(libusb1, context, loop, handle, options):
+    queue = libusb1.TransferQueue(handle, 0x81, lambda data, status: None, options.size, 16)
+    queue.start()
+    in_flight = queue.in_flight
+    queue.stop()
+    loop.run(until=lambda: not queue.in_flight, timeout=10)
+    if queue.in_flight:
+        return False, "%d transfers still in flight"%queue.in_flight
+    queue.close()
+    return True, "%d transfers cancelled"%in_flight
+
+CHECKS = [
+    ('depth', checkDepth),
+    ('write', checkWrite),
+    ('errors', checkErrors),
+    ('stop', checkStop),
+    ('attach', checkAttach),
+]
+
+def main():
+    from optparse import OptionParser
+    parser = OptionParser(usage="%prog [options]")
+    parser.add_option("--transfers", type="int", default=2000,
+                      help="reads per queue depth (default: %default)")
+    parser.add_option("--size", type="int", default=16384,
+                      help="bytes per transfer (default: %default)")
+    parser.add_option("--transfer-us", type="int", default=200,
+                      help="bus time of one transfer in microseconds (default: %default)")
+    parser.add_option("--latency-us", type="int", default=500,
+                      help="time from submission to the earliest start on the bus (default: %default)")
+    parser.add_option("--min-share", type="float", default=0.9,
+                      help="share of the bus rate depths of 4 and more must reach (default: %default)")
+    options, args = parser.parse_args()
+
+    os.environ['SIMUSB1_TRANSFER_US'] = str(options.transfer_us)
+    os.environ['SIMUSB1_LATENCY_US'] = str(options.latency_us)
+    directory = tempfile.mkdtemp(prefix='simusb1-')
+    try:
+        import pylibusb.libusb1 as libusb1
+        libusb1.c_libusb1_shared_library = build(directory)
+        context = libusb1.Context()
+        handle = context.open_device_with_vid_pid(0x1949, 0x0004)
+        loop = libusb1.EventLoop(context)
+        failed = []
+        for name, check in CHECKS:
+            ok, message = check(libusb1, context, loop, handle, options)
+            print "%-34s %s %s"%(name, ok and "ok  " or "FAIL", message)
+            if not ok:
+                failed.append(name)
+        context.close()
+    finally:
+        shutil.rmtree(directory)
+    if failed:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+"""UDisks2 GetManagedObjects against the old per-device UDisks calls.
+
+Usage: bench_udisks.py [drives] [kindles] [rounds]
+
+Starts a private dbus-daemon and a stand-in service that answers both the
+org.freedesktop.UDisks and the org.freedesktop.UDisks2 APIs for the given
+number of drives, then times findUDisksSerials and findUDisks2Serials
+against it. Needs dbus-daemon, dbus-python and GLib bindings.
+"""
+import os, subprocess, sys, time
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+def serve(address, drives, kindles):
+    import dbus, dbus.service
+    from dbus.mainloop.glib import DBusGMainLoop
+    try:
+        from gi.repository import GLib as mainloop
+    except ImportError:
+        import gobject as mainloop
+    DBusGMainLoop(set_as_default=True)
+    bus = dbus.bus.BusConnection(address)
+
+    def vendor(i):
+        if i < kindles:
+            return 'Kindle'
+        return 'ATA'
+    def serial(i):
+        return 'B00%X%011d'%(i%16, i)
+
+    class UDisks2(dbus.service.Object):
+        @dbus.service.method('org.freedesktop.DBus.ObjectManager', out_signature='a{oa{sa{sv}}}')
+        def GetManagedObjects(self):
+            objects = {}
+            for i in range(drives):
+                objects[dbus.ObjectPath('/org/freedesktop/UDisks2/drives/drive%d'%i)] = {
+                    'org.freedesktop.UDisks2.Drive': {
+                        'Vendor': vendor(i), 'Model': 'Internal Storage', 'Serial': serial(i)}}
+            return objects
+
+    class UDisks(dbus.service.Object):
+        @dbus.service.method('org.freedesktop.UDisks', out_signature='ao')
+        def EnumerateDevices(self):
+            return [dbus.ObjectPath('/org/freedesktop/UDisks/devices/sd%d'%i) for i in range(drives)]
+
+    class Device(dbus.service.Object):
+        def __init__(self, conn, path, i):
+            dbus.service.Object.__init__(self, conn, path)
+            self.i = i
+        @dbus.service.method(dbus.PROPERTIES_IFACE, in_signature='ss', out_signature='v')
+        def Get(self, interface, name):
+            if name == 'DriveVendor':
+                return vendor(self.i)
+            elif name == 'DeviceIsDrive':
+                return True
+            elif name == 'DriveSerial':
+                return serial(self.i)
+            raise dbus.exceptions.DBusException('no property %s'%name)
+
+    names = [dbus.service.BusName('org.freedesktop.UDisks2', bus),
+             dbus.service.BusName('org.freedesktop.UDisks', bus)]
+    objects = [UDisks2(bus, '/org/freedesktop/UDisks2'), UDisks(bus, '/org/freedesktop/UDisks')]
+    for i in range(drives):
+        objects.append(Device(bus, '/org/freedesktop/UDisks/devices/sd%d'%i, i))
+    mainloop.MainLoop().run()
+
+def timeBackend(backend, bus, kindles, rounds):
+    found = list(backend(bus))
+    if len(found) != kindles:
+        sys.stderr.write("ERR %s found %d Kindles, expected %d\n"%(backend.__name__, len(found), kindles))
+        sys.exit(1)
+    start = time.time()
+    for i in range(rounds):
+        list(backend(bus))
+    return (time.time()-start)/rounds
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == '--serve':
+        serve(sys.argv[2], int(sys.argv[3]), int(sys.argv[4]))
+        return
+    import dbus
+    import kdt
+    args = [int(arg) for arg in sys.argv[1:]]
+    drives, kindles, rounds = (args+[500, 5, 5][len(args):])[:3]
+
+    daemon = subprocess.Popen(['dbus-daemon', '--session', '--nofork', '--print-address'],
+                              stdout=subprocess.PIPE)
+    server = None
+    try:
+        address = daemon.stdout.readline().strip()
+        server = subprocess.Popen([sys.executable, os.path.abspath(__file__), '--serve',
+                                   address, str(drives), str(kindles)])
+        bus = dbus.bus.BusConnection(address)
+        for i in range(100):
+            if bus.name_has_owner('org.freedesktop.UDisks') and\
+                    bus.name_has_owner('org.freedesktop.UDisks2'):
+                break
+            time.sleep(0.05)
+        else:
+            sys.stderr.write("ERR stand-in UDisks service did not start\n")
+            sys.exit(1)
+        old = timeBackend(kdt.findUDisksSerials, bus, kindles, rounds)
+        new = timeBackend(kdt.findUDisks2Serials, bus, kindles, rounds)
+    finally:
+        if server is not None:
+            server.terminate()
+        daemon.terminate()
+    print "drives:   %d (%d Kindles)"%(drives, kindles)
+    print "UDisks:   %8.2fms"%(old*1e3)
+    print "UDisks2:  %8.2fms"%(new*1e3)
+    print "speedup:  %.1fx"%(old/new)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,357 @@
+/* Simulated libusb-0.1 for the hardware-free benchmarks.
+ *
+ * Build: cc -O2 -shared -fPIC -o libsimusb.so simusb.c
+ *
+ * Presents the usb_bus/usb_device lists of the real library, filled in
+ * from environment variables read on the first usb_find_busses():
+ *
+ *   SIMUSB_BUSSES      number of buses (4)
+ *   SIMUSB_DEVICES     devices per bus (16)
+ *   SIMUSB_KINDLES     how many of all devices are Kindles (8)
+ *   SIMUSB_CONFIGS     configurations per device (1)
+ *   SIMUSB_INTERFACES  interfaces per configuration (2)
+ *   SIMUSB_ENDPOINTS   endpoints per interface (2)
+ *   SIMUSB_OPEN_US     latency of usb_open, in microseconds (0)
+ *   SIMUSB_OPEN_HANG   devnum whose usb_open never returns (0: none)
+ *   SIMUSB_CONTROL_US  latency of a control transfer (0)
+ *   SIMUSB_BULK_US     latency of a bulk or interrupt transfer (0)
+ *   SIMUSB_HANG        devnum whose control transfers never return (0: none)
+ *   SIMUSB_FAIL        devnum whose control transfers fail (0: none)
+ *
+ * Kindles report the serial B006<bus:4><devnum:8>. usb_get_string_simple
+ * costs two control transfers (LANGID table and string) as in libusb.
+ * Bulk reads fill the buffer with 1, 2, 3, ...; bulk writes return the
+ * number of bytes. Every control transfer is counted in
+ * simusb_control_transfers.
+ */
+#include <stdint.h>
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include <time.h>
+
+#define PATH_MAX 4096
+
+struct usb_endpoint_descriptor {
+    uint8_t bLength, bDescriptorType, bEndpointAddress, bmAttributes;
+    uint16_t wMaxPacketSize;
+    uint8_t bInterval, bRefresh, bSynchAddress;
+    unsigned char *extra;
+    int extralen;
+};
+
+struct usb_interface_descriptor {
+    uint8_t bLength, bDescriptorType, bInterfaceNumber, bAlternateSetting;
+    uint8_t bNumEndpoints, bInterfaceClass, bInterfaceSubClass, bInterfaceProtocol;
+    uint8_t iInterface;
+    struct usb_endpoint_descriptor *endpoint;
+    unsigned char *extra;
+    int extralen;
+};
+
+struct usb_interface {
+    struct usb_interface_descriptor *altsetting;
+    int num_altsetting;
+};
+
+struct usb_config_descriptor {
+    uint8_t bLength, bDescriptorType;
+    uint16_t wTotalLength;
+    uint8_t bNumInterfaces, bConfigurationValue, iConfiguration, bmAttributes, MaxPower;
+    struct usb_interface *interface;
+    unsigned char *extra;
+    int extralen;
+};
+
+struct usb_device_descriptor {
+    uint8_t bLength, bDescriptorType;
+    uint16_t bcdUSB;
+    uint8_t bDeviceClass, bDeviceSubClass, bDeviceProtocol, bMaxPacketSize0;
+    uint16_t idVendor, idProduct, bcdDevice;
+    uint8_t iManufacturer, iProduct, iSerialNumber, bNumConfigurations;
+} __attribute__((packed));
+
+struct usb_bus;
+
+struct usb_device {
+    struct usb_device *next, *prev;
+    char filename[PATH_MAX+1];
+    struct usb_bus *bus;
+    struct usb_device_descriptor descriptor;
+    struct usb_config_descriptor *config;
+    void *dev;
+    uint8_t devnum;
+    unsigned char num_children;
+    struct usb_device **children;
+};
+
+struct usb_bus {
+    struct usb_bus *next, *prev;
+    char dirname[PATH_MAX+1];
+    struct usb_device *devices;
+    uint32_t location;
+    struct usb_device *root_dev;
+};
+
+static struct usb_bus *busses;
+static long open_us, control_us, bulk_us, open_hang_devnum, hang_devnum, fail_devnum;
+long simusb_control_transfers;
+
+static long setting(const char *name, long fallback)
+{
+    const char *value = getenv(name);
+    return value ? atol(value) : fallback;
+}
+
+static void delay(long us)
+{
+    struct timespec ts;
+    if (us <= 0)
+        return;
+    ts.tv_sec = us/1000000;
+    ts.tv_nsec = (us%1000000)*1000;
+    nanosleep(&ts, NULL);
+}
+
+static struct usb_config_descriptor *make_configs(int configs, int interfaces, int endpoints)
+{
+    struct usb_config_descriptor *c = calloc(configs, sizeof *c);
+    int i, j, k;
+    for (i = 0; i < configs; i++) {
+        c[i].bLength = 9;
+        c[i].bDescriptorType = 2;
+        c[i].bNumInterfaces = interfaces;
+        c[i].bConfigurationValue = i+1;
+        c[i].bmAttributes = 0x80;
+        c[i].MaxPower = 250;
+        c[i].interface = calloc(interfaces, sizeof *c[i].interface);
+        for (j = 0; j < interfaces; j++) {
+            struct usb_interface_descriptor *alt = calloc(1, sizeof *alt);
+            alt->bLength = 9;
+            alt->bDescriptorType = 4;
+            alt->bInterfaceNumber = j;
+            alt->bNumEndpoints = endpoints;
+            alt->bInterfaceClass = 8;
+            alt->bInterfaceSubClass = 6;
+            alt->bInterfaceProtocol = 0x50;
+            alt->endpoint = calloc(endpoints, sizeof *alt->endpoint);
+            for (k = 0; k < endpoints; k++) {
+                alt->endpoint[k].bLength = 7;
+                alt->endpoint[k].bDescriptorType = 5;
+                alt->endpoint[k].bEndpointAddress = (k%2 ? 0x00 : 0x80)|(k+1);
+                alt->endpoint[k].bmAttributes = 2;
+                alt->endpoint[k].wMaxPacketSize = 512;
+            }
+            c[i].interface[j].altsetting = alt;
+            c[i].interface[j].num_altsetting = 1;
+        }
+    }
+    return c;
+}
+
+void usb_init(void)
+{
+}
+
+void usb_set_debug(int level)
+{
+}
+
+char *usb_strerror(void)
+{
+    return "simulated error";
+}
+
+int usb_find_busses(void)
+{
+    struct usb_bus *prev_bus = NULL;
+    int nbusses, ndevices, kindles, configs, interfaces, endpoints, b, d;
+    if (busses)
+        return 0;
+    nbusses = setting("SIMUSB_BUSSES", 4);
+    ndevices = setting("SIMUSB_DEVICES", 16);
+    kindles = setting("SIMUSB_KINDLES", 8);
+    configs = setting("SIMUSB_CONFIGS", 1);
+    interfaces = setting("SIMUSB_INTERFACES", 2);
+    endpoints = setting("SIMUSB_ENDPOINTS", 2);
+    open_us = setting("SIMUSB_OPEN_US", 0);
+    control_us = setting("SIMUSB_CONTROL_US", 0);
+    bulk_us = setting("SIMUSB_BULK_US", 0);
+    open_hang_devnum = setting("SIMUSB_OPEN_HANG", 0);
+    hang_devnum = setting("SIMUSB_HANG", 0);
+    fail_devnum = setting("SIMUSB_FAIL", 0);
+    for (b = 0; b < nbusses; b++) {
+        struct usb_bus *bus = calloc(1, sizeof *bus);
+        struct usb_device *prev_dev = NULL;
+        snprintf(bus->dirname, sizeof bus->dirname, "%03d", b+1);
+        bus->location = b+1;
+        if (prev_bus) {
+            prev_bus->next = bus;
+            bus->prev = prev_bus;
+        } else
+            busses = bus;
+        prev_bus = bus;
+        for (d = 0; d < ndevices; d++) {
+            struct usb_device *dev = calloc(1, sizeof *dev);
+            int kindle = b*ndevices+d < kindles;
+            dev->bus = bus;
+            dev->devnum = d+1;
+            snprintf(dev->filename, sizeof dev->filename, "%03d", d+1);
+            dev->descriptor.bLength = 18;
+            dev->descriptor.bDescriptorType = 1;
+            dev->descriptor.bcdUSB = 0x0200;
+            dev->descriptor.bMaxPacketSize0 = 64;
+            dev->descriptor.idVendor = kindle ? 0x1949 : 0x046d;
+            dev->descriptor.idProduct = kindle ? 0x0004 : 0xc52b;
+            dev->descriptor.bcdDevice = 0x0100;
+            dev->descriptor.iManufacturer = 1;
+            dev->descriptor.iProduct = 2;
+            dev->descriptor.iSerialNumber = 3;
+            dev->descriptor.bNumConfigurations = configs;
+            dev->config = make_configs(configs, interfaces, endpoints);
+            if (prev_dev) {
+                prev_dev->next = dev;
+                dev->prev = prev_dev;
+            } else
+                bus->devices = dev;
+            prev_dev = dev;
+        }
+    }
+    return nbusses;
+}
+
+int usb_find_devices(void)
+{
+    return 0;
+}
+
+struct usb_bus *usb_get_busses(void)
+{
+    return busses;
+}
+
+/* the handle is the device itself */
+void *usb_open(struct usb_device *dev)
+{
+    if (dev->devnum == open_hang_devnum)
+        for (;;)
+            delay(1000000);
+    delay(open_us);
+    return dev;
+}
+
+int usb_close(void *handle)
+{
+    return 0;
+}
+
+int usb_set_configuration(void *handle, int configuration)
+{
+    return 0;
+}
+
+int usb_claim_interface(void *handle, int interface)
+{
+    return 0;
+}
+
+struct usb_device *usb_device(void *handle)
+{
+    return handle;
+}
+
+static int control_transfer(struct usb_device *dev)
+{
+    simusb_control_transfers++;
+    if (dev->devnum == hang_devnum)
+        for (;;)
+            delay(1000000);
+    delay(control_us);
+    return dev->devnum == fail_devnum ? -5 : 0; /* -EIO */
+}
+
+static const char *string_for(struct usb_device *dev, int index, char *tmp, size_t size)
+{
+    int kindle = dev->descriptor.idVendor == 0x1949;
+    switch (index) {
+    case 1:
+        return kindle ? "Amazon" : "Logitech";
+    case 2:
+        return kindle ? "Amazon Kindle" : "USB Receiver";
+    case 3:
+        snprintf(tmp, size, "B006%04d%08d", atoi(dev->bus->dirname), dev->devnum);
+        return tmp;
+    }
+    return NULL;
+}
+
+/* raw descriptor: bLength, bDescriptorType 3, UTF-16LE */
+int usb_get_string(struct usb_device *dev, int index, int langid, char *buf, size_t buflen)
+{
+    char tmp[32];
+    const char *s;
+    size_t i, n;
+    if (control_transfer(dev) < 0)
+        return -5;
+    if (buflen < 2)
+        return -1;
+    if (index == 0) {
+        if (buflen < 4)
+            return -1;
+        buf[0] = 4;
+        buf[1] = 3;
+        buf[2] = 0x09;
+        buf[3] = 0x04;
+        return 4;
+    }
+    s = string_for(dev, index, tmp, sizeof tmp);
+    if (!s)
+        return -32; /* -EPIPE, the device stalls */
+    n = 2+2*strlen(s);
+    if (n > buflen)
+        n = buflen&~1;
+    buf[0] = n;
+    buf[1] = 3;
+    for (i = 2; i+1 < n; i += 2) {
+        buf[i] = s[i/2-1];
+        buf[i+1] = 0;
+    }
+    return n;
+}
+
+int usb_get_string_simple(struct usb_device *dev, int index, char *buf, size_t buflen)
+{
+    char tmp[32];
+    const char *s;
+    if (control_transfer(dev) < 0 || control_transfer(dev) < 0)
+        return -5;
+    s = string_for(dev, index, tmp, sizeof tmp);
+    if (!s)
+        return -32;
+    return snprintf(buf, buflen, "%s", s);
+}
+
+int usb_bulk_read(void *handle, int ep, char *bytes, int size, int timeout)
+{
+    int i;
+    delay(bulk_us);
+    for (i = 0; i < size; i++)
+        bytes[i] = (char)(i+1);
+    return size;
+}
+
+int usb_bulk_write(void *handle, int ep, char *bytes, int size, int timeout)
+{
+    delay(bulk_us);
+    return size;
+}
+
+int usb_interrupt_read(void *handle, int ep, char *bytes, int size, int timeout)
+{
+    return usb_bulk_read(handle, ep, bytes, size, timeout);
+}
+
+int usb_interrupt_write(void *handle, int ep, char *bytes, int size, int timeout)
+{
+    return usb_bulk_write(handle, ep, bytes, size, timeout);
+}
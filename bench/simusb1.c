@@ -0,0 +1,473 @@
+/* Simulated libusb-1.0 for bench_transfers.py and the libusb-1.0 runs of
+ * bench_simusb.py.
+ *
+ * Build: cc -O2 -shared -fPIC -o libsimusb1.so simusb1.c
+ *
+ * Enumeration follows simusb.c: libusb_init() reads SIMUSB_BUSSES,
+ * SIMUSB_DEVICES, SIMUSB_KINDLES, SIMUSB_OPEN_US, SIMUSB_OPEN_HANG,
+ * SIMUSB_CONTROL_US, SIMUSB_HANG and SIMUSB_FAIL with the same meaning
+ * and defaults, and the devices report the same descriptors and strings
+ * (Kindles: serial B006<bus:4><address:8>). libusb_get_device_list()
+ * fetches are counted in simusb1_device_lists and control transfers in
+ * simusb1_control_transfers; simusb1_device_refs is the number of device
+ * references taken by lists, libusb_ref_device() and open handles and
+ * not given back yet. There is no hotplug support.
+ *
+ * Transfers go over a bus that moves one at a time. A submitted transfer
+ * starts on the bus SIMUSB1_LATENCY_US microseconds after its submission
+ * (500), or when the previous one is done if that is later, and takes
+ * SIMUSB1_TRANSFER_US (200). So a single transfer in flight leaves the
+ * bus idle for the latency, and enough queued transfers keep it busy: the
+ * bus rate is transfer size / SIMUSB1_TRANSFER_US. Every endpoint of
+ * every device shares the bus.
+ *
+ * Completions are reported through the single pollfd, a timerfd armed
+ * for the next transfer due, and delivered by libusb_handle_events_timeout
+ * as in libusb. IN transfers are filled completely; their first four
+ * bytes hold the little-endian number of the transfer on the bus, so the
+ * caller can check nothing was lost or reordered. OUT transfers report
+ * their whole length. Cancelled transfers complete on the next
+ * handle_events with LIBUSB_TRANSFER_CANCELLED. Every submission is
+ * counted in simusb1_submitted.
+ */
+#include <poll.h>
+#include <stdint.h>
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include <sys/time.h>
+#include <sys/timerfd.h>
+#include <time.h>
+#include <unistd.h>
+
+#define LIBUSB_TRANSFER_COMPLETED 0
+#define LIBUSB_TRANSFER_CANCELLED 3
+#define LIBUSB_ERROR_IO -1
+#define LIBUSB_ERROR_NOT_FOUND -5
+#define LIBUSB_ERROR_OVERFLOW -8
+#define LIBUSB_ERROR_PIPE -9
+#define LIBUSB_ERROR_NOT_SUPPORTED -12
+
+struct libusb_transfer;
+typedef void (*libusb_transfer_cb_fn)(struct libusb_transfer *);
+
+struct libusb_transfer {
+    void *dev_handle;
+    uint8_t flags;
+    unsigned char endpoint;
+    unsigned char type;
+    unsigned int timeout;
+    int status;
+    int length;
+    int actual_length;
+    libusb_transfer_cb_fn callback;
+    void *user_data;
+    unsigned char *buffer;
+    int num_iso_packets;
+};
+
+struct libusb_pollfd {
+    int fd;
+    short events;
+};
+
+struct pending {
+    struct libusb_transfer *transfer;
+    double due;
+    int status;
+    struct pending *next;
+};
+
+long simusb1_submitted = 0;
+long simusb1_device_lists = 0;
+long simusb1_device_refs = 0;
+long simusb1_control_transfers = 0;
+
+static int timer = -1;
+static struct libusb_pollfd pollfd;
+static struct pending *queue = NULL; /* ordered by due */
+static double latency = 500e-6, transfer_time = 200e-6, bus_free = 0;
+static uint32_t bus_count = 0;
+static int context_dummy;
+
+static double now(void)
+{
+    struct timespec t;
+    clock_gettime(CLOCK_MONOTONIC, &t);
+    return t.tv_sec+t.tv_nsec*1e-9;
+}
+
+static double setting(const char *name, double fallback)
+{
+    const char *value = getenv(name);
+    return value ? atof(value) : fallback;
+}
+
+static void arm(void)
+{
+    struct itimerspec spec;
+    memset(&spec, 0, sizeof(spec));
+    if (queue) {
+        /* a due time in the past fires at once; 0 would disarm */
+        double due = queue->due > 1e-9 ? queue->due : 1e-9;
+        spec.it_value.tv_sec = (time_t)due;
+        spec.it_value.tv_nsec = (long)((due-(time_t)due)*1e9);
+        if (!spec.it_value.tv_sec && !spec.it_value.tv_nsec)
+            spec.it_value.tv_nsec = 1;
+    }
+    timerfd_settime(timer, TFD_TIMER_ABSTIME, &spec, NULL);
+}
+
+static void enqueue(struct pending *p)
+{
+    struct pending **at = &queue;
+    while (*at && (*at)->due <= p->due)
+        at = &(*at)->next;
+    p->next = *at;
+    *at = p;
+    arm();
+}
+
+/* enumeration */
+
+struct libusb_device_descriptor {
+    uint8_t bLength, bDescriptorType;
+    uint16_t bcdUSB;
+    uint8_t bDeviceClass, bDeviceSubClass, bDeviceProtocol, bMaxPacketSize0;
+    uint16_t idVendor, idProduct, bcdDevice;
+    uint8_t iManufacturer, iProduct, iSerialNumber, bNumConfigurations;
+};
+
+struct device {
+    uint8_t bus, address;
+    struct libusb_device_descriptor descriptor;
+};
+
+struct handle {
+    struct device *dev;
+};
+
+static struct device *devices = NULL;
+static int ndevices = 0;
+static long open_us, control_us, open_hang, hang, fail;
+
+static void delay(long us)
+{
+    struct timespec t;
+    if (us <= 0)
+        return;
+    t.tv_sec = us/1000000;
+    t.tv_nsec = (us%1000000)*1000;
+    nanosleep(&t, NULL);
+}
+
+static void make_devices(void)
+{
+    int busses = setting("SIMUSB_BUSSES", 4), per_bus = setting("SIMUSB_DEVICES", 16);
+    int kindles = setting("SIMUSB_KINDLES", 8), i;
+    open_us = setting("SIMUSB_OPEN_US", 0);
+    control_us = setting("SIMUSB_CONTROL_US", 0);
+    open_hang = setting("SIMUSB_OPEN_HANG", 0);
+    hang = setting("SIMUSB_HANG", 0);
+    fail = setting("SIMUSB_FAIL", 0);
+    ndevices = busses*per_bus;
+    devices = calloc(ndevices, sizeof(*devices));
+    for (i = 0; i < ndevices; i++) {
+        struct libusb_device_descriptor *d = &devices[i].descriptor;
+        int kindle = i < kindles;
+        devices[i].bus = i/per_bus+1;
+        devices[i].address = i%per_bus+1;
+        d->bLength = 18;
+        d->bDescriptorType = 1;
+        d->bcdUSB = 0x0200;
+        d->bMaxPacketSize0 = 64;
+        d->idVendor = kindle ? 0x1949 : 0x046d;
+        d->idProduct = kindle ? 0x0004 : 0xc52b;
+        d->bcdDevice = 0x0100;
+        d->iManufacturer = 1;
+        d->iProduct = 2;
+        d->iSerialNumber = 3;
+        d->bNumConfigurations = 1;
+    }
+}
+
+long libusb_get_device_list(void *ctx, struct device ***list)
+{
+    int i;
+    *list = calloc(ndevices+1, sizeof(**list));
+    for (i = 0; i < ndevices; i++)
+        (*list)[i] = &devices[i];
+    __sync_fetch_and_add(&simusb1_device_refs, ndevices);
+    __sync_fetch_and_add(&simusb1_device_lists, 1);
+    return ndevices;
+}
+
+void libusb_free_device_list(struct device **list, int unref)
+{
+    int i;
+    if (unref)
+        for (i = 0; list[i]; i++)
+            __sync_fetch_and_sub(&simusb1_device_refs, 1);
+    free(list);
+}
+
+struct device *libusb_ref_device(struct device *dev)
+{
+    __sync_fetch_and_add(&simusb1_device_refs, 1);
+    return dev;
+}
+
+void libusb_unref_device(struct device *dev)
+{
+    __sync_fetch_and_sub(&simusb1_device_refs, 1);
+}
+
+int libusb_get_device_descriptor(struct device *dev, struct libusb_device_descriptor *descriptor)
+{
+    *descriptor = dev->descriptor;
+    return 0;
+}
+
+uint8_t libusb_get_bus_number(struct device *dev) { return dev->bus; }
+uint8_t libusb_get_device_address(struct device *dev) { return dev->address; }
+
+int libusb_open(struct device *dev, struct handle **handle)
+{
+    if (dev->address == open_hang)
+        for (;;)
+            delay(1000000);
+    delay(open_us);
+    *handle = malloc(sizeof(**handle));
+    (*handle)->dev = libusb_ref_device(dev);
+    return 0;
+}
+
+void libusb_close(struct handle *handle)
+{
+    libusb_unref_device(handle->dev);
+    free(handle);
+}
+
+struct handle *libusb_open_device_with_vid_pid(void *ctx, uint16_t vendor, uint16_t product)
+{
+    struct handle *handle;
+    int i;
+    for (i = 0; i < ndevices; i++)
+        if (devices[i].descriptor.idVendor == vendor && devices[i].descriptor.idProduct == product)
+            return libusb_open(&devices[i], &handle) ? NULL : handle;
+    return NULL;
+}
+
+struct device *libusb_get_device(struct handle *handle) { return handle->dev; }
+int libusb_claim_interface(struct handle *handle, int number) { return 0; }
+
+static const char *string_for(struct device *dev, int index, char *tmp, size_t size)
+{
+    int kindle = dev->descriptor.idVendor == 0x1949;
+    switch (index) {
+    case 1:
+        return kindle ? "Amazon" : "Logitech";
+    case 2:
+        return kindle ? "Amazon Kindle" : "USB Receiver";
+    case 3:
+        snprintf(tmp, size, "B006%04d%08d", dev->bus, dev->address);
+        return tmp;
+    }
+    return NULL;
+}
+
+/* only GET_DESCRIPTOR(STRING) requests are answered */
+int libusb_control_transfer(struct handle *handle, uint8_t type, uint8_t request, uint16_t value,
+                            uint16_t index, unsigned char *data, uint16_t length, unsigned int timeout)
+{
+    struct device *dev = handle->dev;
+    char tmp[32];
+    const char *s;
+    int i, n;
+    __sync_fetch_and_add(&simusb1_control_transfers, 1);
+    if (dev->address == hang)
+        for (;;)
+            delay(1000000);
+    delay(control_us);
+    if (dev->address == fail)
+        return LIBUSB_ERROR_IO;
+    if (type != 0x80 || request != 0x06 || value>>8 != 0x03 || length < 2)
+        return LIBUSB_ERROR_PIPE;
+    if ((value&0xff) == 0) {
+        if (length < 4)
+            return LIBUSB_ERROR_OVERFLOW;
+        memcpy(data, "\x04\x03\x09\x04", 4);
+        return 4;
+    }
+    s = string_for(dev, value&0xff, tmp, sizeof(tmp));
+    if (!s)
+        return LIBUSB_ERROR_PIPE;
+    n = 2+2*strlen(s);
+    if (n > length)
+        n = length&~1;
+    data[0] = n;
+    data[1] = 0x03;
+    for (i = 2; i+1 < n; i += 2) {
+        data[i] = s[i/2-1];
+        data[i+1] = 0;
+    }
+    return n;
+}
+
+/* the LANGID table, then the string, as in libusb */
+int libusb_get_string_descriptor_ascii(struct handle *handle, uint8_t index, unsigned char *data, int length)
+{
+    unsigned char buf[255];
+    int i, n;
+    if ((n = libusb_control_transfer(handle, 0x80, 0x06, 0x0300, 0, buf, sizeof(buf), 1000)) < 0)
+        return n;
+    if ((n = libusb_control_transfer(handle, 0x80, 0x06, 0x0300|index, 0x0409, buf, sizeof(buf), 1000)) < 0)
+        return n;
+    for (i = 0; i < (n-2)/2 && i < length-1; i++)
+        data[i] = buf[2+2*i];
+    data[i] = 0;
+    return i;
+}
+
+int libusb_init(void **ctx)
+{
+    latency = setting("SIMUSB1_LATENCY_US", 500)*1e-6;
+    transfer_time = setting("SIMUSB1_TRANSFER_US", 200)*1e-6;
+    if (timer < 0)
+        timer = timerfd_create(CLOCK_MONOTONIC, TFD_NONBLOCK|TFD_CLOEXEC);
+    if (!devices)
+        make_devices();
+    pollfd.fd = timer;
+    pollfd.events = POLLIN;
+    if (ctx)
+        *ctx = &context_dummy;
+    return timer < 0 ? -99 : 0;
+}
+
+void libusb_exit(void *ctx) { }
+
+const char *libusb_error_name(int code)
+{
+    switch (code) {
+    case LIBUSB_ERROR_IO:
+        return "LIBUSB_ERROR_IO";
+    case LIBUSB_ERROR_NOT_FOUND:
+        return "LIBUSB_ERROR_NOT_FOUND";
+    case LIBUSB_ERROR_OVERFLOW:
+        return "LIBUSB_ERROR_OVERFLOW";
+    case LIBUSB_ERROR_PIPE:
+        return "LIBUSB_ERROR_PIPE";
+    case LIBUSB_ERROR_NOT_SUPPORTED:
+        return "LIBUSB_ERROR_NOT_SUPPORTED";
+    }
+    return "LIBUSB_ERROR_OTHER";
+}
+
+int libusb_has_capability(uint32_t capability) { return 0; }
+int libusb_hotplug_register_callback(void *ctx, int events, int flags, int vendor, int product,
+                                     int dev_class, void *cb, void *user_data, int *handle)
+{
+    return LIBUSB_ERROR_NOT_SUPPORTED;
+}
+
+/* transfers */
+
+struct libusb_transfer *libusb_alloc_transfer(int iso_packets)
+{
+    return calloc(1, sizeof(struct libusb_transfer));
+}
+
+void libusb_free_transfer(struct libusb_transfer *transfer) { free(transfer); }
+
+int libusb_submit_transfer(struct libusb_transfer *transfer)
+{
+    struct pending *p = malloc(sizeof(*p));
+    double start = now()+latency;
+    if (start < bus_free)
+        start = bus_free;
+    bus_free = start+transfer_time;
+    p->transfer = transfer;
+    p->due = bus_free;
+    p->status = LIBUSB_TRANSFER_COMPLETED;
+    if (transfer->endpoint & 0x80) {
+        uint32_t n = bus_count;
+        memset(transfer->buffer, 0x5a, transfer->length);
+        if (transfer->length >= 4)
+            memcpy(transfer->buffer, &n, 4);
+    }
+    bus_count++;
+    simusb1_submitted++;
+    enqueue(p);
+    return 0;
+}
+
+int libusb_cancel_transfer(struct libusb_transfer *transfer)
+{
+    struct pending **at = &queue;
+    while (*at && (*at)->transfer != transfer)
+        at = &(*at)->next;
+    if (!*at || (*at)->status == LIBUSB_TRANSFER_CANCELLED)
+        return LIBUSB_ERROR_NOT_FOUND;
+    struct pending *p = *at;
+    *at = p->next;
+    p->status = LIBUSB_TRANSFER_CANCELLED;
+    p->due = 0;
+    enqueue(p);
+    return 0;
+}
+
+/* events */
+
+static int deliver(void)
+{
+    uint64_t expirations;
+    double t = now();
+    struct pending *due = NULL, **tail = &due;
+    int n = 0;
+    ssize_t cleared = read(timer, &expirations, sizeof(expirations)); /* -1 if nothing expired */
+    (void)cleared;
+    /* callbacks submit again, so take the due ones off the queue first */
+    while (queue && queue->due <= t) {
+        *tail = queue;
+        queue = queue->next;
+        tail = &(*tail)->next;
+    }
+    *tail = NULL;
+    arm();
+    while (due) {
+        struct pending *p = due;
+        struct libusb_transfer *transfer = p->transfer;
+        due = p->next;
+        transfer->status = p->status;
+        transfer->actual_length = p->status == LIBUSB_TRANSFER_COMPLETED ? transfer->length : 0;
+        free(p);
+        transfer->callback(transfer);
+        n++;
+    }
+    return n;
+}
+
+int libusb_handle_events_timeout(void *ctx, struct timeval *tv)
+{
+    int wait = tv ? (int)(tv->tv_sec*1000+tv->tv_usec/1000) : -1;
+    if (!deliver() && wait != 0) {
+        struct pollfd p = {timer, POLLIN, 0};
+        poll(&p, 1, wait);
+        deliver();
+    }
+    return 0;
+}
+
+int libusb_get_next_timeout(void *ctx, struct timeval *tv) { return 0; }
+int libusb_pollfds_handle_timeouts(void *ctx) { return 1; }
+
+const struct libusb_pollfd **libusb_get_pollfds(void *ctx)
+{
+    const struct libusb_pollfd **fds = calloc(2, sizeof(*fds));
+    fds[0] = &pollfd;
+    return fds;
+}
+
+void libusb_free_pollfds(const struct libusb_pollfd **fds) { free((void *)fds); }
+
+void libusb_set_pollfd_notifiers(void *ctx, void *added, void *removed, void *user_data) { }
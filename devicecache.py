@@ -0,0 +1,109 @@
+"""Persistent serial -> model/password cache for kdt.py.
+
+Backed by SQLite so several kdt.py processes can share one file: reads run
+concurrently, writers serialize on the database lock. The table holds at
+most max_entries serials; the least recently used ones are evicted first.
+"""
+import os, sqlite3, time
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS devices (
+    serial      TEXT PRIMARY KEY,
+    model       TEXT,
+    password    TEXT NOT NULL,
+    first_seen  REAL,
+    last_seen   REAL,
+    seen_count  INTEGER NOT NULL DEFAULT 0,
+    last_used   REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS devices_last_used ON devices(last_used);
+"""
+
+def defaultPath():
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'kdt4lin', 'devices.sqlite')
+
+class DeviceCache(object):
+    """Size-bounded LRU cache of derived device data"""
+    def __init__(self, path=None, max_entries=100000, timeout=30.0):
+        if path is None:
+            path = defaultPath()
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.path = path
+        self.max_entries = max_entries
+        self.db = sqlite3.connect(path, timeout=timeout, isolation_level=None)
+        self.db.text_factory = str
+        try:
+            self.db.execute("PRAGMA journal_mode=WAL")
+        except sqlite3.OperationalError:
+            pass # e.g. on network file systems, rollback journal still works
+        self.db.executescript(SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    def lookup(self, serials):
+        """Returns {serial: (model, password)} for the cached serials"""
+        result = {}
+        serials = list(serials)
+        now = time.time()
+        self.db.execute("BEGIN IMMEDIATE")
+        try:
+            for start in range(0, len(serials), 500):
+                chunk = serials[start:start+500]
+                marks = ",".join("?"*len(chunk))
+                for serial, model, password in self.db.execute(
+                        "SELECT serial, model, password FROM devices WHERE serial IN (%s)"%marks, chunk):
+                    result[serial] = (model, password)
+                self.db.execute("UPDATE devices SET last_used=? WHERE serial IN (%s)"%marks,
+                                [now]+chunk)
+            self.db.execute("COMMIT")
+        except:
+            self.db.execute("ROLLBACK")
+            raise
+        return result
+
+    def store(self, rows, seen=False):
+        """Inserts or refreshes (serial, model, password) rows.
+
+        With seen=True the rows are devices that are attached right now and
+        their last_seen time and counter are updated as well."""
+        now = time.time()
+        if seen:
+            seen_time, seen_count = now, 1
+        else:
+            seen_time, seen_count = None, 0
+        self.db.execute("BEGIN IMMEDIATE")
+        try:
+            for serial, model, password in rows:
+                self.db.execute("INSERT OR IGNORE INTO devices"
+                                " (serial, model, password, first_seen, last_seen, seen_count, last_used)"
+                                " VALUES (?, ?, ?, ?, ?, 0, ?)",
+                                (serial, model, password, seen_time, seen_time, now))
+                self.db.execute("UPDATE devices SET model=?, password=?, last_used=?,"
+                                " first_seen=COALESCE(first_seen, ?),"
+                                " last_seen=COALESCE(?, last_seen),"
+                                " seen_count=seen_count+? WHERE serial=?",
+                                (model, password, now, seen_time, seen_time, seen_count, serial))
+            self.evict()
+            self.db.execute("COMMIT")
+        except:
+            self.db.execute("ROLLBACK")
+            raise
+
+    def evict(self):
+        """Drops least recently used rows beyond max_entries"""
+        count = self.db.execute("SELECT COUNT(*) FROM devices").fetchone()[0]
+        if count > self.max_entries:
+            self.db.execute("DELETE FROM devices WHERE serial IN"
+                            " (SELECT serial FROM devices ORDER BY last_used LIMIT ?)",
+                            (count-self.max_entries,))
+
+    def history(self):
+        """Yields (serial, model, password, first_seen, last_seen, seen_count)
+        for every cached device, most recently seen first"""
+        for row in self.db.execute("SELECT serial, model, password, first_seen, last_seen, seen_count"
+                                   " FROM devices ORDER BY last_seen IS NULL, last_seen DESC, serial"):
+            yield row
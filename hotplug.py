@@ -0,0 +1,110 @@
+"""Kernel uevent listener for kdt.py --watch.
+
+The kernel broadcasts a message on a NETLINK_KOBJECT_UEVENT socket for
+every device that comes or goes. Each message is a NUL separated list,
+"ACTION@DEVPATH" followed by KEY=VALUE pairs. USB devices carry
+PRODUCT=<vendor>/<product>/<bcdDevice> in hex; the serial number is not
+part of the message and is read from sysfs instead.
+
+Any datagram socket delivering messages in that format will do, which is
+how recorded uevents can be replayed through a local AF_UNIX socket.
+"""
+import os, socket
+import sysfs
+
+NETLINK_KOBJECT_UEVENT = 15
+UEVENT_GROUP_KERNEL = 1
+
+def netlinkSocket(rcvbuf=1<<20):
+    sock = socket.socket(socket.AF_NETLINK, socket.SOCK_DGRAM, NETLINK_KOBJECT_UEVENT)
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, rcvbuf)
+    except socket.error:
+        pass
+    sock.bind((0, UEVENT_GROUP_KERNEL))
+    return sock
+
+def unixSocket(path):
+    """Datagram socket at path that recorded uevents can be sent to"""
+    if os.path.exists(path):
+        os.unlink(path)
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    sock.bind(path)
+    return sock
+
+def parseUevent(data):
+    """Returns the KEY=VALUE pairs of a kernel uevent as a dict, or None for
+    messages that are not kernel uevents (e.g. udev's own broadcasts)"""
+    if data.startswith('libudev'):
+        return None
+    fields = data.split('\0')
+    if '@' not in fields[0]:
+        return None
+    event = {}
+    for field in fields[1:]:
+        key, sep, value = field.partition('=')
+        if sep:
+            event[key] = value
+    if 'ACTION' not in event or 'DEVPATH' not in event:
+        action, devpath = fields[0].split('@', 1)
+        event.setdefault('ACTION', action)
+        event.setdefault('DEVPATH', devpath)
+    return event
+
+def isKindle(event):
+    if event.get('SUBSYSTEM') != 'usb' or event.get('DEVTYPE') != 'usb_device':
+        return False
+    try:
+        vendor, product = event['PRODUCT'].split('/')[:2]
+        return int(vendor, 16) == sysfs.KINDLE_VENDOR and int(product, 16) == sysfs.KINDLE_PRODUCT
+    except (KeyError, ValueError):
+        return False
+
+class KindleTable(object):
+    """Attached Kindles keyed by sysfs device path, updated from uevents"""
+    def __init__(self, root='/sys'):
+        self.root = root
+        self.devices = {}
+
+    def scan(self):
+        """Fills the table from the devices already present in sysfs and
+        returns their serials"""
+        found = []
+        for devpath, serial in sysfs.findKindles(self.root):
+            if devpath not in self.devices:
+                self.devices[devpath] = serial
+                found.append(serial)
+        return found
+
+    def update(self, event):
+        """Applies one parsed uevent. Returns ('add', serial) or
+        ('remove', serial) when the set of attached Kindles changed"""
+        if event is None or not isKindle(event):
+            return None
+        devpath = event['DEVPATH']
+        action = event['ACTION']
+        if action == 'add':
+            serial = sysfs.readAttribute(self.root, devpath, 'serial')
+            if not serial or self.devices.get(devpath) == serial:
+                return None
+            self.devices[devpath] = serial
+            return ('add', serial)
+        elif action == 'remove':
+            serial = self.devices.pop(devpath, None)
+            if serial is None:
+                return None
+            return ('remove', serial)
+        return None
+
+    def serials(self):
+        return self.devices.values()
+
+def watch(sock, table, bufsize=65536):
+    """Blocks on sock and yields the changes reported by table.update()"""
+    while True:
+        data = sock.recv(bufsize)
+        if not data:
+            continue
+        change = table.update(parseUevent(data))
+        if change is not None:
+            yield change
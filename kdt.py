@@ -1,62 +1,718 @@
 #!/usr/bin/env python
 import hashlib, sys
+import models, tracing
 
 def getKindleModel(serial):
-    return { '1':'Kindle 1',\
-    '2':'Kindle 2 U.S.',\
-    '3':'Kindle 2 international',\
-    '8':'Kindle 3 WIFI',\
-    '6':'Kindle 3 3G + WIFI U.S.',\
-    'A':'Kindle 3 3G + WIFI European',\
-    '4':'Kindle DX U.S.',\
-    '5':'Kindle DX international',\
-    '9':'Kindle DX Graphite'}.get(serial[4])
+    return models.registry.lookup(serial)
 
 def getKindlePassword(serial):
     return "fiona%s"%hashlib.md5("%s\n"%serial).hexdigest()[7:11]
 
-serials = []
-
-# Trying to get devices via UDisks
-if sys.platform.startswith("linux"):
+def getKindlePasswords(serials, lanes=8192):
+    """Same as map(getKindlePassword, serials), but hashes serials of equal
+    length side by side with multimd5 when NumPy is available"""
     try:
+        import numpy, multimd5
+    except ImportError:
+        return map(getKindlePassword, serials)
+    if not serials:
+        return []
+    # hash the bytes getKindlePassword() does: unicode goes through
+    # "%s" formatting and hashlib's implicit ASCII encoding
+    serials = [serial if type(serial) is str else str("%s"%serial) for serial in serials]
+    lengths = map(len, serials)
+    if min(lengths) == max(lengths):
+        groups = [(serials, None)]
+    else:
+        lengths = numpy.array(lengths)
+        indexed = numpy.array(serials, dtype=object)
+        groups = []
+        for length in numpy.unique(lengths):
+            indices = numpy.nonzero(lengths == length)[0]
+            groups.append((indexed[indices].tolist(), indices))
+        result = numpy.empty(len(serials), dtype=object)
+    hexdigits = numpy.frombuffer(b'0123456789abcdef', dtype=numpy.uint8)
+    for group, indices in groups:
+        length = len(group[0])
+        if length >= multimd5.MAX_LENGTH:
+            passwords = map(getKindlePassword, group)
+        else:
+            passwords = []
+            for start in range(0, len(group), lanes):
+                chunk = group[start:start+lanes]
+                a, b, c, d = multimd5.md5_lanes("\n".join(chunk)+"\n", length+1)
+                # hexdigest()[7:11] is the low nibble of digest byte 3 (top
+                # byte of a), byte 4 (low byte of b) and the high nibble of
+                # byte 5
+                chars = numpy.empty((len(chunk), 9), dtype=numpy.uint8)
+                chars[:, :5] = numpy.frombuffer(b'fiona', dtype=numpy.uint8)
+                chars[:, 5] = hexdigits[(a >> 24) & 0xf]
+                chars[:, 6] = hexdigits[(b >> 4) & 0xf]
+                chars[:, 7] = hexdigits[b & 0xf]
+                chars[:, 8] = hexdigits[(b >> 12) & 0xf]
+                passwords.extend(chars.view('S9').ravel().tolist())
+        if indices is None:
+            return passwords
+        result[indices] = passwords
+    return result.tolist()
+
+def findSysfsSerials(root='/sys'):
+    import sysfs
+    with tracing.span('findKindles', 'sysfs'):
+        return [serial for devpath, serial in sysfs.findKindles(root)]
+
+def findUDisks2Serials(bus=None):
+    # one GetManagedObjects call returns every drive with its properties
+    with tracing.span('import dbus', 'udisks2'):
         import dbus
-        bus = dbus.SystemBus()
-        ud_manager_obj = bus.get_object("org.freedesktop.UDisks", "/org/freedesktop/UDisks")
-        ud_manager = dbus.Interface(ud_manager_obj, 'org.freedesktop.UDisks')
-        for dev in ud_manager.EnumerateDevices():
+    if bus is None:
+        with tracing.span('SystemBus', 'udisks2'):
+            bus = dbus.SystemBus()
+    manager = dbus.Interface(bus.get_object("org.freedesktop.UDisks2", "/org/freedesktop/UDisks2"),
+                             'org.freedesktop.DBus.ObjectManager')
+    with tracing.span('GetManagedObjects', 'udisks2'):
+        objects = manager.GetManagedObjects()
+    for path, interfaces in objects.iteritems():
+        drive = interfaces.get('org.freedesktop.UDisks2.Drive')
+        if drive is not None and str(drive.get('Vendor', '')).strip()=='Kindle' and drive.get('Serial'):
+            yield str(drive['Serial'])
+
+def findUDisksSerials(bus=None):
+    with tracing.span('import dbus', 'udisks'):
+        import dbus
+    if bus is None:
+        with tracing.span('SystemBus', 'udisks'):
+            bus = dbus.SystemBus()
+    ud_manager_obj = bus.get_object("org.freedesktop.UDisks", "/org/freedesktop/UDisks")
+    ud_manager = dbus.Interface(ud_manager_obj, 'org.freedesktop.UDisks')
+    with tracing.span('EnumerateDevices', 'udisks'):
+        devices = ud_manager.EnumerateDevices()
+    for dev in devices:
+        serial = None
+        with tracing.span('Get', 'udisks', device=str(dev)):
             device_obj = bus.get_object("org.freedesktop.UDisks", dev)
             device_props = dbus.Interface(device_obj, dbus.PROPERTIES_IFACE)
             if device_props.Get('org.freedesktop.UDisks.Device', "DriveVendor")=='Kindle' and\
                     device_props.Get('org.freedesktop.UDisks.Device', "DeviceIsDrive"):
-                serials.append(str(device_props.Get('org.freedesktop.UDisks.Device', "DriveSerial")))
-    except:
-        sys.stderr.write("ERR Can't use UDisks interface\n")
+                serial = str(device_props.Get('org.freedesktop.UDisks.Device', "DriveSerial"))
+        if serial is not None:
+            yield serial
 
-# Trying to get devices via libusb
-try:
-    import pylibusb as usb
-    usb.init()
-    if not usb.get_busses():
+def readLibusbSerials(pool, devices, workers=8, timeout=2.0, retries=1):
+    """Reads the serial numbers of devices on up to workers threads and
+    yields (dev, serial, error) in the order the reads finish.
+
+    A read that has not finished timeout seconds after it started is
+    abandoned: its device yields error 'timeout' and a fresh thread takes
+    over the remaining work, since a call stuck inside libusb can't be
+    interrupted. Reads that fail are tried again up to retries times."""
+    import threading, time, Queue
+    tasks = Queue.Queue()
+    results = Queue.Queue()
+    started = {}
+    def worker():
+        while True:
+            task = tasks.get()
+            if task is None:
+                return
+            i, attempt = task
+            started[i] = time.time()
+            serial, error = None, None
+            device = "%s/%s"%pool.key(devices[i])
+            try:
+                with tracing.span('open', 'libusb', device=device, attempt=attempt):
+                    libusb_handle = pool.acquire(devices[i])
+                with libusb_handle:
+                    with tracing.span('get_string', 'libusb', device=device, attempt=attempt):
+                        serial = libusb_handle.get_strings([devices[i].descriptor.iSerialNumber])[0]
+                if serial is None:
+                    error = "no serial number"
+            except Exception, e:
+                error = e
+            results.put((i, attempt, serial, error))
+    def spawn():
+        thread = threading.Thread(target=worker, name="kdt-libusb")
+        thread.daemon = True
+        thread.start()
+        threads.append(thread)
+
+    threads = []
+    for i in range(len(devices)):
+        tasks.put((i, 0))
+    for n in range(min(workers, len(devices))):
+        spawn()
+    pending = set(range(len(devices)))
+    try:
+        while pending:
+            running = [started[i]+timeout for i in pending if i in started]
+            if running:
+                wait = max(0, min(running)-time.time())
+            else:
+                wait = timeout
+            try:
+                i, attempt, serial, error = results.get(True, wait)
+            except Queue.Empty:
+                now = time.time()
+                for i in [i for i in pending if i in started and started[i]+timeout <= now]:
+                    pending.discard(i)
+                    spawn()
+                    yield devices[i], None, 'timeout'
+                continue
+            if i not in pending:
+                continue # answered after it was given up on
+            if error is not None and attempt < retries:
+                del started[i]
+                tasks.put((i, attempt+1))
+                continue
+            pending.discard(i)
+            yield devices[i], serial, error
+    finally:
+        for thread in threads:
+            tasks.put(None)
+
+def findLibusbSerials(workers=8, timeout=2.0, retries=1):
+    import pylibusb
+    usb = pylibusb.get_backend()
+    with tracing.span('init', 'libusb'):
+        usb.init()
+    # every scan, so repeated scans (--serve) see devices come and go
+    with tracing.span('find_busses', 'libusb'):
         usb.find_busses()
+    with tracing.span('find_devices', 'libusb'):
         usb.find_devices()
-    busses = usb.get_busses()
-    for bus in busses:
-        for dev in bus.devices:
-            if (dev.descriptor.idVendor == 0x1949 and
-                dev.descriptor.idProduct == 0x0004):
-                libusb_handle = usb.open(dev)
-                try:
-                    s = usb.get_string_simple(libusb_handle,dev.descriptor.iSerialNumber)
-                    if not s in serials:
-                        serials.append(s)
-                except usb.USBError, error:
-                    sys.stderr.write("ERR Libusb error: %s\nERR May be you is not root?\n"%str(error))
-except:
-    sys.stderr.write("ERR Can't use libusb interface\n")
-
-if len(serials)==0:
-    print "No Kindle devices found"
-else:
-    for serial in serials:
-        print "Device: %s\nSerial: %s\nPassword: %s"%(getKindleModel(serial),serial,getKindlePassword(serial))
+    with tracing.span('find', 'libusb'):
+        devices = list(usb.find(idVendor=0x1949, idProduct=0x0004))
+    # every device may hold a handle at once: stuck reads keep theirs
+    pool = usb.HandlePool(max_open=max(1, len(devices)))
+    try:
+        for dev, serial, error in readLibusbSerials(pool, devices, workers, timeout, retries):
+            if error == 'timeout':
+                sys.stderr.write("ERR Kindle at %s/%s did not answer within %gs\n"%(pool.key(dev)+(timeout,)))
+            elif error is not None:
+                sys.stderr.write("ERR Can't read serial number of Kindle at %s/%s: %s\n"%(pool.key(dev)+(error,)))
+                if isinstance(error, usb.USBError):
+                    sys.stderr.write("ERR May be you is not root?\n")
+            else:
+                yield serial
+    finally:
+        pool.close(borrowed=False)
+
+def probeBackends(backends, timeout=None, first=False):
+    """Runs every (name, backend) pair on its own thread and merges the
+    serials they yield, dropping duplicates, in the order they arrive.
+
+    timeout is the deadline in seconds for each backend, either one number
+    for all of them or a {name: seconds} dict; backends that miss it are
+    abandoned. With first=True the result is returned as soon as a
+    backend that found at least one serial has finished successfully."""
+    import threading, time, Queue
+    events = Queue.Queue()
+    def run(name, backend):
+        try:
+            with tracing.span(name, 'backend'):
+                for serial in backend():
+                    events.put(('serial', name, serial))
+        except Exception, error:
+            events.put(('error', name, error))
+        else:
+            events.put(('done', name, None))
+
+    start = time.time()
+    deadlines = {}
+    for name, backend in backends:
+        if isinstance(timeout, dict):
+            limit = timeout.get(name)
+        else:
+            limit = timeout
+        if limit is not None:
+            deadlines[name] = start+limit
+        else:
+            deadlines[name] = None
+        thread = threading.Thread(target=run, args=(name, backend), name="kdt-%s"%name)
+        thread.daemon = True
+        thread.start()
+
+    serials = []
+    found = set()
+    pending = set(deadlines)
+    while pending:
+        limits = [deadlines[name] for name in pending if deadlines[name] is not None]
+        if limits:
+            wait = max(0, min(limits)-time.time())
+        else:
+            # a finite wait keeps Ctrl-C working while blocked in get()
+            wait = 3600
+        try:
+            kind, name, value = events.get(True, wait)
+        except Queue.Empty:
+            now = time.time()
+            for name in list(pending):
+                if deadlines[name] is not None and deadlines[name] <= now:
+                    sys.stderr.write("ERR %s interface timed out\n"%name)
+                    pending.discard(name)
+            continue
+        if name not in pending:
+            continue
+        if kind == 'serial':
+            found.add(name)
+            if not value in serials:
+                serials.append(value)
+        elif kind == 'error':
+            sys.stderr.write("ERR Can't use %s interface\n"%name)
+            pending.discard(name)
+        else:
+            pending.discard(name)
+            # a backend that saw nothing, e.g. UDisks with the Kindle not
+            # mounted, says nothing about the others
+            if first and name in found:
+                break
+    return serials
+
+def findSerials(sysfs_root='/sys', timeout=None, first=False, workers=8, device_timeout=2.0, retries=1):
+    # sysfs is the cheapest source; when it is there it sees every device
+    if sys.platform.startswith("linux"):
+        import sysfs
+        if sysfs.available(sysfs_root):
+            try:
+                return findSysfsSerials(sysfs_root)
+            except:
+                sys.stderr.write("ERR Can't use sysfs interface\n")
+
+    # Otherwise ask UDisks and libusb at the same time
+    backends = []
+    if sys.platform.startswith("linux"):
+        backends.append(('UDisks2', findUDisks2Serials))
+        backends.append(('UDisks', findUDisksSerials))
+    backends.append(('libusb', lambda: findLibusbSerials(workers, device_timeout, retries)))
+    return probeBackends(backends, timeout, first)
+
+def describeSerials(serials, cache=None, seen=True):
+    """Returns (serial, model, password) for serials, taking what it can
+    from cache and recording the rest there; seen=True records them as
+    attached right now"""
+    known = {}
+    if cache is not None:
+        try:
+            known = cache.lookup(serials)
+        except Exception, error:
+            sys.stderr.write("ERR Can't read device cache: %s\n"%str(error))
+            cache = None
+    result = []
+    with tracing.span('describe', 'kdt', devices=len(serials)):
+        for serial in serials:
+            # only the password comes from the cache: the model is a cheap
+            # lookup, and the registry may have changed since it was cached
+            if serial in known:
+                password = known[serial][1]
+            else:
+                password = getKindlePassword(serial)
+            result.append((serial, getKindleModel(serial), password))
+    if cache is not None:
+        try:
+            cache.store(result, seen=seen)
+        except Exception, error:
+            sys.stderr.write("ERR Can't update device cache: %s\n"%str(error))
+    return result
+
+def printHistory(cache):
+    import time
+    empty = True
+    for serial, model, password, first_seen, last_seen, seen_count in cache.history():
+        empty = False
+        model = getKindleModel(serial)
+        if last_seen is None:
+            last = "never"
+        else:
+            last = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(last_seen))
+        print "Device: %s\nSerial: %s\nPassword: %s\nLast seen: %s (%d times)"%(
+            model, serial, password, last, seen_count)
+    if empty:
+        print "No Kindle devices in cache"
+
+def publishDevices(table, devices):
+    """Writes {serial: (model, password)} to a sharedtable.TableWriter"""
+    table.publish([(serial, model, password) for serial, (model, password) in sorted(devices.iteritems())])
+
+def runWatch(cache=None, sysfs='/sys', socket_path=None, publish=None):
+    """Prints attached Kindles as they come and go until interrupted, and
+    keeps the publish table, if any, up to date"""
+    import hotplug
+    if socket_path:
+        sock = hotplug.unixSocket(socket_path)
+    else:
+        sock = hotplug.netlinkSocket()
+    table = hotplug.KindleTable(sysfs)
+    attached = {}
+    # subscribe before the initial scan so nothing plugged in between is lost
+    for serial, model, password in describeSerials(table.scan(), cache):
+        attached[serial] = (model, password)
+        print "Device: %s\nSerial: %s\nPassword: %s"%(model,serial,password)
+    if publish is not None:
+        publishDevices(publish, attached)
+    sys.stdout.flush()
+    try:
+        for action, serial in hotplug.watch(sock, table):
+            if action == 'add':
+                for serial, model, password in describeSerials([serial], cache):
+                    attached[serial] = (model, password)
+                    print "Device: %s\nSerial: %s\nPassword: %s"%(model,serial,password)
+            else:
+                attached.pop(serial, None)
+                print "Removed: %s"%serial
+            if publish is not None:
+                publishDevices(publish, attached)
+            sys.stdout.flush()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        sock.close()
+        if socket_path:
+            import os
+            os.unlink(socket_path)
+
+def runServe(cache=None, sysfs_root='/sys', path=None, uevent_socket=None, interval=2.0, scan=findSerials,
+             publish=None):
+    """Answers queries about attached Kindles on the Unix socket at path
+    until interrupted. The table follows kernel uevents when sysfs is
+    there, otherwise scan() is called for the full list every interval
+    seconds. Changes are also written to the publish table, if any."""
+    import os, service
+    def describe(serials):
+        return describeSerials(serials, cache)
+    def lookup(serials):
+        # clients may ask about devices that were never plugged in
+        return describeSerials(serials, cache, seen=False)
+    changed = None
+    if publish is not None:
+        changed = lambda devices: publishDevices(publish, devices)
+    server = service.Server(service.listen(path), describe, changed, lookup)
+    sources = []
+    import sysfs
+    if sys.platform.startswith("linux") and sysfs.available(sysfs_root):
+        import hotplug
+        if uevent_socket:
+            sock = hotplug.unixSocket(uevent_socket)
+        else:
+            sock = hotplug.netlinkSocket()
+        sources.append(sock)
+        table = hotplug.KindleTable(sysfs_root)
+        def uevent():
+            change = table.update(hotplug.parseUevent(sock.recv(65536)))
+            if change is not None:
+                action, serial = change
+                if action == 'add':
+                    server.add(serial)
+                else:
+                    server.remove(serial)
+        server.watch(sock.fileno(), uevent)
+        server.update(table.scan())
+    else:
+        # scans block, so they run in a thread that hands each result to
+        # the server loop through a pipe
+        import threading, time, Queue
+        results = Queue.Queue()
+        readable, writable = os.pipe()
+        def scanner():
+            while True:
+                results.put(scan())
+                os.write(writable, 'x')
+                time.sleep(interval)
+        def scanned():
+            os.read(readable, 4096)
+            try:
+                while True:
+                    server.update(results.get_nowait())
+            except Queue.Empty:
+                pass
+        server.watch(readable, scanned)
+        thread = threading.Thread(target=scanner, name='kdt-scanner')
+        thread.daemon = True
+        thread.start()
+    try:
+        server.run()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+        os.unlink(path)
+        for sock in sources:
+            sock.close()
+        if uevent_socket:
+            os.unlink(uevent_socket)
+
+# Batch mode: serials come from a file or stdin instead of attached devices
+
+def readSerials(stream, chunksize):
+    """Yields lists of at most chunksize serials read lazily from stream"""
+    chunk = []
+    for line in stream:
+        serial = line.strip()
+        if not serial:
+            continue
+        chunk.append(serial)
+        if len(chunk) >= chunksize:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def deriveChunk(serials):
+    result = []
+    for serial, password in zip(serials, getKindlePasswords(serials)):
+        result.append((serial, getKindleModel(serial), password))
+    return result
+
+def tryDeriveChunk(serials):
+    """deriveChunk() for apply_async callbacks, which Python 2 never calls
+    for a failed task: returns (True, rows) or (False, exception)"""
+    try:
+        return True, deriveChunk(serials)
+    except Exception, error:
+        import pickle
+        try:
+            pickle.dumps(error)
+        except Exception:
+            error = RuntimeError("%s: %s"%(error.__class__.__name__, error))
+        return False, error
+
+def batchDerive(stream, jobs=None, chunksize=1000, ordered=False):
+    """Derives (serial, model, password) for every serial in stream.
+
+    Chunks are handed to a process pool, but never more than a few per
+    worker are in flight, so memory stays bounded however long the input
+    is. With ordered=True results come back in input order, otherwise as
+    soon as each chunk is done."""
+    import multiprocessing, collections, Queue
+    if not jobs:
+        jobs = multiprocessing.cpu_count()
+    window = jobs*4
+    pool = multiprocessing.Pool(jobs)
+    try:
+        if ordered:
+            pending = collections.deque()
+            for chunk in readSerials(stream, chunksize):
+                pending.append(pool.apply_async(deriveChunk, (chunk,)))
+                if len(pending) >= window:
+                    for row in pending.popleft().get():
+                        yield row
+            while pending:
+                for row in pending.popleft().get():
+                    yield row
+        else:
+            done = Queue.Queue()
+            def finished():
+                ok, rows = done.get()
+                if not ok:
+                    raise rows
+                return rows
+            in_flight = 0
+            for chunk in readSerials(stream, chunksize):
+                pool.apply_async(tryDeriveChunk, (chunk,), callback=done.put)
+                in_flight += 1
+                while in_flight >= window or not done.empty():
+                    for row in finished():
+                        yield row
+                    in_flight -= 1
+            while in_flight:
+                for row in finished():
+                    yield row
+                in_flight -= 1
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+
+def runBatch(filename, jobs, chunksize, ordered):
+    import json
+    if filename == '-':
+        stream = sys.stdin
+    else:
+        stream = open(filename)
+    try:
+        write = sys.stdout.write
+        for serial, model, password in batchDerive(stream, jobs, chunksize, ordered):
+            write(json.dumps({'serial':serial, 'model':model, 'password':password})+"\n")
+    finally:
+        if stream is not sys.stdin:
+            stream.close()
+
+def writeTopology(filename):
+    """Saves the descriptors of every USB device to filename, see
+    pylibusb/topology.py"""
+    import pylibusb.pylibusb as usb
+    import pylibusb.topology
+    usb.init()
+    usb.find_busses()
+    usb.find_devices()
+    topology = pylibusb.topology.export()
+    f = open(filename, 'wb')
+    try:
+        topology.save(f)
+    finally:
+        f.close()
+
+def runInventory(filename):
+    """Prints how many serials in filename belong to each model"""
+    if filename == '-':
+        stream = sys.stdin
+    else:
+        stream = open(filename)
+    try:
+        inventory = models.registry.summarize(line.strip() for line in stream if not line.isspace())
+    finally:
+        if stream is not sys.stdin:
+            stream.close()
+    print "Serials: %d (%d invalid, %d duplicates)"%(inventory.total, inventory.invalid, inventory.duplicates)
+    for model, count in sorted(inventory.models.items(), key=lambda item: -item[1]):
+        print "%s: %d"%(model, count)
+    for code, count in sorted(inventory.unknown.items(), key=lambda item: -item[1]):
+        print "Unknown %s: %d"%(code, count)
+
+def main(argv=None):
+    from optparse import OptionParser
+    parser = OptionParser(usage="%prog [options]")
+    parser.add_option("-b", "--batch", metavar="FILE",
+                      help="derive passwords for serials listed in FILE ('-' for stdin), one per line, "
+                           "and print them as JSON lines")
+    parser.add_option("-j", "--jobs", type="int", default=None,
+                      help="number of worker processes in batch mode (default: number of CPUs)")
+    parser.add_option("--chunk", type="int", default=1000,
+                      help="serials per work unit in batch mode (default: %default)")
+    parser.add_option("--ordered", action="store_true", default=False,
+                      help="keep batch output in input order")
+    parser.add_option("--inventory", metavar="FILE",
+                      help="count the serials listed in FILE ('-' for stdin) per model, "
+                           "with duplicates and unknown device codes")
+    parser.add_option("--topology", metavar="FILE",
+                      help="save the descriptors of every USB device to FILE in a compact binary format")
+    parser.add_option("--models", metavar="FILE",
+                      help="read additional 'PREFIX Model name' lines from FILE")
+    parser.add_option("--cache", metavar="FILE",
+                      help="remember models and passwords of found devices in the SQLite database FILE")
+    parser.add_option("--cache-size", type="int", default=100000,
+                      help="maximum number of devices kept in the cache (default: %default)")
+    parser.add_option("--history", action="store_true", default=False,
+                      help="list every device recorded in the cache instead of scanning")
+    parser.add_option("-w", "--watch", action="store_true", default=False,
+                      help="keep running and print Kindles as they are plugged in")
+    parser.add_option("--uevent-socket", metavar="PATH",
+                      help="in watch or serve mode, read uevents from a datagram socket created at PATH "
+                           "instead of the kernel (for replaying recorded events)")
+    parser.add_option("--serve", metavar="PATH",
+                      help="keep running and answer queries about attached Kindles on the Unix socket PATH")
+    parser.add_option("--publish", metavar="FILE",
+                      help="write the attached Kindles to the shared memory table FILE for other "
+                           "processes to read (see sharedtable.py); '-' for the default in /dev/shm")
+    parser.add_option("--interval", type="float", default=2.0, metavar="SECONDS",
+                      help="with --serve and no sysfs, rescan every SECONDS (default: %default)")
+    parser.add_option("--sysfs", metavar="DIR", default="/sys",
+                      help="sysfs mount point (default: %default)")
+    parser.add_option("--timeout", type="float", default=None, metavar="SECONDS",
+                      help="give up on a discovery backend (UDisks, libusb) after SECONDS")
+    parser.add_option("--workers", type="int", default=8,
+                      help="read serials of up to this many devices at once over libusb (default: %default)")
+    parser.add_option("--device-timeout", type="float", default=2.0, metavar="SECONDS",
+                      help="give up on a device that doesn't answer over libusb within SECONDS (default: %default)")
+    parser.add_option("--retries", type="int", default=1,
+                      help="retry a failed libusb read this many times (default: %default)")
+    parser.add_option("--first", action="store_true", default=False,
+                      help="report the devices of the first discovery backend to finish with any found")
+    parser.add_option("--usb-stats", metavar="FILE",
+                      help="record timings of every libusb call and write them to FILE as JSON")
+    parser.add_option("--trace", metavar="FILE",
+                      help="record wall and CPU time of every discovery phase and device, write them "
+                           "to FILE as Chrome trace events and print the slowest to stderr")
+    options, args = parser.parse_args(argv)
+
+    if options.usb_stats:
+        import pylibusb
+        pylibusb.enable_instrumentation()
+    if options.trace:
+        tracing.start()
+    try:
+        with tracing.span('run', 'kdt'):
+            run(options)
+    finally:
+        if options.trace:
+            writeTrace(tracing.stop(), options.trace)
+        if options.usb_stats:
+            pylibusb.dump_instrumentation(options.usb_stats)
+
+def writeTrace(tracer, filename):
+    try:
+        tracer.save(filename)
+    except IOError, error:
+        sys.stderr.write("ERR Can't write trace: %s\n"%str(error))
+    sys.stderr.write(tracer.summary())
+
+def run(options):
+    if options.models:
+        try:
+            models.registry.load(options.models)
+        except (IOError, ValueError), error:
+            sys.stderr.write("ERR Can't read models: %s\n"%str(error))
+            sys.exit(1)
+
+    if options.inventory:
+        runInventory(options.inventory)
+        return
+
+    if options.topology:
+        writeTopology(options.topology)
+        return
+
+    if options.batch:
+        runBatch(options.batch, options.jobs, options.chunk, options.ordered)
+        return
+
+    cache = None
+    if options.cache or options.history:
+        import devicecache
+        try:
+            cache = devicecache.DeviceCache(options.cache, options.cache_size)
+        except Exception, error:
+            sys.stderr.write("ERR Can't open device cache: %s\n"%str(error))
+            if options.history:
+                sys.exit(1)
+
+    if options.history:
+        printHistory(cache)
+        return
+
+    publish = None
+    if options.publish:
+        import sharedtable
+        path = options.publish
+        if path == '-':
+            path = None
+        try:
+            publish = sharedtable.TableWriter(path)
+        except EnvironmentError, error:
+            sys.stderr.write("ERR Can't open device table: %s\n"%str(error))
+            sys.exit(1)
+
+    if options.watch:
+        runWatch(cache, options.sysfs, options.uevent_socket, publish)
+        return
+
+    if options.serve:
+        runServe(cache, options.sysfs, options.serve, options.uevent_socket, options.interval,
+                 lambda: findSerials(options.sysfs, options.timeout, False, options.workers,
+                                     options.device_timeout, options.retries), publish)
+        return
+
+    serials = findSerials(options.sysfs, options.timeout, options.first,
+                          options.workers, options.device_timeout, options.retries)
+    described = []
+    if serials:
+        described = describeSerials(serials, cache)
+    if publish is not None:
+        publish.publish(described)
+    if len(serials)==0:
+        print "No Kindle devices found"
+    else:
+        for serial, model, password in described:
+            print "Device: %s\nSerial: %s\nPassword: %s"%(model,serial,password)
+
+if __name__ == "__main__":
+    main()
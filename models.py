@@ -0,0 +1,148 @@
+"""Kindle model registry for kdt.py.
+
+A Kindle serial number is 16 upper case letters and digits that start
+with a device code: B001 is a Kindle 1, B008 a Kindle 3 WIFI, and so on.
+The registry maps code prefixes of any length to model names and
+compiles them into one dict per prefix length, so a lookup is a few dict
+probes, longest prefix first. Codes for newer devices can be added from
+a data file, one "PREFIX  Model name" per line:
+
+    # comments and blank lines are ignored
+    G000S1  Kindle Voyage
+"""
+import re
+
+MODELS = [
+    ('B001', 'Kindle 1'),
+    ('B002', 'Kindle 2 U.S.'),
+    ('B003', 'Kindle 2 international'),
+    ('B004', 'Kindle DX U.S.'),
+    ('B005', 'Kindle DX international'),
+    ('B006', 'Kindle 3 3G + WIFI U.S.'),
+    ('B008', 'Kindle 3 WIFI'),
+    ('B009', 'Kindle DX Graphite'),
+    ('B00A', 'Kindle 3 3G + WIFI European'),
+    ('B00E', 'Kindle 4'),
+    ('B00F', 'Kindle Touch 3G + WIFI U.S.'),
+    ('B010', 'Kindle Touch 3G + WIFI European'),
+    ('B011', 'Kindle Touch WIFI'),
+    ('B023', 'Kindle 4 (2012)'),
+    ('9023', 'Kindle 4 (2012)'),
+    ('B024', 'Kindle Paperwhite WIFI'),
+    ('B01B', 'Kindle Paperwhite 3G + WIFI Canada'),
+    ('B01C', 'Kindle Paperwhite 3G + WIFI'),
+    ('B01D', 'Kindle Paperwhite 3G + WIFI Japan'),
+    ('B01F', 'Kindle Paperwhite 3G + WIFI Brazil'),
+]
+
+SERIAL = re.compile(r'[0-9A-Z]{16}\Z')
+
+# unknown serials are grouped by this many leading characters
+CODE_LENGTH = 4
+
+class Registry(object):
+    def __init__(self, entries=MODELS):
+        self.models = {}
+        self.index = []
+        for prefix, model in entries:
+            self.models[prefix] = model
+        self.compile()
+
+    def compile(self):
+        """Rebuilds the per-length index, longest prefixes first"""
+        tables = {}
+        for prefix, model in self.models.iteritems():
+            tables.setdefault(len(prefix), {})[prefix] = model
+        self.index = [(length, tables[length]) for length in sorted(tables, reverse=True)]
+        if self.index:
+            self.longest = self.index[0][0]
+        else:
+            self.longest = 0
+
+    def add(self, prefix, model):
+        self.models[prefix] = model
+        self.compile()
+
+    def load(self, path):
+        """Adds the entries of a data file, replacing known prefixes"""
+        f = open(path)
+        try:
+            for number, line in enumerate(f):
+                line = line.split('#', 1)[0].strip()
+                if not line:
+                    continue
+                fields = line.split(None, 1)
+                if len(fields) != 2:
+                    raise ValueError("%s:%d: expected a prefix and a model name"%(path, number+1))
+                self.models[fields[0].upper()] = fields[1]
+        finally:
+            f.close()
+        self.compile()
+
+    def lookup(self, serial):
+        """Model name for serial, None for unknown codes"""
+        for length, table in self.index:
+            model = table.get(serial[:length])
+            if model is not None:
+                return model
+        return None
+
+    def valid(self, serial):
+        return SERIAL.match(serial) is not None
+
+    def summarize(self, serials):
+        """Classifies an iterable of serials and returns an Inventory.
+
+        Serials are only counted per longest-prefix key while streaming;
+        each distinct key is looked up once at the end, so memory for the
+        counts depends on the number of device codes, not of serials.
+        Duplicates are found from a machine word hash of each serial."""
+        import array
+        counts = {}
+        hashes = array.array('l')
+        remember = hashes.append
+        valid = SERIAL.match
+        longest = max(self.longest, CODE_LENGTH)
+        invalid = 0
+        for serial in serials:
+            if valid(serial) is None:
+                invalid += 1
+                continue
+            key = serial[:longest]
+            counts[key] = counts.get(key, 0)+1
+            remember(hash(serial))
+        inventory = Inventory()
+        inventory.invalid = invalid
+        inventory.total = len(hashes)+invalid
+        for key, count in counts.iteritems():
+            model = self.lookup(key)
+            if model is None:
+                code = key[:CODE_LENGTH]
+                inventory.unknown[code] = inventory.unknown.get(code, 0)+count
+            else:
+                inventory.models[model] = inventory.models.get(model, 0)+count
+        inventory.duplicates = countDuplicates(hashes)
+        return inventory
+
+def countDuplicates(hashes):
+    """Number of entries of an array of hashes that repeat an earlier one"""
+    if not hashes:
+        return 0
+    try:
+        import numpy
+    except ImportError:
+        ordered = sorted(hashes)
+        return sum(1 for i in xrange(1, len(ordered)) if ordered[i] == ordered[i-1])
+    ordered = numpy.sort(numpy.frombuffer(hashes, dtype='l'))
+    return int(numpy.count_nonzero(ordered[1:] == ordered[:-1]))
+
+class Inventory(object):
+    """Counts from Registry.summarize()"""
+    def __init__(self):
+        self.total = 0
+        self.invalid = 0
+        self.duplicates = 0
+        self.models = {}
+        self.unknown = {}
+
+registry = Registry()
@@ -0,0 +1,92 @@
+"""Lane-parallel MD5 of many short messages with NumPy.
+
+Every message of a batch must have the same length and fit into a single
+64 byte MD5 block, i.e. be at most 55 bytes long. That is always the case
+for the "<serial>\\n" strings hashed by kdt.py. The messages are laid out
+side by side, one lane per message, and each of the 64 MD5 steps becomes
+a handful of NumPy operations over all lanes at once.
+"""
+import math, struct
+import numpy
+
+MAX_LENGTH = 55
+
+_S = [7,12,17,22]*4 + [5,9,14,20]*4 + [4,11,16,23]*4 + [6,10,15,21]*4
+_K = [int(abs(math.sin(i+1))*2**32) & 0xffffffff for i in range(64)]
+_G = [i for i in range(16)] + [(5*i+1)%16 for i in range(16)] +\
+     [(3*i+5)%16 for i in range(16)] + [(7*i)%16 for i in range(16)]
+_INIT = (0x67452301, 0xefcdab89, 0x98badcfe, 0x10325476)
+
+def pack(data, length):
+    """Returns the 16 padded message words of every lane.
+
+    data is the concatenation of n messages of length bytes each. Words
+    that differ between messages are (n,) uint32 arrays; the padding words
+    after them are the same in every lane and are returned as plain ints,
+    or None when zero, so the hashing loop can skip them."""
+    if length > MAX_LENGTH:
+        raise ValueError('messages longer than %d bytes need more than one block'%MAX_LENGTH)
+    if length == 0 or len(data)%length:
+        raise ValueError('data is not a whole number of %d byte messages'%length)
+    n = len(data)//length
+    # the 0x80 terminator always lands in the last per-lane word
+    varying = length//4+1
+    block = numpy.zeros((n, varying*4), dtype=numpy.uint8)
+    block[:, :length] = numpy.frombuffer(data, dtype=numpy.uint8).reshape(n, length)
+    block[:, length] = 0x80
+    lanes = numpy.ascontiguousarray(block.view('<u4').T.astype(numpy.uint32))
+    words = [lanes[i] for i in range(varying)] + [None]*(16-varying)
+    words[14] = (length*8) & 0xffffffff
+    return words
+
+def md5_lanes(data, length):
+    """Hashes the equal-length single-block messages concatenated in data.
+
+    Returns the four digest words (a, b, c, d) as uint32 arrays with one
+    element per message; hashlib's digest is their little-endian
+    concatenation."""
+    words = pack(data, length)
+    n = len(data)//length
+    a = numpy.empty(n, dtype=numpy.uint32); a.fill(_INIT[0])
+    b = numpy.empty(n, dtype=numpy.uint32); b.fill(_INIT[1])
+    c = numpy.empty(n, dtype=numpy.uint32); c.fill(_INIT[2])
+    d = numpy.empty(n, dtype=numpy.uint32); d.fill(_INIT[3])
+    f = numpy.empty(n, dtype=numpy.uint32)
+    t = numpy.empty(n, dtype=numpy.uint32)
+    for i in range(64):
+        # F and G in the cheaper d ^ (b & (c ^ d)) form
+        if i < 16:
+            numpy.bitwise_xor(c, d, out=f)
+            f &= b
+            f ^= d
+        elif i < 32:
+            numpy.bitwise_xor(b, c, out=f)
+            f &= d
+            f ^= c
+        elif i < 48:
+            numpy.bitwise_xor(b, c, out=f)
+            f ^= d
+        else:
+            numpy.invert(d, out=f)
+            f |= b
+            f ^= c
+        f += a
+        word = words[_G[i]]
+        if isinstance(word, numpy.ndarray):
+            f += word
+            f += numpy.uint32(_K[i])
+        else:
+            # constant padding words are folded into the round constant
+            f += numpy.uint32((_K[i]+(word or 0)) & 0xffffffff)
+        s = _S[i]
+        numpy.left_shift(f, s, out=t)
+        f >>= 32-s
+        f |= t
+        f += b
+        # the old a is dead now, recycle its buffer for the next f
+        a, b, c, d, f = d, f, b, c, a
+    a += numpy.uint32(_INIT[0])
+    b += numpy.uint32(_INIT[1])
+    c += numpy.uint32(_INIT[2])
+    d += numpy.uint32(_INIT[3])
+    return a, b, c, d
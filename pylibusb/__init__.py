@@ -1 +1,16 @@
 from pylibusb import *
+
+def get_backend():
+    """returns the module implementing pylibusb's device API on the best
+    available library: libusb1 when libusb-1.0 is installed, otherwise the
+    libusb-0.1 wrapper. Set PYLIBUSB_BACKEND=0.1 to force the latter."""
+    import os
+    if os.environ.get('PYLIBUSB_BACKEND') != '0.1':
+        import libusb1
+        try:
+            libusb1.load_library()
+        except OSError:
+            pass
+        else:
+            return libusb1
+    return pylibusb
@@ -0,0 +1,753 @@
+"""libusb-1.0 backend: asynchronous transfers and cached enumeration.
+
+The libusb-0.1 API wrapped by pylibusb.pylibusb only has blocking calls,
+so a thread can have one transfer in flight at a time. libusb-1.0 lets
+transfers be submitted up front and reports their completion from
+libusb_handle_events(); TransferQueue keeps a fixed number of them queued
+on an endpoint and resubmits each one as soon as it completes.
+
+Completions are delivered by whichever event loop watches libusb's file
+descriptors: Context.attach() takes add_reader/remove_reader style
+callables (the shape of asyncio's loop methods), and EventLoop is a
+small select.poll() based loop for callers that have none.
+
+The module also offers the enumeration part of pylibusb's API (init,
+find_busses, find_devices, get_busses, find, open, get_string_simple,
+close) on top of libusb_get_device_list. The device list is kept, with a
+reference on every device, and only fetched again when a hotplug
+callback reports a change; pylibusb.get_backend() picks this module when
+libusb-1.0 is installed.
+"""
+import sys
+import ctypes
+import collections
+import select
+import time
+
+import pylibusb as _usb01
+from pylibusb import USBError, usb_device_descriptor
+import pool as _pool
+import strings as _strings
+
+__all__ = ['Context','EventLoop','HandlePool','TransferQueue','LIBUSB_TRANSFER_TYPE_BULK',
+           'LIBUSB_TRANSFER_TYPE_INTERRUPT','USBError','close','find','find_busses',
+           'find_devices','get_busses','get_string_simple','get_strings','init','open']
+
+#####################################
+# typedefs and defines
+LIBUSB_TRANSFER_TYPE_CONTROL = 0
+LIBUSB_TRANSFER_TYPE_ISOCHRONOUS = 1
+LIBUSB_TRANSFER_TYPE_BULK = 2
+LIBUSB_TRANSFER_TYPE_INTERRUPT = 3
+
+LIBUSB_TRANSFER_COMPLETED = 0
+LIBUSB_TRANSFER_ERROR = 1
+LIBUSB_TRANSFER_TIMED_OUT = 2
+LIBUSB_TRANSFER_CANCELLED = 3
+LIBUSB_TRANSFER_STALL = 4
+LIBUSB_TRANSFER_NO_DEVICE = 5
+LIBUSB_TRANSFER_OVERFLOW = 6
+
+LIBUSB_ENDPOINT_IN = 0x80
+
+LIBUSB_CAP_HAS_HOTPLUG = 0x0003
+LIBUSB_HOTPLUG_EVENT_DEVICE_ARRIVED = 0x01
+LIBUSB_HOTPLUG_EVENT_DEVICE_LEFT = 0x02
+LIBUSB_HOTPLUG_MATCH_ANY = -1
+
+POLLIN = getattr(select, 'POLLIN', 1)
+POLLOUT = getattr(select, 'POLLOUT', 4)
+
+class libusb_context(ctypes.Structure):
+    pass
+class libusb_device(ctypes.Structure):
+    pass
+class libusb_device_handle(ctypes.Structure):
+    pass
+class libusb_transfer(ctypes.Structure):
+    pass
+
+libusb_context_p = ctypes.POINTER(libusb_context)
+libusb_device_p = ctypes.POINTER(libusb_device)
+libusb_device_handle_p = ctypes.POINTER(libusb_device_handle)
+libusb_transfer_p = ctypes.POINTER(libusb_transfer)
+
+libusb_transfer_cb_fn = ctypes.CFUNCTYPE(None, libusb_transfer_p)
+libusb_pollfd_added_cb = ctypes.CFUNCTYPE(None, ctypes.c_int, ctypes.c_short, ctypes.c_void_p)
+libusb_pollfd_removed_cb = ctypes.CFUNCTYPE(None, ctypes.c_int, ctypes.c_void_p)
+libusb_hotplug_callback_fn = ctypes.CFUNCTYPE(ctypes.c_int, libusb_context_p, libusb_device_p,
+                                              ctypes.c_int, ctypes.c_void_p)
+
+libusb_transfer._fields_ = [
+    ('dev_handle',libusb_device_handle_p),
+    ('flags',ctypes.c_uint8),
+    ('endpoint',ctypes.c_ubyte),
+    ('type',ctypes.c_ubyte),
+    ('timeout',ctypes.c_uint),
+    ('status',ctypes.c_int),
+    ('length',ctypes.c_int),
+    ('actual_length',ctypes.c_int),
+    ('callback',libusb_transfer_cb_fn),
+    ('user_data',ctypes.c_void_p),
+    ('buffer',ctypes.c_void_p),
+    ('num_iso_packets',ctypes.c_int),
+    ]
+
+class libusb_pollfd(ctypes.Structure):
+    _fields_ = [
+        ('fd',ctypes.c_int),
+        ('events',ctypes.c_short),
+        ]
+
+class timeval(ctypes.Structure):
+    _fields_ = [
+        ('tv_sec',ctypes.c_long),
+        ('tv_usec',ctypes.c_long),
+        ]
+
+#####################################
+# library loading, deferred like pylibusb's
+
+if sys.platform.startswith('linux'):
+    c_libusb1_shared_library = 'libusb-1.0.so.0'
+elif sys.platform.startswith('win'):
+    c_libusb1_shared_library = 'libusb-1.0.dll'
+elif sys.platform.startswith('darwin'):
+    c_libusb1_shared_library = 'libusb-1.0.0.dylib'
+else:
+    c_libusb1_shared_library = None
+
+c_libusb1 = None
+_raw_libusb1 = None
+
+def _instrument(enabled):
+    """called by pylibusb.enable_instrumentation() and
+    disable_instrumentation() to put c_libusb1 behind the timing proxy"""
+    global c_libusb1
+    if _raw_libusb1 is None:
+        return
+    if enabled:
+        c_libusb1 = _usb01._InstrumentedLibrary(_raw_libusb1)
+    else:
+        c_libusb1 = _raw_libusb1
+
+_usb01._instrumented_backends.append(_instrument)
+
+def _declare_prototypes(lib):
+    lib.libusb_init.argtypes = [ctypes.POINTER(libusb_context_p)]
+    lib.libusb_exit.argtypes = [libusb_context_p]
+    lib.libusb_exit.restype = None
+    lib.libusb_error_name.argtypes = [ctypes.c_int]
+    lib.libusb_error_name.restype = ctypes.c_char_p
+
+    lib.libusb_open_device_with_vid_pid.argtypes = [libusb_context_p,
+                                                    ctypes.c_uint16, ctypes.c_uint16]
+    lib.libusb_open_device_with_vid_pid.restype = libusb_device_handle_p
+    lib.libusb_close.argtypes = [libusb_device_handle_p]
+    lib.libusb_close.restype = None
+    lib.libusb_claim_interface.argtypes = [libusb_device_handle_p, ctypes.c_int]
+
+    lib.libusb_alloc_transfer.argtypes = [ctypes.c_int]
+    lib.libusb_alloc_transfer.restype = libusb_transfer_p
+    lib.libusb_free_transfer.argtypes = [libusb_transfer_p]
+    lib.libusb_free_transfer.restype = None
+    lib.libusb_submit_transfer.argtypes = [libusb_transfer_p]
+    lib.libusb_cancel_transfer.argtypes = [libusb_transfer_p]
+
+    lib.libusb_handle_events_timeout.argtypes = [libusb_context_p, ctypes.POINTER(timeval)]
+    lib.libusb_get_next_timeout.argtypes = [libusb_context_p, ctypes.POINTER(timeval)]
+    lib.libusb_pollfds_handle_timeouts.argtypes = [libusb_context_p]
+    lib.libusb_get_pollfds.argtypes = [libusb_context_p]
+    lib.libusb_get_pollfds.restype = ctypes.POINTER(ctypes.POINTER(libusb_pollfd))
+    lib.libusb_set_pollfd_notifiers.argtypes = [libusb_context_p, libusb_pollfd_added_cb,
+                                                libusb_pollfd_removed_cb, ctypes.c_void_p]
+    lib.libusb_set_pollfd_notifiers.restype = None
+
+    lib.libusb_get_device_list.argtypes = [libusb_context_p,
+                                           ctypes.POINTER(ctypes.POINTER(libusb_device_p))]
+    lib.libusb_get_device_list.restype = ctypes.c_ssize_t
+    lib.libusb_free_device_list.argtypes = [ctypes.POINTER(libusb_device_p), ctypes.c_int]
+    lib.libusb_free_device_list.restype = None
+    lib.libusb_ref_device.argtypes = [libusb_device_p]
+    lib.libusb_ref_device.restype = libusb_device_p
+    lib.libusb_unref_device.argtypes = [libusb_device_p]
+    lib.libusb_unref_device.restype = None
+    lib.libusb_get_device_descriptor.argtypes = [libusb_device_p,
+                                                 ctypes.POINTER(usb_device_descriptor)]
+    lib.libusb_get_bus_number.argtypes = [libusb_device_p]
+    lib.libusb_get_bus_number.restype = ctypes.c_uint8
+    lib.libusb_get_device_address.argtypes = [libusb_device_p]
+    lib.libusb_get_device_address.restype = ctypes.c_uint8
+    lib.libusb_open.argtypes = [libusb_device_p, ctypes.POINTER(libusb_device_handle_p)]
+    lib.libusb_get_string_descriptor_ascii.argtypes = [libusb_device_handle_p, ctypes.c_uint8,
+                                                       ctypes.c_char_p, ctypes.c_int]
+    lib.libusb_control_transfer.argtypes = [libusb_device_handle_p, ctypes.c_uint8, ctypes.c_uint8,
+                                            ctypes.c_uint16, ctypes.c_uint16, ctypes.c_char_p,
+                                            ctypes.c_uint16, ctypes.c_uint]
+    lib.libusb_get_device.argtypes = [libusb_device_handle_p]
+    lib.libusb_get_device.restype = libusb_device_p
+    lib.libusb_has_capability.argtypes = [ctypes.c_uint32]
+    lib.libusb_hotplug_register_callback.argtypes = [
+        libusb_context_p, ctypes.c_int, ctypes.c_int, ctypes.c_int, ctypes.c_int, ctypes.c_int,
+        libusb_hotplug_callback_fn, ctypes.c_void_p, ctypes.POINTER(ctypes.c_int)]
+
+def load_library():
+    """returns the libusb-1.0 CDLL, loading it on first use
+
+    Raises OSError when libusb-1.0 is not installed."""
+    global c_libusb1
+    if c_libusb1 is not None:
+        return c_libusb1
+    try:
+        if c_libusb1_shared_library is None:
+            raise OSError
+        lib = ctypes.CDLL(c_libusb1_shared_library)
+    except OSError:
+        from ctypes.util import find_library
+        path = find_library('usb-1.0')
+        if path is None:
+            raise OSError('could not find the libusb-1.0 shared library')
+        lib = ctypes.CDLL(path)
+    global _raw_libusb1
+    _declare_prototypes(lib)
+    _raw_libusb1 = c_libusb1 = lib
+    _instrument(_usb01._instrumented)
+    return c_libusb1
+
+def CHK(result):
+    if result < 0:
+        raise USBError("%d: %s"%(result,c_libusb1.libusb_error_name(result)))
+    return result
+
+#####################################
+# context and event handling
+
+class Context(object):
+    """wraps a libusb_context"""
+    def __init__(self):
+        lib = load_library()
+        self.cval = libusb_context_p()
+        CHK(lib.libusb_init(ctypes.byref(self.cval)))
+        self._notifiers = None
+
+    def close(self):
+        if self.cval:
+            self.detach()
+            c_libusb1.libusb_exit(self.cval)
+            self.cval = libusb_context_p()
+
+    def open_device_with_vid_pid(self,idVendor,idProduct):
+        handle = c_libusb1.libusb_open_device_with_vid_pid(self.cval,idVendor,idProduct)
+        if not bool(handle):
+            raise USBError("could not open device %04x:%04x"%(idVendor,idProduct))
+        return handle
+
+    def handle_events(self,timeout=0.0):
+        """processes pending events, running completion callbacks; waits at
+        most timeout seconds for one to arrive"""
+        tv = timeval(int(timeout), int((timeout-int(timeout))*1e6))
+        return CHK(c_libusb1.libusb_handle_events_timeout(self.cval, ctypes.byref(tv)))
+
+    def get_next_timeout(self):
+        """seconds until libusb next needs handle_events() for a transfer
+        timeout, or None"""
+        tv = timeval()
+        if CHK(c_libusb1.libusb_get_next_timeout(self.cval, ctypes.byref(tv))) == 0:
+            return None
+        return tv.tv_sec+tv.tv_usec*1e-6
+
+    def pollfds_handle_timeouts(self):
+        return bool(c_libusb1.libusb_pollfds_handle_timeouts(self.cval))
+
+    def get_pollfds(self):
+        """returns [(fd, events)] libusb currently wants watched"""
+        fds = c_libusb1.libusb_get_pollfds(self.cval)
+        if not bool(fds):
+            raise USBError("libusb_get_pollfds failed")
+        result = []
+        i = 0
+        while fds[i]:
+            result.append((fds[i].contents.fd, fds[i].contents.events))
+            i += 1
+        if hasattr(c_libusb1, 'libusb_free_pollfds'):
+            c_libusb1.libusb_free_pollfds(fds)
+        return result
+
+    def attach(self,add_reader,remove_reader,add_writer=None,remove_writer=None,
+               call_later=None):
+        """hands libusb's file descriptors to an event loop
+
+        add_reader(fd, callback) and friends follow asyncio's loop API; the
+        callback runs handle_events(0). call_later(delay, callback) is only
+        used on platforms where libusb can't express its timeouts as file
+        descriptors."""
+        if add_writer is None:
+            add_writer, remove_writer = add_reader, remove_reader
+        watched = {}
+        def ready(*args):
+            self.handle_events(0)
+            reschedule()
+        def reschedule():
+            if call_later is not None and not self.pollfds_handle_timeouts():
+                timeout = self.get_next_timeout()
+                if timeout is not None:
+                    call_later(timeout, ready)
+        def added(fd,events,user_data):
+            watched[fd] = events
+            if events & POLLIN:
+                add_reader(fd, ready)
+            if events & POLLOUT:
+                add_writer(fd, ready)
+        def removed(fd,user_data):
+            events = watched.pop(fd, 0)
+            if events & POLLIN:
+                remove_reader(fd)
+            if events & POLLOUT:
+                remove_writer(fd)
+        self.detach()
+        # the ctypes callbacks must outlive the registration
+        self._notifiers = (libusb_pollfd_added_cb(added), libusb_pollfd_removed_cb(removed),
+                           watched, removed)
+        for fd, events in self.get_pollfds():
+            added(fd, events, None)
+        c_libusb1.libusb_set_pollfd_notifiers(self.cval, self._notifiers[0],
+                                              self._notifiers[1], None)
+        reschedule()
+
+    def detach(self):
+        if self._notifiers is None:
+            return
+        added, removed_cb, watched, removed = self._notifiers
+        c_libusb1.libusb_set_pollfd_notifiers(self.cval, libusb_pollfd_added_cb(),
+                                              libusb_pollfd_removed_cb(), None)
+        for fd in list(watched):
+            removed(fd, None)
+        self._notifiers = None
+
+class EventLoop(object):
+    """minimal select.poll() loop driving one Context"""
+    def __init__(self,context):
+        self.context = context
+        self.poller = select.poll()
+        self.callbacks = {}
+        self.running = False
+        context.attach(self._add_reader, self._remove, self._add_writer, self._remove)
+
+    def _register(self,fd,events,callback):
+        old = self.callbacks.get(fd, (0, None))[0]
+        self.callbacks[fd] = (old|events, callback)
+        self.poller.register(fd, old|events)
+    def _add_reader(self,fd,callback):
+        self._register(fd, POLLIN, callback)
+    def _add_writer(self,fd,callback):
+        self._register(fd, POLLOUT, callback)
+    def _remove(self,fd):
+        if self.callbacks.pop(fd, None) is not None:
+            self.poller.unregister(fd)
+
+    def run(self,until=None,timeout=None):
+        """dispatches completions until stop() is called, until() returns
+        true, or timeout seconds have passed"""
+        self.running = True
+        deadline = None
+        if timeout is not None:
+            deadline = time.time()+timeout
+        while self.running and not (until is not None and until()):
+            wait = self.context.get_next_timeout()
+            if deadline is not None:
+                left = max(0.0, deadline-time.time())
+                if left == 0.0:
+                    break
+                if wait is None or left < wait:
+                    wait = left
+            if wait is None:
+                events = self.poller.poll()
+            else:
+                events = self.poller.poll(int(wait*1000)+1)
+            # one handle_events call serves every ready descriptor, and also
+            # fires expired transfer timeouts when nothing was ready
+            self.context.handle_events(0)
+        self.running = False
+
+    def stop(self):
+        self.running = False
+
+    def close(self):
+        self.context.detach()
+
+#####################################
+# transfers
+
+class _Transfer(object):
+    def __init__(self,size):
+        self.cval = c_libusb1.libusb_alloc_transfer(0)
+        if not bool(self.cval):
+            raise USBError("libusb_alloc_transfer failed")
+        self.buffer = ctypes.create_string_buffer(size)
+        self.size = size
+    def free(self):
+        if self.cval:
+            c_libusb1.libusb_free_transfer(self.cval)
+            self.cval = libusb_transfer_p()
+
+class TransferQueue(object):
+    """keeps up to depth bulk or interrupt transfers in flight on one endpoint
+
+    For IN endpoints start() submits depth reads; every completed read is
+    passed to callback(data, status) and immediately resubmitted until
+    stop() is called. For OUT endpoints write() submits data right away
+    while fewer than depth transfers are in flight and queues it
+    otherwise; callback(actual_length, status) reports each completion.
+    Callbacks run inside Context.handle_events(), i.e. on the event loop.
+    An exception raised by a callback is kept, counted in callback_errors
+    and raised again by check(); the queue carries on.
+    """
+    def __init__(self,handle,endpoint,callback,size=16384,depth=8,
+                 transfer_type=LIBUSB_TRANSFER_TYPE_BULK,timeout=0):
+        if not isinstance(handle,libusb_device_handle_p):
+            raise ValueError("expected instance of libusb_device_handle_p")
+        load_library()
+        self.handle = handle
+        self.endpoint = endpoint
+        self.callback = callback
+        self.size = size
+        self.depth = depth
+        self.transfer_type = transfer_type
+        self.timeout = timeout
+        self.is_in = bool(endpoint & LIBUSB_ENDPOINT_IN)
+        self.running = False
+        self.backlog = collections.deque()
+        self.bytes = 0
+        self.completed = 0
+        self.errors = 0
+        self.callback_errors = 0
+        self.error = None
+        self._c_callback = libusb_transfer_cb_fn(self._complete)
+        self.transfers = [_Transfer(size) for i in range(depth)]
+        self.idle = list(range(depth))
+        self.in_flight = 0
+
+    def _submit(self,index,length):
+        t = self.transfers[index]
+        c = t.cval.contents
+        c.dev_handle = self.handle
+        c.endpoint = self.endpoint
+        c.type = self.transfer_type
+        c.timeout = self.timeout
+        c.length = length
+        c.buffer = ctypes.addressof(t.buffer)
+        c.callback = self._c_callback
+        c.user_data = index
+        CHK(c_libusb1.libusb_submit_transfer(t.cval))
+        self.in_flight += 1
+
+    def _complete(self,transfer_p):
+        c = transfer_p.contents
+        index = c.user_data or 0
+        t = self.transfers[index]
+        self.in_flight -= 1
+        status, actual = c.status, c.actual_length
+        if status == LIBUSB_TRANSFER_COMPLETED:
+            self.completed += 1
+            self.bytes += actual
+        elif status != LIBUSB_TRANSFER_CANCELLED:
+            self.errors += 1
+        # never raise into libusb: ctypes would only print the exception
+        try:
+            if self.is_in:
+                if status != LIBUSB_TRANSFER_CANCELLED:
+                    self.callback(t.buffer.raw[:actual], status)
+            else:
+                self.callback(actual, status)
+        except Exception:
+            self.callback_errors += 1
+            if self.error is None:
+                self.error = sys.exc_info()
+        finally:
+            if self.is_in and self.running and status not in (LIBUSB_TRANSFER_CANCELLED,
+                                                              LIBUSB_TRANSFER_NO_DEVICE):
+                try:
+                    self._submit(index, self.size)
+                except USBError:
+                    self.idle.append(index)
+            elif not self.is_in and self.backlog:
+                data = self.backlog.popleft()
+                ctypes.memmove(t.buffer, data, len(data))
+                try:
+                    self._submit(index, len(data))
+                except USBError:
+                    self.idle.append(index)
+            else:
+                self.idle.append(index)
+
+    def check(self):
+        """raises the first exception a callback raised since the last
+        check(), with its traceback"""
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error[0], error[1], error[2]
+
+    def start(self):
+        if not self.is_in:
+            raise ValueError("start() is only for IN endpoints, use write()")
+        self.running = True
+        while self.idle:
+            self._submit(self.idle.pop(), self.size)
+
+    def write(self,data):
+        if self.is_in:
+            raise ValueError("write() is only for OUT endpoints")
+        if len(data) > self.size:
+            raise ValueError("data is larger than the transfer size %d"%self.size)
+        if self.idle:
+            index = self.idle.pop()
+            ctypes.memmove(self.transfers[index].buffer, data, len(data))
+            self._submit(index, len(data))
+        else:
+            self.backlog.append(data)
+
+    def stop(self):
+        """cancels the transfers in flight; their completions still arrive
+        through the event loop with status LIBUSB_TRANSFER_CANCELLED"""
+        self.running = False
+        self.backlog.clear()
+        for i, t in enumerate(self.transfers):
+            if i not in self.idle:
+                c_libusb1.libusb_cancel_transfer(t.cval)
+
+    def close(self):
+        """frees the transfers; call once in_flight has dropped to zero"""
+        if self.in_flight:
+            raise USBError("%d transfers still in flight"%self.in_flight)
+        for t in self.transfers:
+            t.free()
+        self.transfers = []
+        self.idle = []
+
+#####################################
+# enumeration
+
+class _device(object):
+    """a libusb_device from the cached list, with its descriptor read once;
+    holds a reference on the device for as long as it is alive, so devices
+    handed out before a rescan stay valid"""
+    __slots__ = ('cval','descriptor','bus_number','devnum')
+    def __init__(self,cval):
+        self.cval = c_libusb1.libusb_ref_device(cval)
+        self.descriptor = usb_device_descriptor()
+        CHK(c_libusb1.libusb_get_device_descriptor(self.cval,ctypes.byref(self.descriptor)))
+        self.bus_number = c_libusb1.libusb_get_bus_number(self.cval)
+        self.devnum = c_libusb1.libusb_get_device_address(self.cval)
+    def unref(self):
+        if self.cval:
+            c_libusb1.libusb_unref_device(self.cval)
+            self.cval = libusb_device_p()
+    def __del__(self):
+        if c_libusb1 is not None: # not at interpreter shutdown
+            self.unref()
+
+class bus(object):
+    """the devices of one bus, shaped like pylibusb's bus wrapper"""
+    __slots__ = ('dirname','location','devices')
+    def __init__(self,number,devices):
+        self.dirname = '%03d'%number
+        self.location = number
+        self.devices = devices
+
+class DeviceList(object):
+    """libusb_get_device_list() result cached across scans
+
+    With hotplug support the list is fetched again only after a hotplug
+    callback has bumped the generation counter; each check costs one
+    non-blocking handle_events(). Without it, every refresh() rescans,
+    and current() lets find() use the list find_devices() just fetched."""
+    def __init__(self,context):
+        self.context = context
+        self.devices = None
+        self.fresh = False
+        self.generation = 0
+        self.scanned_generation = -1
+        self.hotplug = False
+        self._hotplug_cb = None
+        if c_libusb1.libusb_has_capability(LIBUSB_CAP_HAS_HOTPLUG):
+            self._hotplug_cb = libusb_hotplug_callback_fn(self._changed)
+            handle = ctypes.c_int()
+            if c_libusb1.libusb_hotplug_register_callback(
+                    context.cval,
+                    LIBUSB_HOTPLUG_EVENT_DEVICE_ARRIVED|LIBUSB_HOTPLUG_EVENT_DEVICE_LEFT,
+                    0, LIBUSB_HOTPLUG_MATCH_ANY, LIBUSB_HOTPLUG_MATCH_ANY,
+                    LIBUSB_HOTPLUG_MATCH_ANY, self._hotplug_cb, None,
+                    ctypes.byref(handle)) == 0:
+                self.hotplug = True
+
+    def _changed(self,ctx,dev,event,user_data):
+        self.generation += 1
+        return 0 # stay registered
+
+    def stale(self):
+        if self.devices is None or not self.hotplug:
+            return True
+        self.context.handle_events(0)
+        return self.generation != self.scanned_generation
+
+    def refresh(self):
+        """fetches the list again if anything may have changed"""
+        if not self.stale():
+            return False
+        generation = self.generation
+        listp = ctypes.POINTER(libusb_device_p)()
+        count = CHK(c_libusb1.libusb_get_device_list(self.context.cval,ctypes.byref(listp)))
+        try:
+            devices = [_device(listp[i]) for i in range(count)]
+        finally:
+            c_libusb1.libusb_free_device_list(listp,1)
+        self.devices = devices
+        self.fresh = True
+        self.scanned_generation = generation
+        if _string_cache.devices:
+            _string_cache.prune(set([(dev.bus_number,dev.devnum,dev.descriptor.bcdDevice)
+                                     for dev in devices]))
+        return True
+
+    def current(self):
+        """the device list, refreshed unless that was just done and not
+        used yet"""
+        if not self.fresh:
+            self.refresh()
+        self.fresh = False
+        return self.devices
+
+    def clear(self):
+        """drops the list; each device releases its reference once nobody
+        else holds it"""
+        self.devices = None
+        self.fresh = False
+
+# module level API matching pylibusb's, on one default context
+_context = None
+_device_list = None
+
+def init():
+    global _context, _device_list
+    if _context is None:
+        _context = Context()
+        _device_list = DeviceList(_context)
+
+def find_busses():
+    """nothing to do: libusb-1.0 lists devices and busses together, see
+    find_devices()"""
+
+def find_devices():
+    _device_list.refresh()
+
+def get_busses():
+    """returns a list of bus objects, empty until the first scan"""
+    if not _device_list.devices:
+        return []
+    numbers = {}
+    for dev in _device_list.devices:
+        numbers.setdefault(dev.bus_number,[]).append(dev)
+    return [bus(number,numbers[number]) for number in sorted(numbers)]
+
+def find(idVendor=None,idProduct=None,serial=None):
+    """yields the matching devices of the cached list, rescanning first
+    when hotplug reported a change, or without hotplug unless
+    find_devices() has just scanned"""
+    for dev in _device_list.current():
+        desc = dev.descriptor
+        if ((idVendor is None or desc.idVendor == idVendor) and
+            (idProduct is None or desc.idProduct == idProduct)):
+            if serial is not None:
+                if not desc.iSerialNumber:
+                    continue
+                try:
+                    handle = open(dev)
+                except USBError:
+                    continue
+                try:
+                    if get_string_simple(handle,desc.iSerialNumber) != serial:
+                        continue
+                except USBError:
+                    continue
+                finally:
+                    close(handle)
+            yield dev
+
+def open(dev):
+    if not isinstance(dev,_device):
+        raise ValueError('open() must be called with pylibusb.libusb1._device instance')
+    handle = libusb_device_handle_p()
+    CHK(c_libusb1.libusb_open(dev.cval,ctypes.byref(handle)))
+    return handle
+
+def close(libusb_handle):
+    if not isinstance(libusb_handle,libusb_device_handle_p):
+        raise ValueError("expected instance of libusb_device_handle_p")
+    c_libusb1.libusb_close(libusb_handle)
+    return 0
+
+def get_string_simple(libusb_handle,index):
+    if not isinstance(libusb_handle,libusb_device_handle_p):
+        raise ValueError("expected instance of libusb_device_handle_p")
+    buflen = 256
+    buf = ctypes.create_string_buffer(buflen)
+    CHK(c_libusb1.libusb_get_string_descriptor_ascii(libusb_handle,index,buf,buflen))
+    return buf.value
+
+# string descriptors, cached per device until a rescan no longer sees it
+
+LIBUSB_REQUEST_GET_DESCRIPTOR = 0x06
+LIBUSB_DT_STRING = 0x03
+STRING_TIMEOUT = 1000
+
+_string_cache = _strings.StringCache()
+
+def _get_strings(libusb_handle,indices):
+    buflen = 255
+    buf = ctypes.create_string_buffer(buflen)
+    def get_descriptor(index,langid):
+        # libusb_get_string_descriptor() is a header inline, not exported
+        n = CHK(c_libusb1.libusb_control_transfer(libusb_handle,LIBUSB_ENDPOINT_IN,
+                                                  LIBUSB_REQUEST_GET_DESCRIPTOR,
+                                                  LIBUSB_DT_STRING<<8|index,langid,
+                                                  buf,buflen,STRING_TIMEOUT))
+        return buf.raw[:n]
+    devp = c_libusb1.libusb_get_device(libusb_handle)
+    descriptor = usb_device_descriptor()
+    CHK(c_libusb1.libusb_get_device_descriptor(devp,ctypes.byref(descriptor)))
+    key = (c_libusb1.libusb_get_bus_number(devp),c_libusb1.libusb_get_device_address(devp),
+           descriptor.bcdDevice)
+    return _strings.get_strings(_string_cache,key,get_descriptor,indices)
+
+def get_strings(libusb_handle,indices):
+    """returns the string descriptors indices as a list, None for index 0
+    and malformed ones, raising USBError when a read fails; see
+    pylibusb.get_strings"""
+    if not isinstance(libusb_handle,libusb_device_handle_p):
+        raise ValueError("expected instance of libusb_device_handle_p")
+    return _get_strings(libusb_handle,indices)
+
+class device_handle(_pool.pooled_handle):
+    """an open libusb_device_handle* owned by a HandlePool"""
+    def get_string_simple(self,index):
+        buflen = 256
+        buf = ctypes.create_string_buffer(buflen)
+        CHK(c_libusb1.libusb_get_string_descriptor_ascii(self.cval,index,buf,buflen))
+        return buf.value
+    def get_strings(self,indices):
+        return _get_strings(self.cval,indices)
+    def claim_interface(self,value):
+        return CHK(c_libusb1.libusb_claim_interface(self.cval,value))
+    def _close(self):
+        if self.cval:
+            c_libusb1.libusb_close(self.cval)
+            self.cval = libusb_device_handle_p()
+
+class HandlePool(_pool.HandlePool):
+    """pool of device_handle objects keyed by (bus number, address)"""
+    def _key(self,dev):
+        if not isinstance(dev,_device):
+            raise ValueError('expected pylibusb.libusb1._device instance')
+        return (dev.bus_number, dev.devnum)
+    def _open(self,dev,key):
+        return device_handle(self, key, open(dev))
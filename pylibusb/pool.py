@@ -0,0 +1,151 @@
+"""Pool of open device handles.
+
+Opening a device costs a syscall or more and every wrapper function
+re-checks the handle type on each call. A pool keeps handles open keyed
+by (bus, device number), hands the same one out again to the next
+borrower, caps the number open at once and closes those that have sat
+idle for too long. The backends subclass HandlePool to say how devices
+are keyed and opened and which pooled handle class to use.
+"""
+import threading
+import time
+
+class PoolExhaustedError(RuntimeError):
+    pass
+
+class pooled_handle(object):
+    """base for the backends' pooled handle classes
+
+    cval is validated once when the handle is opened, so the I/O methods
+    of the subclasses call libusb directly. Use as a context manager to
+    give the handle back to the pool."""
+    def __init__(self,pool,key,cval):
+        self.pool = pool
+        self.key = key
+        self.cval = cval
+        self.users = 0
+        self.last_used = time.time()
+    def __enter__(self):
+        return self
+    def __exit__(self,exc_type,exc_value,traceback):
+        self.release()
+    def release(self):
+        self.pool.release(self)
+    def discard(self):
+        """closes the handle instead of returning it, e.g. after the device
+        went away"""
+        self.pool.discard(self)
+    def _close(self):
+        raise NotImplementedError
+
+class HandlePool(object):
+    def __init__(self,max_open=8,idle_timeout=60.0):
+        self.max_open = max_open
+        self.idle_timeout = idle_timeout
+        self.handles = {}
+        # key -> threading.Event set once the open in progress is over;
+        # these count against max_open
+        self.opening = {}
+        self.lock = threading.Lock()
+
+    def _key(self,dev):
+        raise NotImplementedError
+    def key(self,dev):
+        """the (bus, device number) pair dev is pooled under"""
+        return self._key(dev)
+    def _open(self,dev,key):
+        """returns a new pooled_handle for dev"""
+        raise NotImplementedError
+
+    def acquire(self,dev):
+        """returns an open handle for dev, reusing a pooled one if there is
+        one; pair with release() or use it in a with statement
+
+        The device is opened outside the pool lock, so a slow or hung open
+        only holds up the borrowers of the same device."""
+        key = self._key(dev)
+        while True:
+            with self.lock:
+                handle = self.handles.get(key)
+                if handle is not None:
+                    handle.users += 1
+                    return handle
+                opened = self.opening.get(key)
+                if opened is None:
+                    self._evict(time.time())
+                    if len(self.handles)+len(self.opening) >= self.max_open:
+                        raise PoolExhaustedError("all %d pooled handles are in use"%self.max_open)
+                    opened = self.opening[key] = threading.Event()
+                    break
+            # another thread is opening it; take its handle, or try again
+            # if that open failed
+            opened.wait()
+        try:
+            handle = self._open(dev,key)
+        except:
+            with self.lock:
+                if self.opening.get(key) is opened:
+                    del self.opening[key]
+            opened.set()
+            raise
+        with self.lock:
+            handle.users += 1
+            # close() ran meanwhile: the handle stays out of the pool and
+            # is closed on release()
+            if self.opening.get(key) is opened:
+                del self.opening[key]
+                self.handles[key] = handle
+        opened.set()
+        return handle
+
+    def release(self,handle):
+        with self.lock:
+            handle.users -= 1
+            handle.last_used = time.time()
+            # closed by close(borrowed=False) while it was out
+            if handle.users == 0 and self.handles.get(handle.key) is not handle:
+                handle._close()
+
+    def discard(self,handle):
+        with self.lock:
+            if self.handles.get(handle.key) is handle:
+                del self.handles[handle.key]
+            handle._close()
+
+    def _evict_idle(self,now):
+        for h in [h for h in self.handles.itervalues() if h.users == 0]:
+            if now-h.last_used >= self.idle_timeout:
+                del self.handles[h.key]
+                h._close()
+
+    def _evict(self,now):
+        # idle handles past their timeout always go; if still full, the
+        # least recently used idle one makes room
+        self._evict_idle(now)
+        if len(self.handles)+len(self.opening) >= self.max_open:
+            idle = [h for h in self.handles.itervalues() if h.users == 0]
+            if idle:
+                oldest = min(idle, key=lambda h: h.last_used)
+                del self.handles[oldest.key]
+                oldest._close()
+
+    def evict_idle(self):
+        """closes handles idle for longer than idle_timeout"""
+        with self.lock:
+            self._evict_idle(time.time())
+
+    def close(self,borrowed=True):
+        """closes every pooled handle. With borrowed=False, handles still
+        in use (e.g. by a thread stuck in a transfer) are closed when they
+        are released instead of under their user's feet."""
+        with self.lock:
+            for h in self.handles.values():
+                if borrowed or h.users == 0:
+                    h._close()
+            self.handles.clear()
+            self.opening.clear()
+
+    def __enter__(self):
+        return self
+    def __exit__(self,exc_type,exc_value,traceback):
+        self.close()
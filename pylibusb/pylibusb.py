@@ -1,10 +1,19 @@
 import sys
 import ctypes
-
-__all__ = ['USBError','USBNoDataAvailableError','bulk_read','bulk_write',
-           'claim_interface', 'close', 'find_busses','find_devices','get_busses',
-           'get_string_simple', 'init','interrupt_read','interrupt_write','open',
-           'set_configuration','set_debug']
+import threading
+import time
+import Queue
+import pool as _pool
+import strings as _strings
+
+__all__ = ['HandlePool','PoolExhaustedError','USBError','USBNoDataAvailableError','bulk_read','bulk_write',
+           'bulk_readinto','bulk_write_from',
+           'claim_interface', 'close', 'find', 'find_busses','find_devices','get_busses',
+           'get_string_simple', 'get_strings', 'init','interrupt_read','interrupt_readinto',
+           'interrupt_write','interrupt_write_from','open',
+           'set_configuration','set_debug','snapshot','stream_bulk',
+           'enable_instrumentation','disable_instrumentation',
+           'instrumentation_snapshot','reset_instrumentation','dump_instrumentation']
            
 if sys.platform.startswith('linux'):
     __all__.extend(['get_driver_np','detach_kernel_driver_np'])
@@ -22,14 +31,70 @@ class USBError(RuntimeError):
 class USBNoDataAvailableError(USBError):
     pass
 
+PoolExhaustedError = _pool.PoolExhaustedError
+
+# The shared library is only loaded, and its prototypes only declared, on
+# the first call into it; importing pylibusb costs no dlopen().
 if sys.platform.startswith('linux'):
     c_libusb_shared_library = 'libusb-0.1.so.4'
-    c_libusb = ctypes.cdll.LoadLibrary(c_libusb_shared_library)
 elif sys.platform.startswith('win'):
-    c_libusb = ctypes.CDLL(r'C:\WINDOWS\system32\libusb0.dll')
+    c_libusb_shared_library = r'C:\WINDOWS\system32\libusb0.dll'
 elif sys.platform.startswith('darwin'):
     c_libusb_shared_library = '/Library/Frameworks/libusb.framework/Versions/Current/libusb'
-    c_libusb = ctypes.cdll.LoadLibrary(c_libusb_shared_library)
+else:
+    c_libusb_shared_library = None
+
+_probe_result = None
+
+def _probe_library():
+    """Returns the path of the libusb-0.1 library to load, trying the
+    platform default before asking ctypes.util (which may spawn ldconfig).
+    The answer is cached for the life of the process."""
+    global _probe_result
+    if _probe_result is not None:
+        return _probe_result
+    candidates = []
+    if c_libusb_shared_library is not None:
+        candidates.append(c_libusb_shared_library)
+    for candidate in candidates:
+        try:
+            ctypes.CDLL(candidate)
+        except OSError:
+            continue
+        _probe_result = candidate
+        return candidate
+    from ctypes.util import find_library
+    for name in ('usb-0.1', 'usb'):
+        candidate = find_library(name)
+        if candidate is not None:
+            _probe_result = candidate
+            return candidate
+    raise OSError('could not find the libusb-0.1 shared library')
+
+class _LazyLibrary(object):
+    """Stands in for the CDLL until the first attribute access, then loads
+    the library and replaces itself in the module namespace, so the
+    wrappers below pay for the indirection only once."""
+    def __getattr__(self, name):
+        return getattr(_load_library(), name)
+
+def _load_library():
+    global c_libusb, _raw_libusb
+    if not isinstance(c_libusb, _LazyLibrary):
+        return c_libusb
+    lib = ctypes.CDLL(_probe_library())
+    _declare_prototypes(lib)
+    _raw_libusb = lib
+    if _instrumented:
+        c_libusb = _InstrumentedLibrary(lib)
+    else:
+        c_libusb = lib
+    return c_libusb
+
+c_libusb = _LazyLibrary()
+_raw_libusb = None
+_instrumented = False
+_instrumentation = None
 
 #####################################
 # typedefs and defines
@@ -376,6 +441,9 @@ class _device(object):
             result.append(config_descriptor( self.cval.contents.config[i] ))
         return result
     config = property(get_config)
+    def get_snapshot(self):
+        return snapshot(self)
+    snapshot = property(get_snapshot)
 
 class bus(object):
     """wraps pointer to usb_bus structure"""
@@ -399,6 +467,99 @@ class bus(object):
         return result
     devices = property(get_devices)
 
+# descriptor snapshots
+#
+# Immutable copies of a device's whole descriptor tree, read out of the
+# ctypes structures in one pass. They are plain tuples (no per-instance
+# __dict__), so they are small and every field access is a tuple lookup
+# instead of a ctypes dereference.
+
+_endpoint_fields = ('bLength bDescriptorType bEndpointAddress bmAttributes '
+                    'wMaxPacketSize bInterval bRefresh bSynchAddress').split()
+_interface_descriptor_fields = ('bLength bDescriptorType bInterfaceNumber bAlternateSetting '
+                                'bNumEndpoints bInterfaceClass bInterfaceSubClass '
+                                'bInterfaceProtocol iInterface').split()
+_config_fields = ('bLength bDescriptorType wTotalLength bNumInterfaces '
+                  'bConfigurationValue iConfiguration bmAttributes MaxPower').split()
+_device_descriptor_fields = [name for name,ctype in usb_device_descriptor._fields_]
+
+_snapshot_types_built = False
+
+def _build_snapshot_types():
+    """declares the snapshot classes on the first snapshot() call, like the
+    library load: namedtuple() compiles a class each time, which importing
+    pylibusb shouldn't pay for"""
+    global _snapshot_types_built, endpoint_snapshot, interface_descriptor_snapshot
+    global interface_snapshot, config_snapshot, device_snapshot
+    global _get_endpoint, _get_interface_descriptor, _get_config, _get_device_descriptor
+    if _snapshot_types_built:
+        return
+    import collections, operator
+    endpoint_snapshot = collections.namedtuple('endpoint_snapshot', _endpoint_fields)
+    interface_descriptor_snapshot = collections.namedtuple(
+        'interface_descriptor_snapshot', _interface_descriptor_fields+['endpoint'])
+
+    class interface_snapshot(collections.namedtuple('interface_snapshot', ['altsetting'])):
+        __slots__ = ()
+        num_altsetting = property(lambda self: len(self.altsetting))
+
+    config_snapshot = collections.namedtuple('config_snapshot', _config_fields+['interface'])
+
+    class device_snapshot(collections.namedtuple('device_snapshot',
+            ['dirname','filename','devnum']+_device_descriptor_fields+['config'])):
+        """snapshot of a usb_device, with the device descriptor fields inline"""
+        __slots__ = ()
+        descriptor = property(lambda self: self)
+
+    _get_endpoint = operator.attrgetter(*_endpoint_fields)
+    _get_interface_descriptor = operator.attrgetter(*_interface_descriptor_fields)
+    _get_config = operator.attrgetter(*_config_fields)
+    _get_device_descriptor = operator.attrgetter(*_device_descriptor_fields)
+    _snapshot_types_built = True
+
+def _snapshot_config(c):
+    interfaces = []
+    for i in range(c.bNumInterfaces):
+        intf = c.interface[i]
+        altsettings = []
+        for j in range(intf.num_altsetting):
+            alt = intf.altsetting[j]
+            ep = alt.endpoint
+            endpoints = tuple([endpoint_snapshot(*_get_endpoint(ep[k]))
+                               for k in range(alt.bNumEndpoints)])
+            altsettings.append(interface_descriptor_snapshot(
+                *(_get_interface_descriptor(alt)+(endpoints,))))
+        interfaces.append(interface_snapshot(tuple(altsettings)))
+    return config_snapshot(*(_get_config(c)+(tuple(interfaces),)))
+
+_snapshot_cache = {}
+
+def snapshot(dev):
+    """returns the device_snapshot of a _device
+
+    Built on first request and cached until the next find_busses() or
+    find_devices(), which may free the underlying structures."""
+    if not isinstance(dev,_device):
+        raise ValueError('snapshot() must be called with pylibusb._device instance')
+    key = ctypes.addressof(dev.cval.contents)
+    result = _snapshot_cache.get(key)
+    if result is None:
+        _build_snapshot_types()
+        d = dev.cval.contents
+        desc = d.descriptor
+        if d.bus:
+            dirname = d.bus.contents.dirname
+        else:
+            dirname = ''
+        configs = ()
+        if d.config:
+            configs = tuple([_snapshot_config(d.config[i])
+                             for i in range(desc.bNumConfigurations)])
+        result = device_snapshot(*((dirname,d.filename,d.devnum)+
+                                   _get_device_descriptor(desc)+(configs,)))
+        _snapshot_cache[key] = result
+    return result
+
 def _CheckBus(b):
     if bool(b):
         return bus(b)
@@ -413,33 +574,113 @@ def _CheckDevice(b):
     
 #####################################
 # function definitions
-c_libusb.usb_get_busses.restype = usb_bus_p
-c_libusb.usb_open.restype = usb_dev_handle_p
-c_libusb.usb_strerror.restype = ctypes.c_char_p
-
-c_libusb.usb_close.restype = ctypes.c_int
-c_libusb.usb_close.argtypes = [usb_dev_handle_p]
-
-c_libusb.usb_get_string_simple.restype = ctypes.c_int
-c_libusb.usb_get_string_simple.argtypes = [usb_dev_handle_p,
-                                           ctypes.c_int,
-                                           ctypes.c_char_p,
-                                           ctypes.c_int]
-
-c_libusb.usb_bulk_read.argtypes = [usb_dev_handle_p, ctypes.c_int,
-                                        ctypes.c_char_p, ctypes.c_int, ctypes.c_int]
-c_libusb.usb_bulk_write.argtypes = [usb_dev_handle_p, ctypes.c_int,
-                                         ctypes.c_char_p, ctypes.c_int, ctypes.c_int]
-c_libusb.usb_claim_interface.argtypes = [usb_dev_handle_p, ctypes.c_int]
-c_libusb.usb_interrupt_read.argtypes = [usb_dev_handle_p, ctypes.c_int,
+def _declare_prototypes(lib):
+    lib.usb_get_busses.restype = usb_bus_p
+    lib.usb_open.restype = usb_dev_handle_p
+    lib.usb_strerror.restype = ctypes.c_char_p
+
+    lib.usb_close.restype = ctypes.c_int
+    lib.usb_close.argtypes = [usb_dev_handle_p]
+
+    lib.usb_get_string_simple.restype = ctypes.c_int
+    lib.usb_get_string_simple.argtypes = [usb_dev_handle_p,
+                                          ctypes.c_int,
+                                          ctypes.c_char_p,
+                                          ctypes.c_int]
+    lib.usb_get_string.restype = ctypes.c_int
+    lib.usb_get_string.argtypes = [usb_dev_handle_p, ctypes.c_int, ctypes.c_int,
+                                   ctypes.c_char_p, ctypes.c_int]
+    lib.usb_device.restype = usb_device_p
+    lib.usb_device.argtypes = [usb_dev_handle_p]
+
+    lib.usb_bulk_read.argtypes = [usb_dev_handle_p, ctypes.c_int,
+                                  ctypes.c_char_p, ctypes.c_int, ctypes.c_int]
+    lib.usb_bulk_write.argtypes = [usb_dev_handle_p, ctypes.c_int,
+                                   ctypes.c_char_p, ctypes.c_int, ctypes.c_int]
+    lib.usb_claim_interface.argtypes = [usb_dev_handle_p, ctypes.c_int]
+    lib.usb_interrupt_read.argtypes = [usb_dev_handle_p, ctypes.c_int,
+                                       ctypes.c_char_p, ctypes.c_int, ctypes.c_int]
+    lib.usb_interrupt_write.argtypes = [usb_dev_handle_p, ctypes.c_int,
                                         ctypes.c_char_p, ctypes.c_int, ctypes.c_int]
-c_libusb.usb_interrupt_write.argtypes = [usb_dev_handle_p, ctypes.c_int,
-                                         ctypes.c_char_p, ctypes.c_int, ctypes.c_int]
-c_libusb.usb_set_configuration.argtypes = [usb_dev_handle_p, ctypes.c_int]
+    lib.usb_set_configuration.argtypes = [usb_dev_handle_p, ctypes.c_int]
 
 #####################################
 # wrapper
 
+class _Py_buffer(ctypes.Structure):
+    _fields_ = [
+        ('buf',ctypes.c_void_p),
+        ('obj',ctypes.c_void_p),
+        ('len',ctypes.c_ssize_t),
+        ('itemsize',ctypes.c_ssize_t),
+        ('readonly',ctypes.c_int),
+        ('ndim',ctypes.c_int),
+        ('format',ctypes.c_char_p),
+        ('shape',ctypes.c_void_p),
+        ('strides',ctypes.c_void_p),
+        ('suboffsets',ctypes.c_void_p),
+        ('smalltable',ctypes.c_ssize_t*2), # Python 2 only, harmless padding on 3
+        ('internal',ctypes.c_void_p),
+        ('reserved',ctypes.c_void_p*8),
+        ]
+
+PyBUF_SIMPLE = 0
+PyBUF_WRITABLE = 1
+
+class _pinned_buffer(object):
+    """address and length of the memory behind a buffer-protocol object
+
+    The exporter is held (e.g. a bytearray cannot be resized) until
+    release() is called, so the address stays valid for the C call."""
+    def __init__(self,obj,offset,size,writable):
+        self.view = None
+        try:
+            view = _Py_buffer()
+            if writable:
+                flags = PyBUF_WRITABLE
+            else:
+                flags = PyBUF_SIMPLE
+            ctypes.pythonapi.PyObject_GetBuffer(ctypes.py_object(obj),
+                                                ctypes.byref(view),flags)
+            self.view = view
+            address, length = view.buf, view.len
+        except TypeError:
+            # Python 2 types that only implement the old buffer interface
+            if writable:
+                length = len(obj)
+                address = ctypes.addressof(ctypes.c_char.from_buffer(obj))
+            else:
+                address, length = ctypes.c_void_p(), ctypes.c_ssize_t()
+                ctypes.pythonapi.PyObject_AsReadBuffer(ctypes.py_object(obj),
+                                                       ctypes.byref(address),
+                                                       ctypes.byref(length))
+                address, length = address.value, length.value
+        if size is None:
+            size = length-offset
+        if offset < 0 or size < 0 or offset+size > length:
+            self.release()
+            raise ValueError('offset %d and size %d out of range for a buffer of %d bytes'%(
+                offset,size,length))
+        self.obj = obj
+        self.pointer = ctypes.cast(ctypes.c_void_p((address or 0)+offset),ctypes.c_char_p)
+        self.size = size
+    def release(self):
+        if self.view is not None:
+            ctypes.pythonapi.PyBuffer_Release(ctypes.byref(self.view))
+            self.view = None
+
+def _transfer_buffer(func,libusb_handle,endpoint,buf,timeout,offset,size,writable):
+    if not isinstance(libusb_handle,usb_dev_handle_p):
+        raise ValueError("expected instance of usb_dev_handle_p")
+    return _transfer_unchecked(func,libusb_handle,endpoint,buf,timeout,offset,size,writable)
+
+def _transfer_unchecked(func,libusb_handle,endpoint,buf,timeout,offset,size,writable):
+    pinned = _pinned_buffer(buf,offset,size,writable)
+    try:
+        return CHK(func(libusb_handle, endpoint, pinned.pointer, pinned.size, timeout))
+    finally:
+        pinned.release()
+
 def CHK(result):
     if result < 0:
         errstr = c_libusb.usb_strerror()
@@ -462,16 +703,68 @@ def bulk_write(libusb_handle,endpoint,buf,timeout):
     return CHK(c_libusb.usb_bulk_write(libusb_handle, endpoint,
                                     buf, len(buf), timeout))
 
+def bulk_readinto(libusb_handle,endpoint,buf,timeout,offset=0,size=None):
+    """reads into any writable buffer object (bytearray, mmap, ctypes
+    array, ...) starting at offset, without intermediate copies; size
+    defaults to the rest of the buffer. Returns the number of bytes read."""
+    return _transfer_buffer(c_libusb.usb_bulk_read,libusb_handle,endpoint,
+                            buf,timeout,offset,size,True)
+
+def bulk_write_from(libusb_handle,endpoint,buf,timeout,offset=0,size=None):
+    """writes from any buffer object, read-only ones included, without
+    copying it first"""
+    return _transfer_buffer(c_libusb.usb_bulk_write,libusb_handle,endpoint,
+                            buf,timeout,offset,size,False)
+
 def claim_interface(libusb_handle,value):
     if not isinstance(libusb_handle,usb_dev_handle_p):
         raise ValueError("expected instance of usb_dev_handle_p")
     return CHK(c_libusb.usb_claim_interface(libusb_handle, value))
 
+def find(idVendor=None,idProduct=None,serial=None):
+    """yields a _device for every device matching all given criteria
+
+    Walks libusb's bus and device lists and compares the raw descriptor
+    fields, so no wrapper object is built for devices that don't match.
+    Matching a serial number opens the device to read it."""
+    busp = c_libusb.usb_get_busses()
+    while busp:
+        bus_c = busp.contents
+        devp = bus_c.devices
+        while devp:
+            dev_c = devp.contents
+            desc = dev_c.descriptor
+            if ((idVendor is None or desc.idVendor == idVendor) and
+                (idProduct is None or desc.idProduct == idProduct)):
+                if serial is None:
+                    yield _device(devp)
+                elif desc.iSerialNumber and _read_serial(devp,desc.iSerialNumber) == serial:
+                    yield _device(devp)
+            devp = dev_c.next
+        busp = bus_c.next
+
+def _read_serial(devp,index):
+    libusb_handle = c_libusb.usb_open(devp)
+    if not bool(libusb_handle):
+        return None
+    try:
+        buflen = 256
+        buf = ctypes.create_string_buffer(buflen)
+        if c_libusb.usb_get_string_simple(libusb_handle,index,buf,buflen) < 0:
+            return None
+        return buf.value
+    finally:
+        c_libusb.usb_close(libusb_handle)
+
 def find_busses():
+    _snapshot_cache.clear()
     c_libusb.usb_find_busses()
 
 def find_devices():
+    _snapshot_cache.clear()
     c_libusb.usb_find_devices()
+    if _string_cache.devices:
+        _prune_string_cache()
     
 def get_busses():
     return _CheckBus(c_libusb.usb_get_busses())
@@ -491,6 +784,16 @@ def interrupt_write(libusb_handle,endpoint,buf,timeout):
     return CHK(c_libusb.usb_interrupt_write(libusb_handle, endpoint,
                                             buf, len(buf), timeout))
 
+def interrupt_readinto(libusb_handle,endpoint,buf,timeout,offset=0,size=None):
+    """like bulk_readinto() for interrupt endpoints"""
+    return _transfer_buffer(c_libusb.usb_interrupt_read,libusb_handle,endpoint,
+                            buf,timeout,offset,size,True)
+
+def interrupt_write_from(libusb_handle,endpoint,buf,timeout,offset=0,size=None):
+    """like bulk_write_from() for interrupt endpoints"""
+    return _transfer_buffer(c_libusb.usb_interrupt_write,libusb_handle,endpoint,
+                            buf,timeout,offset,size,False)
+
 def open(dev):
     if not isinstance(dev,_device):
         raise ValueError('open() must be called with pylibusb._device instance')
@@ -513,6 +816,48 @@ def get_string_simple(libusb_handle,index):
                                        index,buf,buflen))
     return buf.value
 
+# string descriptors, cached per device until it goes away
+
+_string_cache = _strings.StringCache()
+
+def _string_key(devp):
+    d = devp.contents
+    if d.bus:
+        return (d.bus.contents.dirname, d.devnum, d.descriptor.bcdDevice)
+    return (None, d.devnum, d.descriptor.bcdDevice)
+
+def _prune_string_cache():
+    keys = set()
+    busp = c_libusb.usb_get_busses()
+    while busp:
+        devp = busp.contents.devices
+        while devp:
+            keys.add(_string_key(devp))
+            devp = devp.contents.next
+        busp = busp.contents.next
+    _string_cache.prune(keys)
+
+def _get_strings(libusb_handle,indices):
+    buflen = 255
+    buf = ctypes.create_string_buffer(buflen)
+    def get_descriptor(index,langid):
+        n = CHK(c_libusb.usb_get_string(libusb_handle,index,langid,buf,buflen))
+        return buf.raw[:n]
+    key = _string_key(c_libusb.usb_device(libusb_handle))
+    return _strings.get_strings(_string_cache,key,get_descriptor,indices)
+
+def get_strings(libusb_handle,indices):
+    """returns the string descriptors indices as a list, None for index 0
+    and malformed ones; raises USBError like get_string_simple() when a
+    read fails
+
+    The LANGID table is read once for all of them, and strings already
+    read from the same device are answered from a cache that the next
+    find_devices() drops for devices no longer attached."""
+    if not isinstance(libusb_handle,usb_dev_handle_p):
+        raise ValueError("expected instance of usb_dev_handle_p")
+    return _get_strings(libusb_handle,indices)
+
 def set_configuration(libusb_handle,value):
     if not isinstance(libusb_handle,usb_dev_handle_p):
         raise ValueError("expected instance of usb_dev_handle_p")
@@ -521,6 +866,321 @@ def set_configuration(libusb_handle,value):
 def set_debug(val):
     c_libusb.usb_set_debug(val)
 
+#####################################
+# instrumentation
+#
+# While enabled, c_libusb (and libusb1.c_libusb1, once that backend is
+# loaded) is replaced by a proxy that times every call into the library and
+# counts calls, errors (negative results) and bytes moved. While disabled
+# the wrappers call the CDLL directly and pay nothing.
+
+# control traffic counts on both backends, string reads included
+_byte_functions = frozenset(['usb_bulk_read','usb_bulk_write','usb_interrupt_read',
+                             'usb_interrupt_write','usb_control_msg','usb_get_string',
+                             'usb_get_string_simple','libusb_control_transfer',
+                             'libusb_get_string_descriptor_ascii'])
+
+# functions of other backends switching their libraries to and from the
+# proxy, called with the new state
+_instrumented_backends = []
+HISTOGRAM_BUCKETS = 24 # bucket i holds calls shorter than 2**i us, up to ~8s
+
+class _call_stats(object):
+    __slots__ = ('calls','errors','bytes','total_time','max_time','histogram')
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.bytes = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+        self.histogram = [0]*HISTOGRAM_BUCKETS
+    def as_dict(self):
+        buckets = {}
+        for i, count in enumerate(self.histogram):
+            if count:
+                buckets['<%dus'%(1<<i)] = count
+        return {'calls':self.calls,'errors':self.errors,'bytes':self.bytes,
+                'total_time':self.total_time,'max_time':self.max_time,
+                'mean_time':self.calls and self.total_time/self.calls,
+                'histogram':buckets}
+
+class _Instrumentation(object):
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stats = {}
+    def record(self,name,elapsed,result):
+        bucket = min(int(elapsed*1e6).bit_length(), HISTOGRAM_BUCKETS-1)
+        with self.lock:
+            stats = self.stats.get(name)
+            if stats is None:
+                stats = self.stats[name] = _call_stats()
+            stats.calls += 1
+            stats.total_time += elapsed
+            if elapsed > stats.max_time:
+                stats.max_time = elapsed
+            stats.histogram[bucket] += 1
+            if isinstance(result,(int,long)):
+                if result < 0:
+                    stats.errors += 1
+                elif name in _byte_functions:
+                    stats.bytes += result
+
+if sys.platform.startswith('win'):
+    _clock = time.clock
+else:
+    _clock = time.time
+
+class _InstrumentedLibrary(object):
+    def __init__(self,lib):
+        self._lib = lib
+    def __getattr__(self,name):
+        func = getattr(self._lib,name)
+        if not callable(func):
+            return func
+        def timed(*args):
+            start = _clock()
+            result = func(*args)
+            _instrumentation.record(name, _clock()-start, result)
+            return result
+        timed.__name__ = name
+        # cache on the proxy so the closure is only built once per function
+        setattr(self,name,timed)
+        return timed
+
+def enable_instrumentation():
+    """starts recording per-function counters and latencies"""
+    global c_libusb, _instrumented, _instrumentation
+    if _instrumentation is None:
+        _instrumentation = _Instrumentation()
+    _instrumented = True
+    if _raw_libusb is not None:
+        c_libusb = _InstrumentedLibrary(_raw_libusb)
+    for instrument in _instrumented_backends:
+        instrument(True)
+
+def disable_instrumentation():
+    """stops recording; what was collected stays readable until reset"""
+    global c_libusb, _instrumented
+    _instrumented = False
+    if _raw_libusb is not None:
+        c_libusb = _raw_libusb
+    for instrument in _instrumented_backends:
+        instrument(False)
+
+def instrumentation_snapshot():
+    """returns {function name: {'calls', 'errors', 'bytes', 'total_time',
+    'max_time', 'mean_time', 'histogram'}} with times in seconds"""
+    if _instrumentation is None:
+        return {}
+    with _instrumentation.lock:
+        return dict([(name, stats.as_dict())
+                     for name, stats in _instrumentation.stats.iteritems()])
+
+def reset_instrumentation():
+    if _instrumentation is not None:
+        with _instrumentation.lock:
+            _instrumentation.stats.clear()
+
+def dump_instrumentation(f):
+    """writes instrumentation_snapshot() as JSON to a file object or path"""
+    import json
+    if isinstance(f,basestring):
+        import __builtin__
+        out = __builtin__.open(f,'w')
+        try:
+            json.dump(instrumentation_snapshot(),out,indent=1,sort_keys=True)
+        finally:
+            out.close()
+    else:
+        json.dump(instrumentation_snapshot(),f,indent=1,sort_keys=True)
+
+#####################################
+# pooled handles
+
+class device_handle(_pool.pooled_handle):
+    """an open usb_dev_handle* owned by a HandlePool
+
+    Same operations as the module functions of the same names, minus the
+    handle argument and the per-call type check."""
+    def bulk_read(self,endpoint,buf,timeout):
+        return CHK(c_libusb.usb_bulk_read(self.cval, endpoint, buf, len(buf), timeout))
+    def bulk_write(self,endpoint,buf,timeout):
+        return CHK(c_libusb.usb_bulk_write(self.cval, endpoint, buf, len(buf), timeout))
+    def bulk_readinto(self,endpoint,buf,timeout,offset=0,size=None):
+        return _transfer_unchecked(c_libusb.usb_bulk_read,self.cval,endpoint,
+                                   buf,timeout,offset,size,True)
+    def bulk_write_from(self,endpoint,buf,timeout,offset=0,size=None):
+        return _transfer_unchecked(c_libusb.usb_bulk_write,self.cval,endpoint,
+                                   buf,timeout,offset,size,False)
+    def interrupt_read(self,endpoint,buf,timeout):
+        return CHK(c_libusb.usb_interrupt_read(self.cval, endpoint, buf, len(buf), timeout))
+    def interrupt_write(self,endpoint,buf,timeout):
+        return CHK(c_libusb.usb_interrupt_write(self.cval, endpoint, buf, len(buf), timeout))
+    def claim_interface(self,value):
+        return CHK(c_libusb.usb_claim_interface(self.cval, value))
+    def set_configuration(self,value):
+        return CHK(c_libusb.usb_set_configuration(self.cval, value))
+    def get_string_simple(self,index):
+        buflen = 256
+        buf = ctypes.create_string_buffer(buflen)
+        CHK(c_libusb.usb_get_string_simple(self.cval, index, buf, buflen))
+        return buf.value
+    def get_strings(self,indices):
+        return _get_strings(self.cval,indices)
+    def _close(self):
+        if self.cval:
+            c_libusb.usb_close(self.cval)
+            self.cval = usb_dev_handle_p()
+
+class HandlePool(_pool.HandlePool):
+    """pool of device_handle objects keyed by (bus dirname, devnum)"""
+    def _key(self,dev):
+        if not isinstance(dev,_device):
+            raise ValueError('expected pylibusb._device instance')
+        d = dev.cval.contents
+        if d.bus:
+            return (d.bus.contents.dirname, d.devnum)
+        return (None, d.devnum)
+    def _open(self,dev,key):
+        return device_handle(self, key, open(dev))
+
+#####################################
+# streaming reads
+
+class stream_stats(object):
+    """counters of a bulk_stream
+
+    reader_stalls counts reads that had to wait for the consumer to hand
+    a buffer back (processing is the bottleneck); consumer_stalls counts
+    chunks the consumer had to wait for (USB is the bottleneck)."""
+    def __init__(self):
+        self.bytes = 0
+        self.chunks = 0
+        self.reader_stalls = 0
+        self.consumer_stalls = 0
+        self.start = None
+        self.stop = None
+    def get_elapsed(self):
+        if self.start is None:
+            return 0.0
+        if self.stop is None:
+            return time.time()-self.start
+        return self.stop-self.start
+    elapsed = property(get_elapsed)
+    def get_rate(self):
+        elapsed = self.elapsed
+        if not elapsed:
+            return 0.0
+        return self.bytes/elapsed
+    rate = property(get_rate)
+    def as_dict(self):
+        return {'bytes':self.bytes,'chunks':self.chunks,'elapsed':self.elapsed,
+                'rate':self.rate,'reader_stalls':self.reader_stalls,
+                'consumer_stalls':self.consumer_stalls}
+
+class bulk_stream(object):
+    """iterates over chunks read from a bulk endpoint by a background thread
+
+    depth buffers of chunk_size bytes are allocated up front and cycle
+    between the reader thread and the consumer. The reader only issues a
+    new read when a buffer is free, so a slow consumer throttles it
+    instead of growing memory. Each chunk is a memoryview into one of the
+    buffers and stays valid until the next chunk is requested; copy=True
+    yields independent strings instead. Iteration ends after a short read
+    when stop_on_short is set, after total bytes, or on close()."""
+    def __init__(self,libusb_handle,endpoint,chunk_size=16384,depth=4,timeout=1000,
+                 total=None,stop_on_short=False,copy=False):
+        if isinstance(libusb_handle,device_handle):
+            libusb_handle = libusb_handle.cval
+        if not isinstance(libusb_handle,usb_dev_handle_p):
+            raise ValueError("expected instance of usb_dev_handle_p")
+        self.handle = libusb_handle
+        self.endpoint = endpoint
+        self.chunk_size = chunk_size
+        self.timeout = timeout
+        self.total = total
+        self.stop_on_short = stop_on_short
+        self.copy = copy
+        self.stats = stream_stats()
+        self.buffers = [bytearray(chunk_size) for i in range(depth)]
+        self.free = Queue.Queue()
+        self.filled = Queue.Queue()
+        for i in range(depth):
+            self.free.put(i)
+        self.stopping = False
+        self.thread = None
+
+    def _reader(self):
+        remaining = self.total
+        try:
+            while not self.stopping:
+                try:
+                    index = self.free.get_nowait()
+                except Queue.Empty:
+                    self.stats.reader_stalls += 1
+                    index = self.free.get()
+                if index is None:
+                    break
+                size = self.chunk_size
+                if remaining is not None:
+                    size = min(size, remaining)
+                n = _transfer_unchecked(c_libusb.usb_bulk_read,self.handle,self.endpoint,
+                                        self.buffers[index],self.timeout,0,size,True)
+                self.filled.put((index, n, None))
+                if remaining is not None:
+                    remaining -= n
+                    if remaining <= 0:
+                        break
+                if self.stop_on_short and n < size:
+                    break
+        except Exception, error:
+            self.filled.put((None, 0, error))
+            return
+        self.filled.put((None, 0, None))
+
+    def __iter__(self):
+        self.stats.start = time.time()
+        self.thread = threading.Thread(target=self._reader, name='pylibusb-stream')
+        self.thread.daemon = True
+        self.thread.start()
+        index = None
+        try:
+            while True:
+                try:
+                    item = self.filled.get_nowait()
+                except Queue.Empty:
+                    self.stats.consumer_stalls += 1
+                    item = self.filled.get()
+                index, n, error = item
+                if error is not None:
+                    raise error
+                if index is None:
+                    break
+                self.stats.bytes += n
+                self.stats.chunks += 1
+                if self.copy:
+                    yield str(self.buffers[index][:n])
+                else:
+                    yield memoryview(self.buffers[index])[:n]
+                self.free.put(index)
+                index = None
+        finally:
+            self.stats.stop = time.time()
+            if index is not None:
+                self.free.put(index)
+            self.close()
+
+    def close(self):
+        """stops the reader thread after its current read"""
+        self.stopping = True
+        self.free.put(None)
+        if self.thread is not None and self.thread is not threading.current_thread():
+            self.thread.join(self.timeout/1000.0+1.0)
+
+def stream_bulk(libusb_handle,endpoint,chunk_size=16384,depth=4,timeout=1000,**kw):
+    """returns a bulk_stream; see there"""
+    return bulk_stream(libusb_handle,endpoint,chunk_size,depth,timeout,**kw)
+
 # Platform-specific (non-portable) additions
 
 if sys.platform.startswith('linux'):
@@ -0,0 +1,113 @@
+"""String descriptor reads shared by the backends.
+
+get_string_simple() asks the device for its LANGID table (string
+descriptor 0) before every string it reads, so reading manufacturer,
+product and serial number costs six control transfers. The backends'
+get_strings() fetch the table once and then one descriptor per index,
+and keep the results in a StringCache keyed by (bus, devnum, bcdDevice):
+strings don't change while a device stays attached, and a device that is
+unplugged and plugged in again gets a new device number.
+"""
+import threading
+
+USB_DT_STRING = 3
+LANGID_EN_US = 0x0409
+
+def parse_langids(raw):
+    """returns the LANGIDs listed in a raw string descriptor 0"""
+    if len(raw) < 2 or ord(raw[1]) != USB_DT_STRING:
+        return []
+    n = min(ord(raw[0]), len(raw))
+    return [ord(raw[i]) | ord(raw[i+1])<<8 for i in range(2, n-1, 2)]
+
+def decode_string(raw):
+    """returns a raw string descriptor as a byte string, non-ASCII
+    characters replaced by '?' like libusb's get_string_simple"""
+    if len(raw) < 2 or ord(raw[1]) != USB_DT_STRING:
+        return None
+    n = min(ord(raw[0]), len(raw))
+    return raw[2:n].decode('utf-16-le', 'replace').encode('ascii', 'replace')
+
+def read_strings(get_descriptor, indices, result=None):
+    """reads the string descriptors indices into the dict result through
+    get_descriptor(index, langid), which returns the raw descriptor and
+    raises the backend's USBError on failure. Failures propagate, with the
+    strings read before them left in result. Index 0, malformed
+    descriptors and all indices of a device without a LANGID table come
+    back as None; the LANGID table is read once."""
+    if result is None:
+        result = {}
+    langid = None
+    for index in indices:
+        if index in result:
+            continue
+        if not index:
+            result[index] = None
+            continue
+        if langid is None:
+            langids = parse_langids(get_descriptor(0, 0))
+            if not langids:
+                for index in indices:
+                    result[index] = None
+                return result
+            if LANGID_EN_US in langids:
+                langid = LANGID_EN_US
+            else:
+                langid = langids[0]
+        result[index] = decode_string(get_descriptor(index, langid))
+    return result
+
+class StringCache(object):
+    """strings read from each attached device"""
+    def __init__(self):
+        self.devices = {}
+        self.lock = threading.Lock()
+
+    def get(self, key, indices):
+        """returns ({index: string} of the cached indices, missing indices)"""
+        with self.lock:
+            strings = self.devices.get(key)
+            if strings is None:
+                return {}, list(indices)
+            found = {}
+            missing = []
+            for index in indices:
+                if index in strings:
+                    found[index] = strings[index]
+                else:
+                    missing.append(index)
+            return found, missing
+
+    def store(self, key, strings):
+        """adds strings to the entry of key; failed reads (None) are left
+        out so they are tried again next time"""
+        with self.lock:
+            entry = self.devices.setdefault(key, {})
+            for index, string in strings.iteritems():
+                if string is not None:
+                    entry[index] = string
+
+    def prune(self, keys):
+        """forgets every device whose key is not in keys"""
+        with self.lock:
+            for key in [key for key in self.devices if key not in keys]:
+                del self.devices[key]
+
+    def clear(self):
+        with self.lock:
+            self.devices.clear()
+
+def get_strings(cache, key, get_descriptor, indices):
+    """the backends' get_strings(): cached strings for key, reading the
+    missing ones through read_strings(). Returns them in indices order;
+    a failed read raises, after caching what was read before it."""
+    indices = list(indices)
+    found, missing = cache.get(key, indices)
+    if missing:
+        strings = {}
+        try:
+            read_strings(get_descriptor, missing, strings)
+        finally:
+            cache.store(key, strings)
+        found.update(strings)
+    return [found[index] for index in indices]
@@ -0,0 +1,186 @@
+"""Columnar export of the whole libusb-0.1 descriptor tree.
+
+export() walks the bus and device lists once, reading the ctypes
+structures directly, and returns a Topology of five tables: buses,
+devices, configs, interfaces (one row per alternate setting) and
+endpoints. Every table is a set of equally long array.array columns, and
+each row below buses has the row index of its parent in the column named
+after the parent table, e.g. endpoints['interface'].
+
+save() writes the columns as raw little-endian arrays behind a small
+header; load() reads them back. A host with a dozen devices comes to a
+few kilobytes, and snapshots from many hosts can be compared or summed
+column by column. to_numpy() gives NumPy structured arrays, if NumPy is
+installed.
+"""
+import array
+import operator
+import struct
+import sys
+
+import pylibusb as _usb
+
+MAGIC = 'KDTTOPO\x01'
+
+_typecodes = {_usb.uint8: 'B', _usb.uint16: 'H'}
+
+def _columns(structure, names=None):
+    """(name, typecode) for the descriptor fields of a ctypes structure"""
+    return [(name, _typecodes[ctype]) for name, ctype in structure._fields_
+            if ctype in _typecodes and (names is None or name in names)]
+
+_device_columns = _columns(_usb.usb_device_descriptor)
+_config_columns = _columns(_usb.usb_config_descriptor, _usb._config_fields)
+_interface_columns = _columns(_usb.usb_interface_descriptor, _usb._interface_descriptor_fields)
+_endpoint_columns = _columns(_usb.usb_endpoint_descriptor, _usb._endpoint_fields)
+
+SCHEMA = [
+    ('buses', [('number', 'i'), ('location', 'I')]),
+    ('devices', [('bus', 'i'), ('devnum', 'B')]+_device_columns),
+    ('configs', [('device', 'i')]+_config_columns),
+    ('interfaces', [('config', 'i')]+_interface_columns),
+    ('endpoints', [('interface', 'i')]+_endpoint_columns),
+]
+
+class Table(object):
+    """equally long array.array columns, in schema order"""
+    def __init__(self, name, columns):
+        self.name = name
+        self.names = [column for column, typecode in columns]
+        self.columns = dict((column, array.array(typecode)) for column, typecode in columns)
+
+    def __len__(self):
+        if not self.names:
+            return 0
+        return len(self.columns[self.names[0]])
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    def _fill(self, rows):
+        if rows:
+            for name, values in zip(self.names, zip(*rows)):
+                self.columns[name].extend(values)
+
+    def row(self, i):
+        return dict((name, self.columns[name][i]) for name in self.names)
+
+class Topology(object):
+    def __init__(self):
+        self.tables = []
+        for name, columns in SCHEMA:
+            table = Table(name, columns)
+            self.tables.append(table)
+            setattr(self, name, table)
+
+    def save(self, f):
+        """writes the tables to the open binary file f"""
+        f.write(MAGIC)
+        f.write(struct.pack('<H', len(self.tables)))
+        for table in self.tables:
+            f.write(struct.pack('<HI', len(table.names), len(table)))
+            _write_name(f, table.name)
+            for name in table.names:
+                column = table.columns[name]
+                _write_name(f, name)
+                f.write(struct.pack('<cB', column.typecode, column.itemsize))
+                if sys.byteorder == 'big':
+                    column = array.array(column.typecode, column)
+                    column.byteswap()
+                f.write(column.tostring())
+
+    def to_numpy(self):
+        """{table name: NumPy structured array}"""
+        import numpy
+        result = {}
+        for table in self.tables:
+            dtype = [(name, table.columns[name].typecode) for name in table.names]
+            data = numpy.zeros(len(table), dtype=dtype)
+            for name in table.names:
+                data[name] = numpy.frombuffer(table.columns[name], dtype=table.columns[name].typecode)
+            result[table.name] = data
+        return result
+
+def _write_name(f, name):
+    f.write(struct.pack('<B', len(name))+name)
+
+def _read(f, n):
+    data = f.read(n)
+    if len(data) != n:
+        raise ValueError('truncated topology file')
+    return data
+
+def _read_name(f):
+    return _read(f, ord(_read(f, 1)))
+
+def load(f):
+    """reads a Topology written by save() from the open binary file f"""
+    if _read(f, len(MAGIC)) != MAGIC:
+        raise ValueError('not a topology file')
+    topology = Topology()
+    count, = struct.unpack('<H', _read(f, 2))
+    for i in range(count):
+        ncolumns, rows = struct.unpack('<HI', _read(f, 6))
+        table = getattr(topology, _read_name(f), None)
+        if not isinstance(table, Table):
+            raise ValueError('unknown table in topology file')
+        for j in range(ncolumns):
+            name = _read_name(f)
+            typecode, itemsize = struct.unpack('<cB', _read(f, 2))
+            column = array.array(typecode)
+            if column.itemsize != itemsize:
+                raise ValueError('column %s.%s has %d byte items, expected %d'%(
+                    table.name, name, itemsize, column.itemsize))
+            column.fromstring(_read(f, rows*itemsize))
+            if sys.byteorder == 'big':
+                column.byteswap()
+            if name in table.columns:
+                table.columns[name] = column
+    return topology
+
+_get_device = operator.attrgetter(*[name for name, typecode in _device_columns])
+_get_config = operator.attrgetter(*[name for name, typecode in _config_columns])
+_get_interface = operator.attrgetter(*[name for name, typecode in _interface_columns])
+_get_endpoint = operator.attrgetter(*[name for name, typecode in _endpoint_columns])
+
+def _bus_number(dirname):
+    try:
+        return int(dirname)
+    except ValueError:
+        return -1
+
+def export():
+    """returns the Topology of every device libusb currently lists; call
+    find_busses() and find_devices() first"""
+    buses, devices, configs, interfaces, endpoints = [], [], [], [], []
+    busp = _usb.c_libusb.usb_get_busses()
+    while busp:
+        b = busp.contents
+        bus = len(buses)
+        buses.append((_bus_number(b.dirname), b.location))
+        devp = b.devices
+        while devp:
+            d = devp.contents
+            desc = d.descriptor
+            device = len(devices)
+            devices.append((bus, d.devnum)+_get_device(desc))
+            if d.config:
+                for i in range(desc.bNumConfigurations):
+                    c = d.config[i]
+                    config = len(configs)
+                    configs.append((device,)+_get_config(c))
+                    for j in range(c.bNumInterfaces):
+                        intf = c.interface[j]
+                        for k in range(intf.num_altsetting):
+                            alt = intf.altsetting[k]
+                            interface = len(interfaces)
+                            interfaces.append((config,)+_get_interface(alt))
+                            ep = alt.endpoint
+                            for e in range(alt.bNumEndpoints):
+                                endpoints.append((interface,)+_get_endpoint(ep[e]))
+            devp = d.next
+        busp = b.next
+    topology = Topology()
+    for table, rows in zip(topology.tables, (buses, devices, configs, interfaces, endpoints)):
+        table._fill(rows)
+    return topology
@@ -0,0 +1,302 @@
+"""Local query service for kdt.py --serve.
+
+Keeps the table of attached Kindles warm and answers clients on a Unix
+domain stream socket, so tools don't pay for interpreter start-up and a
+full bus scan every time they ask. Requests and responses are JSON
+objects, one per line:
+
+  {"op": "list"}
+      -> {"devices": [{"serial": ..., "model": ..., "password": ...}, ...]}
+  {"op": "lookup", "serials": [...]}
+      -> {"devices": [...]} for the given serials, attached or not
+  {"op": "subscribe"}
+      -> {"devices": [...]}, then {"event": "add" or "remove", "serial": ...,
+         "model": ..., "password": ...} whenever the table changes
+
+An "id" member of a request is copied into its response. Clients may send
+any number of requests without waiting for answers; all requests that
+arrive in one read are answered with one write.
+
+The server is a single thread around poll(). Device changes come from
+other file descriptors handed to watch(), e.g. a uevent socket or the
+pipe of a rescanning thread, so the table needs no locking.
+"""
+import errno, json, os, select, socket
+
+# a client that lets this much output pile up, or sends a request line
+# this long, is disconnected
+MAX_PENDING = 1<<20
+
+def listen(path, backlog=128):
+    """Listening socket at path, only accessible to its owner since the
+    answers contain passwords"""
+    if os.path.exists(path):
+        os.unlink(path)
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    umask = os.umask(0177)
+    try:
+        sock.bind(path)
+    finally:
+        os.umask(umask)
+    sock.listen(backlog)
+    sock.setblocking(False)
+    return sock
+
+def record(serial, model, password):
+    return {'serial': serial, 'model': model, 'password': password}
+
+class Client(object):
+    def __init__(self, sock):
+        self.sock = sock
+        self.inbuf = ''
+        self.outbuf = ''
+        self.subscribed = False
+
+class Server(object):
+    """Device table plus the clients asking about it.
+
+    describe(serials) must return a (serial, model, password) tuple for
+    each serial, in order. lookup(serials) does the same for serials that
+    lookup requests ask about but that are not attached; it defaults to
+    describe. changed(devices), if given, is called with the table after
+    every add(), remove() or update() that modified it."""
+    def __init__(self, sock, describe, changed=None, lookup=None):
+        self.sock = sock
+        self.describe = describe
+        if lookup is None:
+            lookup = describe
+        self.lookup = lookup
+        self.changed = changed
+        self.devices = {}
+        self.generation = 0
+        self.listing = None
+        self.clients = {}
+        self.sources = {}
+        self.poll = select.poll()
+        self.poll.register(sock.fileno(), select.POLLIN)
+        self.running = False
+
+    def watch(self, fd, callback):
+        """Calls callback() from the loop whenever fd is readable"""
+        self.sources[fd] = callback
+        self.poll.register(fd, select.POLLIN)
+
+    # device table
+
+    def add(self, serial):
+        if serial not in self.devices:
+            self._added(self.describe([serial]))
+            self._changed()
+
+    def remove(self, serial):
+        if self._removed(serial):
+            self._changed()
+
+    def update(self, serials):
+        """Makes the table hold exactly serials"""
+        generation = self.generation
+        serials = set(serials)
+        for serial in [serial for serial in self.devices if serial not in serials]:
+            self._removed(serial)
+        new = [serial for serial in serials if serial not in self.devices]
+        if new:
+            self._added(self.describe(new))
+        if self.generation != generation:
+            self._changed()
+
+    def _removed(self, serial):
+        entry = self.devices.pop(serial, None)
+        if entry is not None:
+            self._notify('remove', serial, entry)
+        return entry is not None
+
+    def _added(self, described):
+        for serial, model, password in described:
+            self.devices[serial] = (model, password)
+            self._notify('add', serial, (model, password))
+
+    def _changed(self):
+        if self.changed is not None:
+            self.changed(self.devices)
+
+    def _notify(self, event, serial, entry):
+        self.generation += 1
+        self.listing = None
+        message = record(serial, *entry)
+        message['event'] = event
+        line = json.dumps(message)+'\n'
+        for client in self.clients.values():
+            if client.subscribed:
+                self._send(client, line)
+
+    def _list(self):
+        """the table as a JSON array, encoded once per change"""
+        if self.listing is None:
+            self.listing = json.dumps([record(serial, model, password)
+                                       for serial, (model, password) in sorted(self.devices.iteritems())])
+        return self.listing
+
+    def _lookup(self, serials):
+        serials = [str(serial) for serial in serials]
+        unknown = [serial for serial in serials if serial not in self.devices]
+        described = dict((serial, (model, password))
+                         for serial, model, password in self.lookup(unknown))
+        described.update(self.devices)
+        return [record(serial, *described[serial]) for serial in serials]
+
+    # requests
+
+    def handle(self, client, line):
+        """Returns the response line to one request line"""
+        try:
+            request = json.loads(line)
+            op = request.get('op')
+        except (ValueError, AttributeError):
+            return json.dumps({'error': 'bad request'})+'\n'
+        if op == 'list' or op == 'subscribe':
+            if op == 'subscribe':
+                client.subscribed = True
+            # the common case, spliced together without decoding the listing
+            if 'id' in request:
+                return '{"id": %s, "devices": %s}\n'%(json.dumps(request['id']), self._list())
+            return '{"devices": %s}\n'%self._list()
+        elif op == 'lookup':
+            serials = request.get('serials')
+            if not isinstance(serials, list) or\
+                    not all(isinstance(serial, basestring) for serial in serials):
+                response = {'error': 'lookup needs a list of serials'}
+            else:
+                try:
+                    response = {'devices': self._lookup(serials)}
+                except Exception, error:
+                    response = {'error': 'lookup failed: %s'%error}
+        else:
+            response = {'error': 'unknown op %r'%op}
+        if 'id' in request:
+            response['id'] = request['id']
+        return json.dumps(response)+'\n'
+
+    # event loop
+
+    def run(self):
+        """Serves until stop() is called from a callback"""
+        self.running = True
+        listener = self.sock.fileno()
+        while self.running:
+            try:
+                ready = self.poll.poll()
+            except select.error, error:
+                if error.args[0] == errno.EINTR:
+                    continue
+                raise
+            for fd, events in ready:
+                if fd == listener:
+                    self._accept()
+                elif fd in self.sources:
+                    self.sources[fd]()
+                elif fd in self.clients:
+                    client = self.clients[fd]
+                    if events & select.POLLOUT:
+                        self._flush(client)
+                    if events & (select.POLLIN|select.POLLHUP|select.POLLERR) and fd in self.clients:
+                        self._read(client)
+
+    def stop(self):
+        self.running = False
+
+    def close(self):
+        for client in self.clients.values():
+            self._drop(client)
+        self.sock.close()
+
+    def _accept(self):
+        while True:
+            try:
+                sock, address = self.sock.accept()
+            except socket.error:
+                return # nothing pending, or out of descriptors until a client leaves
+            sock.setblocking(False)
+            self.clients[sock.fileno()] = Client(sock)
+            self.poll.register(sock.fileno(), select.POLLIN)
+
+    def _drop(self, client):
+        fd = client.sock.fileno()
+        self.poll.unregister(fd)
+        del self.clients[fd]
+        client.sock.close()
+
+    def _read(self, client):
+        try:
+            data = client.sock.recv(65536)
+        except socket.error, error:
+            if error.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                return
+            data = ''
+        if not data:
+            self._drop(client)
+            return
+        lines = (client.inbuf+data).split('\n')
+        client.inbuf = lines.pop()
+        if len(client.inbuf) > MAX_PENDING:
+            self._drop(client)
+            return
+        responses = [self.handle(client, line) for line in lines if line.strip()]
+        if responses:
+            self._send(client, ''.join(responses))
+
+    def _send(self, client, data):
+        if client.outbuf:
+            client.outbuf += data
+            if len(client.outbuf) > MAX_PENDING:
+                self._drop(client)
+            return
+        try:
+            sent = client.sock.send(data)
+        except socket.error, error:
+            if error.args[0] not in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                self._drop(client)
+                return
+            sent = 0
+        if sent < len(data):
+            client.outbuf = data[sent:]
+            self.poll.modify(client.sock.fileno(), select.POLLIN|select.POLLOUT)
+
+    def _flush(self, client):
+        try:
+            sent = client.sock.send(client.outbuf)
+        except socket.error, error:
+            if error.args[0] not in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                self._drop(client)
+            return
+        client.outbuf = client.outbuf[sent:]
+        if not client.outbuf:
+            self.poll.modify(client.sock.fileno(), select.POLLIN)
+
+class Connection(object):
+    """Blocking client for a running kdt.py --serve"""
+    def __init__(self, path):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(path)
+        self.file = self.sock.makefile('rb')
+
+    def close(self):
+        self.file.close()
+        self.sock.close()
+
+    def request(self, *requests):
+        """Sends requests in one write and returns their responses"""
+        self.sock.sendall(''.join(json.dumps(request)+'\n' for request in requests))
+        return [self.receive() for request in requests]
+
+    def receive(self):
+        """Next response or event line, None once the server is gone"""
+        line = self.file.readline()
+        if not line:
+            return None
+        return json.loads(line)
+
+    def list(self):
+        return self.request({'op': 'list'})[0]['devices']
+
+    def lookup(self, serials):
+        return self.request({'op': 'lookup', 'serials': list(serials)})[0]['devices']
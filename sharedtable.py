@@ -0,0 +1,175 @@
+"""Shared memory table of attached Kindles for kdt.py --publish.
+
+kdt.py writes the devices it found into a small file, normally on tmpfs,
+that any number of local processes map into memory. Reading the table is
+then a few memory copies: no syscalls, no IPC and no waiting for a scan.
+
+Layout (little-endian):
+
+  header, 64 bytes:  magic "KDTSHM01", version, capacity, slot size,
+                     count, sequence (u64), update time (double)
+  capacity slots:    serial (24 bytes), model (56 bytes), password
+                     (16 bytes), NUL padded
+
+The sequence number works as a seqlock. A writer, holding an exclusive
+flock on the file, makes it odd before it touches the slots and even
+again afterwards; a reader copies
+the slots between two reads of the sequence and retries if they differ
+or are odd. sequence/2 is the generation of the table, so a reader can
+check whether anything changed with one 8 byte read.
+"""
+import fcntl, mmap, os, struct, tempfile, time
+
+MAGIC = 'KDTSHM01'
+VERSION = 1
+HEADER = struct.Struct('<8sIIIIQd')
+HEADER_SIZE = 64
+SEQUENCE = struct.Struct('<Q')
+SEQUENCE_OFFSET = 24
+SLOT = struct.Struct('<24s56s16s')
+
+def defaultPath():
+    base = '/dev/shm'
+    if not os.path.isdir(base):
+        base = tempfile.gettempdir()
+    return os.path.join(base, 'kdt4lin-%d.table'%os.getuid())
+
+class StaleTableError(RuntimeError):
+    """The table stayed mid-update for longer than any update takes,
+    because its writer died in the middle of one"""
+
+def _unpackRows(data, count):
+    rows = []
+    for i in range(count):
+        serial, model, password = SLOT.unpack_from(data, i*SLOT.size)
+        rows.append((serial.rstrip('\0'), model.rstrip('\0') or None, password.rstrip('\0')))
+    return rows
+
+class TableWriter(object):
+    """A writer of a table file. Writers take an exclusive flock on the
+    file for every update, so several kdt.py processes can publish to the
+    same table without tearing it; the latest update wins. The file keeps
+    its inode and its rows across writers, so readers that have it mapped
+    see a new writer's updates."""
+    def __init__(self, path=None, capacity=256):
+        if path is None:
+            path = defaultPath()
+        self.path = path
+        self.capacity = capacity
+        self.size = 0
+        self.map = None
+        # passwords inside: only the owner may read it
+        self.fd = os.open(path, os.O_RDWR|os.O_CREAT, 0600)
+        fcntl.flock(self.fd, fcntl.LOCK_EX)
+        try:
+            self._remap()
+            magic, version, capacity, slot_size, count, sequence, updated = HEADER.unpack_from(self.map, 0)
+            if magic != MAGIC or version != VERSION or slot_size != SLOT.size:
+                self._write([], 0)
+            elif sequence&1:
+                # a writer died mid-update and left slots that can't be
+                # trusted: close the update out with an empty table
+                self._write([], sequence+1)
+            elif capacity != self.capacity:
+                self._write(_unpackRows(self.map[HEADER_SIZE:HEADER_SIZE+count*SLOT.size], count), sequence)
+        finally:
+            fcntl.flock(self.fd, fcntl.LOCK_UN)
+
+    def _remap(self):
+        """Maps the whole file, growing it to capacity first; another
+        writer may have grown it since"""
+        # never shrink the file, readers may have more of it mapped
+        size = max(HEADER_SIZE+self.capacity*SLOT.size, os.fstat(self.fd).st_size)
+        if os.fstat(self.fd).st_size != size:
+            os.ftruncate(self.fd, size)
+        if size != self.size:
+            if self.map is not None:
+                self.map.close()
+            self.map = mmap.mmap(self.fd, size, mmap.MAP_SHARED, mmap.PROT_READ|mmap.PROT_WRITE)
+            self.size = size
+            self.capacity = (size-HEADER_SIZE)//SLOT.size
+
+    def publish(self, rows):
+        """Replaces the table with (serial, model, password) rows; rows
+        beyond capacity are left out"""
+        fcntl.flock(self.fd, fcntl.LOCK_EX)
+        try:
+            self._remap()
+            self._write(rows, SEQUENCE.unpack_from(self.map, SEQUENCE_OFFSET)[0])
+        finally:
+            fcntl.flock(self.fd, fcntl.LOCK_UN)
+
+    def _write(self, rows, sequence):
+        rows = list(rows)[:self.capacity]
+        data = ''.join([SLOT.pack(serial, model or '', password) for serial, model, password in rows])
+        header = HEADER.pack(MAGIC, VERSION, self.capacity, SLOT.size, len(rows),
+                             sequence+1, time.time())
+        # Only slice assignments write to the mapping: struct.pack_into
+        # zeroes its target before filling it in, and a reader could catch
+        # the zeroed sequence. The stores are plain copies, whose order is
+        # kept on x86, where this runs.
+        self._setSequence(sequence+1)
+        self.map[:SEQUENCE_OFFSET] = header[:SEQUENCE_OFFSET]
+        self.map[SEQUENCE_OFFSET+SEQUENCE.size:HEADER.size] = header[SEQUENCE_OFFSET+SEQUENCE.size:]
+        self.map[HEADER_SIZE:HEADER_SIZE+len(data)] = data
+        self._setSequence(sequence+2)
+
+    def _setSequence(self, sequence):
+        self.map[SEQUENCE_OFFSET:SEQUENCE_OFFSET+SEQUENCE.size] = SEQUENCE.pack(sequence)
+
+    def close(self):
+        self.map.close()
+        os.close(self.fd)
+
+class TableReader(object):
+    def __init__(self, path=None):
+        if path is None:
+            path = defaultPath()
+        self.path = path
+        self.map = None
+        self._open()
+
+    def _open(self):
+        if self.map is not None:
+            self.map.close()
+        fd = os.open(self.path, os.O_RDONLY)
+        try:
+            size = os.fstat(fd).st_size
+            if size < HEADER_SIZE:
+                raise ValueError('%s is not a device table'%self.path)
+            self.map = mmap.mmap(fd, size, mmap.MAP_SHARED, mmap.PROT_READ)
+        finally:
+            os.close(fd)
+        if self.map[:len(MAGIC)] != MAGIC:
+            raise ValueError('%s is not a device table'%self.path)
+
+    def close(self):
+        self.map.close()
+
+    def generation(self):
+        """Changes whenever the table does"""
+        return SEQUENCE.unpack_from(self.map, SEQUENCE_OFFSET)[0]//2
+
+    def read(self, timeout=1.0):
+        """Returns (generation, updated, [(serial, model, password), ...])
+        from one consistent snapshot of the table. Raises StaleTableError
+        if there was none for timeout seconds."""
+        deadline = None
+        while True:
+            before = SEQUENCE.unpack_from(self.map, SEQUENCE_OFFSET)[0]
+            if not before&1:
+                magic, version, capacity, slot_size, count, sequence, updated = HEADER.unpack_from(self.map, 0)
+                data = self.map[HEADER_SIZE:HEADER_SIZE+count*slot_size]
+                if SEQUENCE.unpack_from(self.map, SEQUENCE_OFFSET)[0] == before:
+                    if version != VERSION or slot_size != SLOT.size:
+                        raise ValueError('%s has an unknown layout'%self.path)
+                    if HEADER_SIZE+capacity*slot_size <= len(self.map):
+                        return before//2, updated, _unpackRows(data, count)
+                    # a writer with a larger capacity took over the file
+                    self._open()
+                    continue
+            # the clock is only read once a retry is needed
+            if deadline is None:
+                deadline = time.time()+timeout
+            elif time.time() > deadline:
+                raise StaleTableError('%s has been mid-update for %gs'%(self.path, timeout))
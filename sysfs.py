@@ -0,0 +1,60 @@
+"""USB device discovery through sysfs.
+
+The kernel exposes every USB device as a directory under
+/sys/bus/usb/devices with idVendor, idProduct and serial attributes, all
+world readable, so finding Kindles takes a few small file reads and needs
+neither root nor libusb nor a dbus connection. The root is configurable
+so fake trees can be used for testing and benchmarking.
+"""
+import os
+
+KINDLE_VENDOR = 0x1949
+KINDLE_PRODUCT = 0x0004
+
+def readAttribute(sysfs, devpath, name):
+    try:
+        f = open(os.path.join(sysfs, devpath.lstrip('/'), name))
+    except IOError:
+        return None
+    try:
+        return f.read().strip()
+    finally:
+        f.close()
+
+def _matches(path, name, value):
+    try:
+        f = open(os.path.join(path, name))
+    except IOError:
+        return False
+    try:
+        return int(f.read().strip(), 16) == value
+    except ValueError:
+        return False
+    finally:
+        f.close()
+
+def available(sysfs='/sys'):
+    return os.path.isdir(os.path.join(sysfs, 'bus', 'usb', 'devices'))
+
+def findKindles(sysfs='/sys', vendor=KINDLE_VENDOR, product=KINDLE_PRODUCT):
+    """Returns (devpath, serial) for every matching device, devpath being
+    the device directory relative to sysfs as in uevent DEVPATH"""
+    found = []
+    root = os.path.join(sysfs, 'bus', 'usb', 'devices')
+    try:
+        names = os.listdir(root)
+    except OSError:
+        return found
+    prefix = len(os.path.realpath(sysfs))
+    for name in names:
+        # "1-1.2:1.0" style entries are interfaces, "usb1" are root hubs
+        if ':' in name or name.startswith('usb'):
+            continue
+        path = os.path.join(root, name)
+        if not _matches(path, 'idVendor', vendor) or not _matches(path, 'idProduct', product):
+            continue
+        devpath = os.path.realpath(path)[prefix:]
+        serial = readAttribute(sysfs, devpath, 'serial')
+        if serial:
+            found.append((devpath, serial))
+    return found
@@ -0,0 +1,183 @@
+"""Phase tracing for kdt.py --trace.
+
+Code marks its phases with
+
+    with tracing.span('EnumerateDevices', 'udisks'):
+        ...
+
+which costs one global lookup while tracing is off. After start(), every
+span records its wall time and the CPU time of the thread running it.
+Tracer.save() writes the spans as Chrome trace events (open the file in
+chrome://tracing or https://ui.perfetto.dev), one row per thread, and
+Tracer.summary() lists the slowest spans and the total per phase.
+Spans that had not finished when the trace was saved, e.g. a read
+abandoned on a hung device, are written up to that moment and flagged.
+"""
+import os, threading, time
+
+def _loadThreadClock():
+    """Returns a function giving the CPU seconds used by the calling
+    thread, or by the whole process where that can't be had"""
+    try:
+        import ctypes, ctypes.util
+        class timespec(ctypes.Structure):
+            _fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6')
+        clock_gettime = libc.clock_gettime
+        clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER(timespec)]
+    except (ImportError, OSError, AttributeError):
+        return time.clock
+    CLOCK_THREAD_CPUTIME_ID = 3
+    def threadClock():
+        t = timespec()
+        if clock_gettime(CLOCK_THREAD_CPUTIME_ID, ctypes.byref(t)) != 0:
+            return time.clock()
+        return t.tv_sec+t.tv_nsec*1e-9
+    threadClock()
+    return threadClock
+
+class Span(object):
+    __slots__ = ('tracer', 'name', 'category', 'args', 'thread', 'start', 'cpu', 'wall', 'cpu_time')
+    def __init__(self, tracer, name, category, args):
+        self.tracer = tracer
+        self.name = name
+        self.category = category
+        self.args = args
+        self.wall = None
+        self.cpu_time = None
+
+    def __enter__(self):
+        self.thread = threading.current_thread()
+        self.start = time.time()
+        self.cpu = self.tracer.clock()
+        self.tracer._opened(self)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.wall = time.time()-self.start
+        self.cpu_time = self.tracer.clock()-self.cpu
+        if exc_type is not None:
+            self.args['error'] = '%s: %s'%(exc_type.__name__, exc_value)
+        self.tracer._closed(self)
+
+class Tracer(object):
+    def __init__(self, clock=None):
+        if clock is None:
+            clock = _loadThreadClock()
+        self.clock = clock
+        self.origin = time.time()
+        self.lock = threading.Lock()
+        self.spans = []
+        self.running = set()
+
+    def span(self, name, category='kdt', **args):
+        return Span(self, name, category, args)
+
+    def _opened(self, span):
+        with self.lock:
+            self.running.add(span)
+
+    def _closed(self, span):
+        with self.lock:
+            self.running.discard(span)
+            self.spans.append(span)
+
+    def collected(self):
+        """(span, unfinished) for every span so far, in start order"""
+        with self.lock:
+            spans = [(span, False) for span in self.spans]+[(span, True) for span in self.running]
+        spans.sort(key=lambda item: item[0].start)
+        return spans
+
+    def _measure(self, span, unfinished, now):
+        """wall and CPU seconds of span; CPU time is unknown while it runs"""
+        if unfinished:
+            return now-span.start, None
+        return span.wall, span.cpu_time
+
+    def events(self):
+        """The trace as a list of Chrome trace event dicts"""
+        now = time.time()
+        pid = os.getpid()
+        events = [{'name': 'process_name', 'ph': 'M', 'pid': pid, 'tid': 0,
+                   'args': {'name': 'kdt.py'}}]
+        threads = {}
+        for span, unfinished in self.collected():
+            tid = span.thread.ident
+            if tid not in threads:
+                threads[tid] = span.thread.name
+                events.append({'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid,
+                               'args': {'name': span.thread.name}})
+            wall, cpu = self._measure(span, unfinished, now)
+            args = dict(span.args)
+            if cpu is not None:
+                args['cpu_ms'] = round(cpu*1e3, 3)
+            if unfinished:
+                args['unfinished'] = True
+            events.append({'name': span.name, 'cat': span.category, 'ph': 'X', 'pid': pid, 'tid': tid,
+                           'ts': round((span.start-self.origin)*1e6, 1), 'dur': round(wall*1e6, 1),
+                           'args': args})
+        return events
+
+    def save(self, path):
+        import json
+        f = open(path, 'w')
+        try:
+            json.dump({'traceEvents': self.events(), 'displayTimeUnit': 'ms'}, f)
+        finally:
+            f.close()
+
+    def summary(self, count=10):
+        """Text report of the count slowest spans and the time per phase"""
+        now = time.time()
+        measured = []
+        phases = {}
+        for span, unfinished in self.collected():
+            wall, cpu = self._measure(span, unfinished, now)
+            measured.append((wall, cpu, span, unfinished))
+            key = (span.category, span.name)
+            calls, total, total_cpu = phases.get(key, (0, 0.0, 0.0))
+            phases[key] = (calls+1, total+wall, total_cpu+(cpu or 0.0))
+        measured.sort(key=lambda item: -item[0])
+        lines = ["Slowest spans (wall, CPU):"]
+        for wall, cpu, span, unfinished in measured[:count]:
+            if cpu is None:
+                cpu = "?"
+            else:
+                cpu = "%.3fms"%(cpu*1e3)
+            details = " ".join("%s=%s"%item for item in sorted(span.args.items()))
+            if unfinished:
+                details = (details+" unfinished").strip()
+            lines.append("  %10.3fms %10s  %s/%s [%s] %s"%(wall*1e3, cpu, span.category, span.name,
+                                                           span.thread.name, details))
+        lines.append("Phases (calls, total wall, total CPU):")
+        for (category, name), (calls, total, total_cpu) in sorted(phases.items(), key=lambda item: -item[1][1]):
+            lines.append("  %6d %10.3fms %10.3fms  %s/%s"%(calls, total*1e3, total_cpu*1e3, category, name))
+        return "\n".join(lines)+"\n"
+
+class _NullSpan(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+_null = _NullSpan()
+tracer = None
+
+def start():
+    """Starts recording spans and returns the Tracer"""
+    global tracer
+    tracer = Tracer()
+    return tracer
+
+def stop():
+    """Stops recording and returns the Tracer, if there was one"""
+    global tracer
+    result, tracer = tracer, None
+    return result
+
+def span(name, category='kdt', **args):
+    if tracer is None:
+        return _null
+    return tracer.span(name, category, **args)